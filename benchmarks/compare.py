@@ -0,0 +1,73 @@
+'''
+    Compares two results files of benchmarks.run:
+
+        python -m benchmarks.compare benchmarks/results/baseline.json new.json --threshold 0.2
+
+    Exits with 1 when the p50 or p95 latency of a scenario grew, or its throughput
+    dropped, by more than the threshold (a fraction of the baseline).
+'''
+import argparse
+import json
+import sys
+
+METRICS = [
+    ('p50_ms', 1)
+    , ('p95_ms', 1)
+    , ('throughput', -1)
+    , ('peak_memory_bytes', 1)
+    ]
+
+# Reported but not failed on, the allocation peaks are too noisy for a fixed threshold
+INFORMATIVE = ['peak_memory_bytes']
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    '''
+        Relative change of every metric of the scenarios found in both runs.
+        direction is 1 when a higher value is worse and -1 when it is better.
+
+        RETURNS
+        A list of dict with scenario, metric, baseline, current, change and regression
+    '''
+    rows = list()
+    for scenario, result in current['results'].items():
+        base = baseline['results'].get(scenario)
+        if base is None:
+            continue
+        for metric, direction in METRICS:
+            if not base.get(metric) or metric not in result:
+                continue
+            change = result[metric] / base[metric] - 1
+            rows.append({
+                'scenario': scenario,
+                'metric': metric,
+                'baseline': base[metric],
+                'current': result[metric],
+                'change': change,
+                'regression': metric not in INFORMATIVE and change * direction > threshold
+            })
+    return rows
+
+def main(argv: list=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as baseline_file, open(args.current) as current_file:
+        baseline, current = json.load(baseline_file), json.load(current_file)
+
+    if baseline['meta'].get('params') != current['meta'].get('params'):
+        print('--> The runs used different parameters, the numbers may not be comparable')
+
+    rows = compare(baseline, current, args.threshold)
+    for row in rows:
+        flag = 'REGRESSION' if row['regression'] else ''
+        print(f'{row["scenario"]:<40} {row["metric"]:<18} {row["baseline"]:>14.2f} {row["current"]:>14.2f} {row["change"]:>+8.1%} {flag}')
+
+    regressions = [row for row in rows if row['regression']]
+    print(f'{len(regressions)} regressions over {args.threshold:.0%}')
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+CADASTRO_HEADER = [
+    "TP_FUNDO", "CNPJ_FUNDO", "DENOM_SOCIAL", "DT_REG", "DT_CONST", "CD_CVM", "DT_CANCEL", "SIT", "DT_INI_SIT"
+    , "DT_INI_ATIV", "DT_INI_EXERC", "DT_FIM_EXERC", "CLASSE", "DT_INI_CLASSE", "RENTAB_FUNDO", "CONDOM"
+    , "FUNDO_COTAS", "FUNDO_EXCLUSIVO", "TRIB_LPRAZO", "PUBLICO_ALVO", "ENTID_INVEST", "TAXA_PERFM"
+    , "INF_TAXA_PERFM", "TAXA_ADM", "INF_TAXA_ADM", "VL_PATRIM_LIQ", "DT_PATRIM_LIQ", "DIRETOR", "CNPJ_ADMIN"
+    , "ADMIN", "PF_PJ_GESTOR", "CPF_CNPJ_GESTOR", "GESTOR", "CNPJ_AUDITOR", "AUDITOR", "CNPJ_CUSTODIANTE"
+    , "CUSTODIANTE", "CNPJ_CONTROLADOR", "CONTROLADOR", "INVEST_QUALIF", "INVEST_PROF"
+    ]
+
+CLASSES = ['Fundo de Ações', 'Fundo de Renda Fixa', 'Fundo Multimercado', 'Fundo Cambial', 'Fundo da Dívida Externa', '']
+STATUSES = ['EM FUNCIONAMENTO NORMAL', 'CANCELADA', 'FASE PRÉ-OPERACIONAL']
+NAME_WORDS = ['ALFA', 'BETA', 'GAMA', 'ATLÂNTICO', 'IPÊ', 'JACARANDÁ', 'AURORA', 'HORIZONTE', 'PRIME', 'SELEÇÃO'
+    , 'INSTITUCIONAL', 'PREVIDÊNCIA', 'CRÉDITO PRIVADO', 'LONGO PRAZO', 'ESTRATÉGIA', 'ÍNDICE', 'DINÂMICO']
+
+_WEIGHTS_1 = np.array([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+_WEIGHTS_2 = np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+
+def random_cnpjs(rng: np.random.Generator, size: int) -> list:
+    '''
+        Unique, valid CNPJs (root + 0001 + check digits), formatted as in cad_fi.csv.
+
+        RETURNS
+        A list of str
+    '''
+    roots = rng.choice(10 ** 8, size=size, replace=False)
+    digits = np.array([list(f'{root:08d}0001') for root in roots], dtype=np.int64)
+    remainder = (digits @ _WEIGHTS_1) % 11
+    first = np.where(remainder < 2, 0, 11 - remainder)
+    remainder = (np.column_stack([digits, first]) @ _WEIGHTS_2) % 11
+    second = np.where(remainder < 2, 0, 11 - remainder)
+
+    cnpjs = list()
+    for number in np.column_stack([digits, first, second]):
+        number = ''.join(map(str, number))
+        cnpjs.append(f'{number[0:2]}.{number[2:5]}.{number[5:8]}/{number[8:12]}-{number[12:14]}')
+    return cnpjs
+
+def write_cadastro(path: str, funds: int, seed: int=0) -> list:
+    '''
+        Writes a synthetic cad_fi.csv with the columns, separator and encoding of
+        the CVM file. About 2% of the funds appear twice, as funds that changed
+        class do in the real file.
+
+        RETURNS
+        The list of CNPJs in the file
+    '''
+    rng = np.random.default_rng(seed)
+    cnpjs = random_cnpjs(rng, funds)
+    admins = random_cnpjs(rng, 200)
+    gestores = random_cnpjs(rng, 2000)
+
+    rows = pd.DataFrame('', index=range(funds), columns=CADASTRO_HEADER)
+    rows['TP_FUNDO'] = 'FI'
+    rows['CNPJ_FUNDO'] = cnpjs
+    rows['DENOM_SOCIAL'] = [f'FUNDO DE INVESTIMENTO {" ".join(rng.choice(NAME_WORDS, 3))} {pos}' for pos in range(funds)]
+    rows['SIT'] = rng.choice(STATUSES, funds, p=[0.45, 0.5, 0.05])
+    rows['DT_INI_ATIV'] = (np.datetime64('1995-01-01') + rng.integers(0, 10000, funds)).astype(str)
+    rows['CLASSE'] = rng.choice(CLASSES, funds)
+    rows['TAXA_PERFM'] = np.where(rng.random(funds) < 0.3, '20', '')
+    rows['TAXA_ADM'] = np.where(rng.random(funds) < 0.9, np.round(rng.uniform(0, 3, funds), 2).astype(str), '')
+    admin = rng.integers(0, len(admins), funds)
+    rows['CNPJ_ADMIN'] = np.array(admins)[admin]
+    rows['ADMIN'] = [f'ADMINISTRADORA {pos} S.A.' for pos in admin]
+    gestor = rng.integers(0, len(gestores), funds)
+    rows['PF_PJ_GESTOR'] = 'PJ'
+    rows['CPF_CNPJ_GESTOR'] = np.array(gestores)[gestor]
+    rows['GESTOR'] = [f'GESTORA {pos} LTDA' for pos in gestor]
+    rows['INVEST_QUALIF'] = rng.choice(['S', 'N'], funds)
+    rows['INVEST_PROF'] = rng.choice(['S', 'N'], funds, p=[0.1, 0.9])
+
+    duplicates = rows.sample(frac=0.02, random_state=seed).assign(CLASSE='Fundo Multimercado')
+    rows = pd.concat([rows, duplicates]).sort_values('CNPJ_FUNDO', kind='stable')
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    rows.to_csv(path, sep=';', encoding='ISO-8859-1', index=False)
+    return cnpjs
+
+def quote_documents(cnpj: str, start: datetime, end: datetime, rng: np.random.Generator) -> list:
+    '''Daily quotes of a fund on the business days between start and end, as a random walk'''
+    dates = pd.bdate_range(start, end)
+    quota = rng.uniform(1, 10) * np.cumprod(1 + rng.normal(0.0004, 0.006, len(dates)))
+    patrimonio = rng.uniform(1e6, 1e9) * quota / quota[0]
+    captacao = np.round(rng.exponential(1e5, len(dates)), 2)
+    resgate = np.round(rng.exponential(1e5, len(dates)), 2)
+    cotistas = np.maximum(1, rng.integers(10, 50000) + np.cumsum(rng.integers(-5, 6, len(dates))))
+
+    return [{
+        'CNPJ': cnpj,
+        'DATA': day.to_pydatetime(),
+        'VALOR_QUOTA': float(quota[pos]),
+        'VALOR_PATRIMONIAL': float(patrimonio[pos]),
+        'CAPTACAO_DIA': float(captacao[pos]),
+        'RESGATE_DIA': float(resgate[pos]),
+        'COTISTAS': int(cotistas[pos])
+    } for pos, day in enumerate(dates)]
+
+def rollup_documents(quotes: list) -> list:
+    '''
+        Monthly and yearly rollups of the quotes of a fund, computed as
+        br_funds.quote.rollups does but without a query per batch of funds:
+        rebuild_rollups upserts them one by one, which mongomock does in
+        time proportional to the size of the collection.
+
+        RETURNS
+        A list of dict
+    '''
+    from br_funds.quote.rollups import ROLLUP_FIELDS, daily_rows, aggregate_periods, to_documents
+
+    frame = pd.DataFrame(quotes)
+    frame['DATA'] = pd.to_datetime(frame['DATA'])
+    documents = to_documents(aggregate_periods(daily_rows(frame, dict()), 'M'), 'M')
+
+    months = pd.DataFrame(documents, columns=ROLLUP_FIELDS)
+    months = months.assign(DATA=pd.to_datetime(months['FIM'])).drop(columns=['PERIODO', 'INICIO', 'FIM'])
+    return documents + to_documents(aggregate_periods(months, 'Y'), 'Y')
+
+def seed_db(cnpjs: list, quote_funds: int, years: int, seed: int=0, end: datetime=datetime(2024, 12, 31)) -> dict:
+    '''
+        Seeds the connected DB with what the API and the ingestion would store: every
+        fund in cnpjs is saved from the cadastro, the first quote_funds of them get
+        years of daily quotes, their latest quote and their monthly and yearly rollups.
+        Needs an app context of the app whose cadastro and DB are benchmarked.
+
+        RETURNS
+        A dict with the number of documents per collection
+    '''
+    from br_funds.database import connect_to_db
+    from br_funds.funds.cadastro import cadastro
+    from br_funds.funds.sync import cadastro_hash
+    from br_funds.models.fund_model import Fund
+    from br_funds.models.quote_model import Quote, LatestQuote, QuoteRollup
+
+    connect_to_db()
+    # _get_collection would create the indexes before the inserts, which makes
+    # every mongomock insert check the unique ones against the whole collection
+    collections = {document: document._get_db()[document._get_collection_name()] for document in [Fund, Quote, LatestQuote, QuoteRollup]}
+
+    funds = list()
+    for record in cadastro.get(cnpjs):
+        document = Fund(CADASTRO_HASH=cadastro_hash(record), **record).to_mongo().to_dict()
+        document.pop('_id', None)
+        funds.append(document)
+    if funds:
+        collections[Fund].insert_many(funds)
+
+    rng = np.random.default_rng(seed)
+    start = datetime(end.year - years + 1, 1, 1)
+    quotes = collections[Quote]
+    latest = list()
+    rollups = list()
+    total = 0
+    for cnpj in cnpjs[:quote_funds]:
+        documents = quote_documents(cnpj, start, end, rng)
+        rollups.extend(rollup_documents(documents))
+        quotes.insert_many(documents)
+        latest.append(documents[-1])
+        total += len(documents)
+    if latest:
+        collections[LatestQuote].insert_many(latest)
+        collections[QuoteRollup].insert_many(rollups)
+
+    for document in collections:
+        document.ensure_indexes()
+
+    return {'funds': len(funds), 'quotes': total, 'latest_quotes': len(latest), 'rollups': len(rollups)}
@@ -0,0 +1,250 @@
+'''
+    Benchmarks of the API routes and of load_funds_data against a local stand-in
+    of the DB: mongomock by default, or a local mongod with --mongodb-host.
+    The cadastro is a synthetic cad_fi.csv written to --data-dir, nothing is
+    downloaded. Run it from the repository root:
+
+        pip install -r benchmarks/requirements.txt
+        python -m benchmarks.run --output benchmarks/results/baseline.json
+
+    and compare two runs with benchmarks.compare. mongomock scans its collections
+    instead of using indexes, so the routes that query the Quote collection are
+    dominated by it; use a local mongod to measure them against real query plans.
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks.fixtures import write_cadastro, seed_db
+
+PERCENTILES = [50, 90, 95, 99]
+
+class Scenario():
+    '''
+        A benchmarked operation. call receives the iteration number and returns the
+        HTTP status (or None for plain functions); statuses other than expected are
+        counted as errors.
+    '''
+    def __init__(self, name: str, call, iterations: int, expected: int=200) -> None:
+        self.name = name
+        self.call = call
+        self.iterations = iterations
+        self.expected = expected
+
+    def run(self, warmup: int, memory_iterations: int) -> dict:
+        '''
+            Times iterations calls after warmup untimed ones, then measures the peak of
+            the Python allocations (tracemalloc) over memory_iterations more calls.
+            The memory pass is separate since tracemalloc slows every allocation down.
+
+            RETURNS
+            A dict with the latency percentiles (ms), throughput (calls/s) and peak memory (bytes)
+        '''
+        for iteration in range(warmup):
+            self.call(iteration)
+
+        timings = list()
+        errors = 0
+        started = time.perf_counter()
+        for iteration in range(self.iterations):
+            start = time.perf_counter()
+            status = self.call(warmup + iteration)
+            timings.append(time.perf_counter() - start)
+            if status is not None and status != self.expected:
+                errors += 1
+        elapsed = time.perf_counter() - started
+
+        tracemalloc.start()
+        for iteration in range(memory_iterations):
+            tracemalloc.reset_peak()
+            self.call(warmup + self.iterations + iteration)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        timings = np.array(timings) * 1000
+        result = {
+            'iterations': self.iterations,
+            'errors': errors,
+            'mean_ms': float(timings.mean()),
+            'min_ms': float(timings.min()),
+            'max_ms': float(timings.max())
+        }
+        for percentile, value in zip(PERCENTILES, np.percentile(timings, PERCENTILES)):
+            result[f'p{percentile}_ms'] = float(value)
+        result['throughput'] = self.iterations / elapsed
+        result['peak_memory_bytes'] = peak
+
+        return result
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def max_rss_bytes() -> int:
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+def build_scenarios(app, cnpjs: list, args) -> list:
+    '''The scenarios of the run, CNPJs are picked at random but with a fixed seed'''
+    from br_funds.funds.load_funds import load_funds_data
+
+    client = app.test_client()
+    rng = random.Random(args.seed)
+    saved = cnpjs[:args.db_funds]
+    quoted = cnpjs[:args.quote_funds]
+    # Funds in the cadastro but not in the DB, each POST /funds/ adds a new batch of them
+    unsaved = cnpjs[args.db_funds:]
+    numbers = {cnpj: ''.join(char for char in cnpj if char.isdigit()) for cnpj in cnpjs}
+
+    def status(resp) -> int:
+        # Streamed bodies are only generated when read
+        resp.get_data()
+        return resp.status_code
+
+    def get(path: str, **kwargs):
+        return lambda iteration: status(client.get(path.format(**{key: value() for key, value in kwargs.items()})))
+
+    def post(path: str, body):
+        return lambda iteration: status(client.post(path, json=body(iteration)))
+
+    def add_batch(iteration: int) -> dict:
+        start = iteration * args.batch
+        return {'cnpjs': unsaved[start:start + args.batch]}
+
+    quote = lambda: numbers[rng.choice(quoted)]
+    iterations = args.iterations
+    heavy = max(1, iterations // 5)
+    # add_funds never adds the same fund twice, it can only run while there are unsaved funds
+    add_iterations = min(iterations, len(unsaved) // args.batch - args.warmup - args.memory_iterations)
+
+    scenarios = [
+        Scenario('GET /funds/ (all)', get('/funds/'), heavy)
+        , Scenario('GET /funds/?limit=1000', get('/funds/?limit=1000'), iterations)
+        , Scenario('GET /funds/?stream=json', get('/funds/?stream=json'), heavy)
+        , Scenario('GET /funds/?STATUS=...&fields=...', get('/funds/?STATUS=CANCELADA&limit=1000&fields=CNPJ,NOME,GESTOR'), iterations)
+        , Scenario('GET /funds/<cnpj>', get('/funds/{cnpj}', cnpj=lambda: numbers[rng.choice(saved)]), iterations)
+        , Scenario('POST /funds/?mode=bulk', post('/funds/?mode=bulk', lambda iteration: {'cnpjs': rng.sample(saved, args.batch)}), iterations)
+        , Scenario('GET /funds/<cnpj>/quote/', get('/funds/{cnpj}/quote/', cnpj=quote), iterations)
+        , Scenario('POST /quotes/latest', post('/quotes/latest', lambda iteration: {'cnpjs': rng.sample(quoted, min(len(quoted), 100))}), iterations)
+        , Scenario('GET /funds/<cnpj>/quotes', get('/funds/{cnpj}/quotes', cnpj=quote), heavy)
+        , Scenario('GET /funds/<cnpj>/quotes (1 year)', get('/funds/{cnpj}/quotes?from=2024-01-01', cnpj=quote), iterations)
+        , Scenario('GET /funds/<cnpj>/quotes?format=csv', get('/funds/{cnpj}/quotes?format=csv', cnpj=quote), heavy)
+        , Scenario('GET /funds/<cnpj>/quotes/monthly', get('/funds/{cnpj}/quotes/monthly', cnpj=quote), iterations)
+        , Scenario('GET /funds/<cnpj>/performance', get('/funds/{cnpj}/performance', cnpj=quote), heavy)
+        , Scenario('load_funds_data', lambda iteration: load_funds_data(rng.sample(cnpjs, args.batch)) and None, iterations)
+        ]
+    if add_iterations > 0:
+        scenarios.append(Scenario('POST /funds/', post('/funds/', add_batch), add_iterations, expected=201))
+
+    return scenarios
+
+def main(argv: list=None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--funds', type=int, default=30000, help='funds in the synthetic cadastro')
+    parser.add_argument('--db-funds', type=int, default=5000, help='funds saved in the DB, the rest are added by POST /funds/')
+    parser.add_argument('--quote-funds', type=int, default=300, help='funds with daily quotes')
+    parser.add_argument('--years', type=int, default=10, help='years of daily quotes')
+    parser.add_argument('--iterations', type=int, default=50, help='timed calls per scenario, the heaviest ones run a fifth of it')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--memory-iterations', type=int, default=3)
+    parser.add_argument('--batch', type=int, default=20, help='CNPJs per POST /funds/ and load_funds_data call')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache', action='store_true', help='keep the response cache on, by default every request reaches the DB')
+    parser.add_argument('--mongodb-host', default=None, help='local mongod to use instead of mongomock, its benchmark DB is dropped')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'br_funds_benchmarks'))
+    parser.add_argument('--only', default=None, help='run only the scenarios whose name contains this text')
+    parser.add_argument('--output', default=None, help='JSON file for the results, printed to stdout when not given')
+    args = parser.parse_args(argv)
+
+    if not 0 < args.quote_funds <= args.db_funds <= args.funds:
+        parser.error('expected 0 < --quote-funds <= --db-funds <= --funds')
+
+    cadastro_path = os.path.join(args.data_dir, f'cad_fi_{args.funds}_{args.seed}.csv')
+    os.makedirs(args.data_dir, exist_ok=True)
+    # The settings are read from the environment when br_funds is imported
+    os.environ.update({
+        'CADASTRO_LOCAL_PATH': cadastro_path,
+        'CADASTRO_SNAPSHOT_PATH': os.path.join(args.data_dir, f'cad_fi_{args.funds}_{args.seed}.arrow'),
+        'MONGODB_HOST': args.mongodb_host or 'mongodb://localhost',
+        'MONGODB_DB': 'br_funds_benchmarks',
+        'CACHE_MAX_ENTRIES': os.environ.get('CACHE_MAX_ENTRIES', '10000') if args.cache else '0'
+    })
+    os.environ.pop('SNAPSHOT_DIR', None)
+
+    from br_funds import create_app
+    from br_funds.database import db, get_db
+    from br_funds.funds.cadastro import build_records, cadastro
+    from mongoengine import get_connection
+
+    app = create_app()
+    if not args.mongodb_host:
+        import mongomock
+        db.config['mongo_client_class'] = mongomock.MongoClient
+
+    cnpjs = write_cadastro(cadastro_path, args.funds, args.seed)
+    results = dict()
+    with app.app_context(), contextlib.redirect_stdout(io.StringIO()) as app_output:
+        get_db()
+        get_connection().drop_database('br_funds_benchmarks')
+
+        cadastro.refresh(force=True)
+        started = time.perf_counter()
+        seeded = seed_db(cnpjs[:args.db_funds], args.quote_funds, args.years, args.seed)
+        print(f'Seeded {seeded} in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+
+        scenarios = build_scenarios(app, cnpjs, args)
+        scenarios.append(Scenario('build_records (cad_fi.csv)', lambda iteration: build_records(cadastro_path) and None, max(1, args.iterations // 10)))
+        for scenario in scenarios:
+            if args.only and args.only not in scenario.name:
+                continue
+            results[scenario.name] = scenario.run(args.warmup, args.memory_iterations)
+            app_output.seek(0)
+            app_output.truncate()
+            print(f'{scenario.name}: p50 {results[scenario.name]["p50_ms"]:.2f}ms'
+                f' p99 {results[scenario.name]["p99_ms"]:.2f}ms {results[scenario.name]["throughput"]:.1f}/s', file=sys.stderr)
+
+    report = {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'db': 'mongod' if args.mongodb_host else 'mongomock',
+            'params': {key: value for key, value in vars(args).items() if key not in ['output', 'data_dir', 'mongodb_host']},
+            'seeded': seeded,
+            'max_rss_bytes': max_rss_bytes()
+        },
+        'results': results
+    }
+
+    body = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as output_file:
+            output_file.write(body)
+    else:
+        print(body)
+
+    return report
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,49 @@
 from flask import Flask
 from .blueprints.root_blueprint import root_blueprint
 from .blueprints.funds_blueprint import funds_blueprint
+from .blueprints.quotes_blueprint import quotes_blueprint
+from .blueprints.jobs_blueprint import jobs_blueprint
+from .funds.cadastro import cadastro
+from .database import db
+from .cache import response_cache
+from .compression import compression
+from .jobs import jobs
+from .metrics import metrics
+from .log import setup_logging
+from .profiling import request_profiler
+from .snapshot import shared_snapshot
+from .quote.ingest import ingest_quotes_command
+from .quote.rollups import rebuild_rollups_command
+from .serializers import FundsJSONProvider
+from .migrations import migrate_types_command
+from .funds.sync import sync_funds_command
 
 def create_app(config_object='br_funds.settings'):
     app = Flask(__name__)
+    app.json = FundsJSONProvider(app)
+    app.config.from_object(config_object)
     app.config['JSON_SORT_KEYS'] = False
+    setup_logging(app)
+
+    db.init_app(app)
+    cadastro.init_app(app)
+    response_cache.init_app(app)
+    shared_snapshot.init_app(app)
+    jobs.init_app(app)
+    # after_request hooks run in reverse order: the profiler report is compressed
+    # and the metrics see the size sent
+    metrics.init_app(app)
+    compression.init_app(app)
+    request_profiler.init_app(app)
 
     app.register_blueprint(root_blueprint)
     app.register_blueprint(funds_blueprint)
+    app.register_blueprint(quotes_blueprint)
+    app.register_blueprint(jobs_blueprint)
+
+    app.cli.add_command(ingest_quotes_command)
+    app.cli.add_command(migrate_types_command)
+    app.cli.add_command(rebuild_rollups_command)
+    app.cli.add_command(sync_funds_command)
 
     return app
\ No newline at end of file
@@ -0,0 +1,49 @@
+import asyncio
+
+from quart import Quart
+
+from br_funds.aio.database import async_db
+from br_funds.aio.routes import async_blueprint
+from br_funds.database import db, get_db
+from br_funds.funds.cadastro import cadastro
+from br_funds.log import setup_logging
+from br_funds.models.fund_model import Fund
+from br_funds.models.quote_model import Quote, LatestQuote, QuoteIngestion, QuoteRollup
+from br_funds.serializers import FundsJSONProvider
+
+def ensure_indexes() -> None:
+    '''The indexes are declared in the mongoengine models, the async client does not create them'''
+    get_db()
+    for document in [Fund, Quote, LatestQuote, QuoteIngestion, QuoteRollup]:
+        document.ensure_indexes()
+
+def create_asgi_app(config_object='br_funds.settings'):
+    '''
+        ASGI variant of create_app serving the same routes with Quart and the
+        asynchronous pymongo client, so a worker holds many in-flight requests
+        on one event loop instead of one thread each. Run it with e.g.
+
+            hypercorn 'br_funds.aio.app:create_asgi_app()' --bind 0.0.0.0:80
+
+        The CLI commands and the response cache are only part of create_app.
+    '''
+    app = Quart(__name__)
+    app.json = FundsJSONProvider(app)
+    app.config.from_object(config_object)
+    setup_logging(app)
+
+    db.init_app(app)
+    async_db.init_app(app)
+    cadastro.init_app(app)
+
+    app.register_blueprint(async_blueprint)
+
+    @app.before_serving
+    async def create_indexes():
+        await asyncio.to_thread(ensure_indexes)
+
+    @app.after_serving
+    async def close_db():
+        await async_db.close()
+
+    return app
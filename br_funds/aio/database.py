@@ -0,0 +1,94 @@
+import logging
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from br_funds.database import (DBParametersError, db_config, key_of, existing_query, plan_upserts
+    , upsert_results, bulk_write_error_details)
+
+logger = logging.getLogger(__name__)
+
+class AsyncDB():
+    '''
+        Process-wide asynchronous MongoDB client of the ASGI app, configured with
+        the same settings as DB.
+
+        The client is created on first use, inside the event loop serving the
+        requests, and its pool is shared by every in-flight request.
+    '''
+    def __init__(self) -> None:
+        self.config = dict()
+        self._client = None
+
+    def init_app(self, app) -> None:
+        self.config = db_config(app.config)
+        self._client = None
+        app.extensions['async_db'] = self
+
+    @property
+    def client(self):
+        if self._client is None:
+            if not self.config:
+                self.config = db_config()
+
+            if not all([self.config['host'], self.config['db']]):
+                raise DBParametersError()
+
+            params = {key: value for key, value in self.config.items() if value is not None and key != 'db'}
+            client_class = params.pop('mongo_client_class', None)
+            if client_class is None:
+                from pymongo import AsyncMongoClient as client_class
+            self._client = client_class(**params)
+
+        return self._client
+
+    def collection(self, document):
+        '''Collection of a mongoengine Document class'''
+        return self.client[self.config['db']][document._get_collection_name()]
+
+    async def ping(self) -> bool:
+        '''
+            Health check: sends a ping to the server.
+
+            RETURNS
+            True when the DB answered
+        '''
+        try:
+            await self.client.admin.command('ping')
+        except (DBParametersError, PyMongoError) as err:
+            logger.warning('DB health check failed: %s', err)
+            return False
+
+        return True
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+        self._client = None
+
+async_db = AsyncDB()
+
+async def bulk_upsert(collection, documents: list, keys: list, batch_size: int=1000, skip_unchanged: bool=True) -> list:
+    '''Asynchronous br_funds.database.bulk_upsert, for a collection of the async client'''
+    results = list()
+    for start in range(0, len(documents), batch_size):
+        results.extend(await _bulk_upsert_batch(collection, documents[start:start + batch_size], keys, skip_unchanged))
+
+    return results
+
+async def _bulk_upsert_batch(collection, documents: list, keys: list, skip_unchanged: bool) -> list:
+    documents = {key_of(document, keys): document for document in documents}
+
+    existing = dict()
+    if skip_unchanged:
+        async for document in collection.find(*existing_query(documents, keys)):
+            existing[key_of(document, keys)] = document
+
+    statuses, operations, operation_keys = plan_upserts(documents, keys, existing)
+
+    upserted, write_errors = dict(), list()
+    if operations:
+        try:
+            upserted = (await collection.bulk_write(operations, ordered=False)).upserted_ids
+        except BulkWriteError as err:
+            upserted, write_errors = bulk_write_error_details(err)
+
+    return upsert_results(statuses, keys, operation_keys, upserted, write_errors)
@@ -0,0 +1,265 @@
+import asyncio
+import logging
+from http import HTTPStatus
+
+from mongoengine import ValidationError
+from pymongo.errors import BulkWriteError
+from quart import Response
+
+from br_funds.aio.database import async_db, bulk_upsert
+from br_funds.aio.serializers import respond, stream_response
+from br_funds.database import DBParametersError
+from br_funds.funds.cadastro import CadastroUnavailableError
+from br_funds.funds.funds import encode_cursor, decode_cursor, fund_projection
+from br_funds.funds.load_funds import load_funds_data
+from br_funds.funds.search import normalize, search_records
+from br_funds.funds.sync import cadastro_hash
+from br_funds.models.fund_model import Fund
+from br_funds.utils import validate_cnpj, validate_cnpjs, InvalidCNPJError, funds_exist
+
+logger = logging.getLogger(__name__)
+
+def _db_error(root: str) -> Response:
+    logger.error('Could not connect to the DB')
+    return respond({
+        'msg': 'Could not connect to the DB',
+        'error': True,
+        'data': None
+    }, HTTPStatus.INTERNAL_SERVER_ERROR, root=root)
+
+async def get_all_funds(limit: int=None, cursor: str=None, filters: dict=None, fields: list=None) -> Response:
+    '''Asynchronous br_funds.funds.funds.get_all_funds'''
+    try:
+        collection = async_db.collection(Fund)
+    except DBParametersError:
+        return _db_error('funds')
+
+    query = dict(filters or dict())
+    if cursor:
+        try:
+            query['_id'] = {'$gt': decode_cursor(cursor)}
+        except ValueError as error:
+            return respond({
+                'msg': f'{error}',
+                'error': True,
+                'data': None
+            }, HTTPStatus.BAD_REQUEST, root='funds')
+
+    all_funds = await collection.find(query, fund_projection(fields)).sort('_id', 1).limit(limit or 0).to_list(None)
+    next_cursor = None
+    if limit and len(all_funds) == limit:
+        next_cursor = encode_cursor(all_funds[-1]['_id'])
+
+    body = {
+        'msg': 'Funds in the DB matching the filters' if filters else 'All funds in the DB',
+        'records': len(all_funds),
+        'data': all_funds
+    }
+    if limit:
+        body['next_cursor'] = next_cursor
+    return respond(body, root='funds')
+
+def stream_all_funds(stream_format: str, filters: dict=None, fields: list=None) -> Response:
+    '''Asynchronous br_funds.funds.funds.stream_all_funds, rows are sent as the cursor yields them'''
+    try:
+        collection = async_db.collection(Fund)
+    except DBParametersError:
+        return _db_error('funds')
+
+    funds = collection.find(filters or dict(), fund_projection(fields)).sort('_id', 1)
+    msg = 'Funds in the DB matching the filters' if filters else 'All funds in the DB'
+    return stream_response({'msg': msg}, funds, root='funds', param_format=stream_format)
+
+async def _load_cadastro(cnpjs: list) -> list:
+    '''The cadastro may need to be downloaded and parsed, that happens in a worker thread'''
+    return await asyncio.to_thread(load_funds_data, cnpjs)
+
+async def add_funds(cnpjs: list) -> Response:
+    '''Asynchronous br_funds.funds.funds.add_funds, the funds are inserted in order with a single insert_many'''
+    if not cnpjs or not isinstance(cnpjs, list):
+        return respond({
+            'msg': f'{InvalidCNPJError(cnpjs)}',
+            'error': True,
+            'data': [f'{cnpjs}']
+        }, HTTPStatus.BAD_REQUEST, root='funds')
+
+    funds_list, errors = validate_cnpjs(cnpjs)
+    errors = [error for error in errors if error]
+    if errors:
+        logger.info('Invalid CNPJ')
+        return respond({
+            'msg': 'One or more CNPJs are invalid',
+            'error': True,
+            'data': errors
+        }, HTTPStatus.BAD_REQUEST, root='funds')
+
+    try:
+        collection = async_db.collection(Fund)
+    except DBParametersError:
+        return _db_error('funds')
+
+    try:
+        funds_info = await _load_cadastro(funds_list)
+    except CadastroUnavailableError as error:
+        logger.error('%s', error)
+        return respond({
+            'msg': f'{error}',
+            'error': True,
+            'data': None
+        }, HTTPStatus.SERVICE_UNAVAILABLE, root='funds')
+
+    msg = funds_exist(funds_list, funds_info)
+    if msg:
+        logger.info('One or more funds were not found')
+        return respond({
+            'msg': 'One or more funds were not found',
+            'error': True,
+            'data': msg
+        }, HTTPStatus.NOT_FOUND, root='funds')
+
+    documents = list()
+    for record in funds_info:
+        document = Fund(CADASTRO_HASH=cadastro_hash(record), **record).to_mongo().to_dict()
+        document.pop('_id', None)
+        documents.append(document)
+
+    try:
+        result = await collection.insert_many(documents, ordered=True)
+    except BulkWriteError as err:
+        # Same as the synchronous version: the funds before the failed one are kept
+        error = err.details['writeErrors'][0]
+        logger.error('%s not saved: %s', funds_info[error['index']]['CNPJ'], error.get('errmsg'))
+        return respond({
+            'msg': f'Error while adding {funds_info[error["index"]]["CNPJ"]} to the DB',
+            'error': True,
+            'data': [error.get('errmsg'), funds_info[error['index']]]
+        }, HTTPStatus.INTERNAL_SERVER_ERROR, root='funds')
+
+    return respond({
+        'msg': 'Records added',
+        'records': len(result.inserted_ids),
+        'data': [str(inserted_id) for inserted_id in result.inserted_ids]
+    }, HTTPStatus.CREATED, root='funds')
+
+async def upsert_funds(cnpjs: list) -> Response:
+    '''Asynchronous br_funds.funds.funds.upsert_funds'''
+    if not cnpjs or not isinstance(cnpjs, list):
+        return respond({
+            'msg': f'{InvalidCNPJError(cnpjs)}',
+            'error': True,
+            'data': [f'{cnpjs}']
+        }, HTTPStatus.BAD_REQUEST, root='funds')
+
+    results = dict()
+    funds_list = list()
+    for cnpj, normalized, error in zip(cnpjs, *validate_cnpjs(cnpjs)):
+        if error:
+            results[str(cnpj)] = {'CNPJ': cnpj, 'status': 'failed', 'msg': error}
+            funds_list.append(str(cnpj))
+        else:
+            funds_list.append(normalized)
+
+    try:
+        collection = async_db.collection(Fund)
+    except DBParametersError:
+        return _db_error('funds')
+
+    try:
+        funds_info = await _load_cadastro([cnpj for cnpj in funds_list if cnpj not in results]) or list()
+    except CadastroUnavailableError as error:
+        logger.error('%s', error)
+        return respond({
+            'msg': f'{error}',
+            'error': True,
+            'data': None
+        }, HTTPStatus.SERVICE_UNAVAILABLE, root='funds')
+
+    found = {fund['CNPJ'] for fund in funds_info}
+    for cnpj in funds_list:
+        if cnpj not in found and cnpj not in results:
+            results[cnpj] = {'CNPJ': cnpj, 'status': 'failed', 'msg': f'Fund with CNPJ {cnpj} not found in the registry'}
+
+    documents = list()
+    for record in funds_info:
+        fund = Fund(CADASTRO_HASH=cadastro_hash(record), **record)
+        try:
+            fund.validate()
+        except ValidationError as error:
+            results[fund.CNPJ] = {'CNPJ': fund.CNPJ, 'status': 'failed', 'msg': f'{error}'}
+            continue
+        document = fund.to_mongo().to_dict()
+        document.pop('_id', None)
+        documents.append(document)
+
+    for result in await bulk_upsert(collection, documents, ['CNPJ']):
+        results[result['CNPJ']] = result
+
+    data = [results[cnpj] for cnpj in dict.fromkeys(funds_list)]
+    summary = {status: 0 for status in ['inserted', 'updated', 'unchanged', 'failed']}
+    for result in data:
+        summary[result['status']] += 1
+
+    return respond({
+        'msg': 'Funds upserted',
+        'records': len(data),
+        'error': summary['failed'] > 0,
+        'summary': summary,
+        'data': data
+    }, HTTPStatus.OK, root='funds')
+
+async def get_fund(cnpj: str) -> Response:
+    '''Asynchronous br_funds.funds.funds.get_fund'''
+    try:
+        fund_cnpj = validate_cnpj([cnpj])[0]
+    except InvalidCNPJError as error:
+        logger.info('Invalid CNPJ')
+        return respond({
+            'msg': f'{error}',
+            'error': True,
+            'data': [cnpj]
+        }, HTTPStatus.BAD_REQUEST, root='fund')
+
+    try:
+        collection = async_db.collection(Fund)
+    except DBParametersError:
+        return _db_error('fund')
+
+    fund = await collection.find_one({'CNPJ': fund_cnpj}, fund_projection())
+    if fund is None:
+        logger.info('Fund %s not found', cnpj)
+        return respond({
+            'msg': f'Fund {cnpj} ({fund_cnpj}) not found',
+            'error': True,
+            'data': [cnpj]
+        }, HTTPStatus.NOT_FOUND, root='fund')
+
+    return respond({
+        'msg': f'Fund: {fund["CNPJ"]}',
+        'records': 1,
+        'data': fund
+    }, root='fund')
+
+async def search_funds(query: str, limit: int) -> Response:
+    '''Asynchronous br_funds.funds.search.search_funds, the index is synced and queried in a worker thread'''
+    if not normalize(query):
+        return respond({
+            'msg': 'The search needs at least one letter or digit in q',
+            'error': True,
+            'data': None
+        }, HTTPStatus.BAD_REQUEST, root='funds')
+
+    try:
+        results = await asyncio.to_thread(search_records, query, limit)
+    except CadastroUnavailableError as error:
+        logger.error('%s', error)
+        return respond({
+            'msg': f'{error}',
+            'error': True,
+            'data': None
+        }, HTTPStatus.SERVICE_UNAVAILABLE, root='funds')
+
+    return respond({
+        'msg': f'Funds matching {query}',
+        'records': len(results),
+        'data': results
+    }, root='funds')
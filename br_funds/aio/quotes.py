@@ -0,0 +1,259 @@
+import asyncio
+import logging
+from http import HTTPStatus
+from typing import List
+
+from quart import Response, current_app
+
+from br_funds.aio.database import async_db
+from br_funds.aio.serializers import respond, stream_response
+from br_funds.database import DBParametersError
+from br_funds.models.quote_model import Quote, LatestQuote, QuoteRollup
+from br_funds.quote.export import ArrowStream, ParquetBuffer, csv_batch
+from br_funds.quote.performance import SERIES_FIELDS, to_quote_series, compute_performance
+from br_funds.quote.quotes import latest_quotes_pipeline, quote_history_query
+from br_funds.quote.rollups import rollups_query
+from br_funds.serializers import MIMETYPES
+from br_funds.utils import InvalidCNPJError, validate_cnpj, validate_cnpjs
+
+logger = logging.getLogger(__name__)
+
+def _db_error(root: str) -> Response:
+    logger.error('Could not connect to the DB')
+    return respond({
+        'msg': 'Could not connect to the DB',
+        'error': True,
+        'data': None
+    }, HTTPStatus.INTERNAL_SERVER_ERROR, root=root)
+
+def _invalid_cnpj(cnpj, err: InvalidCNPJError, root: str) -> Response:
+    logger.info('Invalid CNPJ: %s', cnpj)
+    return respond({
+        'msg': str(err),
+        'error': True,
+        'data': None
+    }, HTTPStatus.BAD_REQUEST, root=root)
+
+async def _find_latest_quotes(cnpjs: List) -> dict:
+    results = dict()
+    async for quote in async_db.collection(LatestQuote).find({'CNPJ': {'$in': cnpjs}}):
+        results[quote['CNPJ']] = quote
+
+    missing = [cnpj for cnpj in cnpjs if cnpj not in results]
+    if missing:
+        async for group in await async_db.collection(Quote).aggregate(latest_quotes_pipeline(missing)):
+            results[group['_id']] = group['quote']
+
+    return results
+
+async def find_latest_quotes(cnpjs: List) -> dict:
+    '''
+        Asynchronous br_funds.quote.quotes.find_latest_quotes. The CNPJs are split
+        in groups of ASYNC_FANOUT_SIZE queried concurrently.
+
+        RETURNS
+        A dict of quotes by CNPJ, funds without quotes are left out
+    '''
+    size = current_app.config['ASYNC_FANOUT_SIZE']
+    groups = await asyncio.gather(*[_find_latest_quotes(cnpjs[start:start + size]) for start in range(0, len(cnpjs), size)])
+
+    results = dict()
+    for group in groups:
+        results.update(group)
+
+    return results
+
+async def get_latest_quotes(cnpjs: List) -> Response:
+    '''Asynchronous br_funds.quote.quotes.get_latest_quotes'''
+    if not cnpjs or not isinstance(cnpjs, list):
+        return respond({
+            'msg': str(InvalidCNPJError(cnpjs)),
+            'error': True,
+            'data': None
+        }, HTTPStatus.BAD_REQUEST, root='quotes')
+
+    entries = list()
+    for cnpj, normalized, error in zip(cnpjs, *validate_cnpjs(cnpjs)):
+        if error:
+            entries.append({'CNPJ': cnpj, 'error': True, 'msg': error, 'data': None})
+        else:
+            entries.append({'CNPJ': normalized})
+
+    try:
+        quotes = await find_latest_quotes(list(dict.fromkeys(entry['CNPJ'] for entry in entries if 'error' not in entry)))
+    except DBParametersError:
+        return _db_error('quotes')
+
+    found = 0
+    for entry in entries:
+        if 'error' in entry:
+            continue
+        quote = quotes.get(entry['CNPJ'])
+        if quote is None:
+            entry.update({'error': True, 'msg': f'Could not find any quotes for the fund {entry["CNPJ"]}', 'data': None})
+        else:
+            entry.update({'error': False, 'data': quote})
+            found += 1
+
+    return respond({
+        'msg': f'Latest quotes for {found} of {len(entries)} funds',
+        'records': found,
+        'error': found < len(entries),
+        'data': entries
+    }, root='quotes')
+
+async def get_latest_quote(cnpj: str) -> Response:
+    '''Asynchronous br_funds.quote.quotes.get_latest_quote'''
+    try:
+        cnpj = validate_cnpj([cnpj])[0]
+    except InvalidCNPJError as err:
+        return _invalid_cnpj(cnpj, err, 'quote')
+
+    try:
+        result = await async_db.collection(LatestQuote).find_one({'CNPJ': cnpj})
+        if result is None:
+            result = await async_db.collection(Quote).find_one({'CNPJ': cnpj}, sort=[('DATA', -1)])
+    except DBParametersError:
+        return _db_error('quote')
+
+    if not result:
+        return respond({
+            'msg': f'Could not find any quotes for the fund {cnpj}',
+            'records': 0,
+            'error': True,
+            'data': None
+        }, HTTPStatus.NOT_FOUND, root='quote')
+
+    return respond({
+        'msg': f'Latest quote for the fund {cnpj}',
+        'records': 1,
+        'data': result
+    }, root='quote')
+
+async def _read_batches(first: list, cursor, size: int):
+    '''Yields first, then the rest of the cursor in lists of up to size rows'''
+    try:
+        batch = first
+        while batch:
+            yield batch
+            batch = await cursor.to_list(size)
+    finally:
+        await cursor.close()
+
+async def _export_csv(batches):
+    header = True
+    async for batch in batches:
+        yield await asyncio.to_thread(csv_batch, batch, header)
+        header = False
+
+async def _export_arrow(batches):
+    stream = ArrowStream()
+    async for batch in batches:
+        yield await asyncio.to_thread(stream.write, batch)
+    yield stream.close()
+
+async def _export_parquet(batches) -> bytes:
+    parquet = ParquetBuffer()
+    async for batch in batches:
+        await asyncio.to_thread(parquet.write, batch)
+    return await asyncio.to_thread(parquet.close)
+
+async def get_quote_history(cnpj: str, from_date: str=None, to_date: str=None, param_format: str='JSON') -> Response:
+    '''
+        Asynchronous br_funds.quote.quotes.get_quote_history. JSON and XML are
+        streamed from the cursor. CSV, Arrow and Parquet read the cursor in batches
+        of QUOTES_EXPORT_BATCH_SIZE and encode each one in a worker thread, so the
+        event loop keeps serving the other requests; CSV and Arrow are streamed as
+        the batches are encoded, Parquet is sent once its footer is written.
+    '''
+    try:
+        cnpj = validate_cnpj([cnpj])[0]
+    except InvalidCNPJError as err:
+        return _invalid_cnpj(cnpj, err, 'quotes')
+
+    try:
+        cursor = async_db.collection(Quote).find(*quote_history_query(cnpj, from_date, to_date)).sort('DATA', 1)
+    except DBParametersError:
+        return _db_error('quotes')
+
+    batch_size = current_app.config['QUOTES_EXPORT_BATCH_SIZE']
+    first = await cursor.to_list(1 if param_format in ['JSON', 'XML'] else batch_size)
+    if not first:
+        await cursor.close()
+        return respond({
+            'msg': f'Could not find any quotes for the fund {cnpj}',
+            'records': 0,
+            'error': True,
+            'data': None
+        }, HTTPStatus.NOT_FOUND, root='quotes')
+
+    if param_format in ['JSON', 'XML']:
+        async def rows():
+            yield first[0]
+            async for row in cursor:
+                yield row
+
+        return stream_response({'msg': f'Quotes for the fund {cnpj}'}, rows(), root='quotes', param_format=param_format)
+
+    batches = _read_batches(first, cursor, batch_size)
+    if param_format == 'PARQUET':
+        return Response(await _export_parquet(batches), mimetype=MIMETYPES[param_format])
+    if param_format == 'CSV':
+        body = _export_csv(batches)
+    else:
+        body = _export_arrow(batches)
+
+    return Response(body, mimetype=MIMETYPES[param_format])
+
+async def get_rollups(cnpj: str, period: str, from_date: str=None, to_date: str=None) -> Response:
+    '''Asynchronous br_funds.quote.rollups.get_rollups'''
+    try:
+        cnpj = validate_cnpj([cnpj])[0]
+    except InvalidCNPJError as err:
+        return _invalid_cnpj(cnpj, err, 'rollups')
+
+    try:
+        results = await async_db.collection(QuoteRollup).find(*rollups_query(cnpj, period, from_date, to_date)).sort('INICIO', 1).to_list(None)
+    except DBParametersError:
+        return _db_error('rollups')
+
+    if not results:
+        return respond({
+            'msg': f'Could not find any {period} rollups for the fund {cnpj}',
+            'records': 0,
+            'error': True,
+            'data': None
+        }, HTTPStatus.NOT_FOUND, root='rollups')
+
+    return respond({
+        'msg': f'{period.capitalize()} rollups for the fund {cnpj}',
+        'records': len(results),
+        'data': results
+    }, root='rollups')
+
+async def get_performance(cnpj: str, from_date: str=None, to_date: str=None, rate: float=0.0) -> Response:
+    '''Asynchronous br_funds.quote.performance.get_performance'''
+    try:
+        cnpj = validate_cnpj([cnpj])[0]
+    except InvalidCNPJError as err:
+        return _invalid_cnpj(cnpj, err, 'performance')
+
+    try:
+        rows = await async_db.collection(Quote).find(*quote_history_query(cnpj, from_date, to_date, SERIES_FIELDS)).sort('DATA', 1).to_list(None)
+    except DBParametersError:
+        return _db_error('performance')
+
+    # pandas and numpy work, done in a worker thread to keep the event loop free
+    series = await asyncio.to_thread(to_quote_series, rows)
+    if series.empty:
+        return respond({
+            'msg': f'Could not find any quotes for the fund {cnpj}',
+            'error': True,
+            'data': None
+        }, HTTPStatus.NOT_FOUND, root='performance')
+
+    return respond({
+        'msg': f'Performance of the fund {cnpj}',
+        'error': False,
+        'data': await asyncio.to_thread(compute_performance, series, rate)
+    }, root='performance')
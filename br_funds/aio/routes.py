@@ -0,0 +1,141 @@
+from http import HTTPStatus
+
+from quart import Blueprint, Response, current_app, request
+
+from br_funds.aio.database import async_db
+from br_funds.aio.funds import add_funds, upsert_funds, get_all_funds, stream_all_funds, get_fund, search_funds
+from br_funds.funds.funds import parse_fund_query
+from br_funds.aio.quotes import get_latest_quote, get_latest_quotes, get_quote_history, get_rollups, get_performance
+from br_funds.aio.serializers import respond
+from br_funds.serializers import negotiate_format
+from br_funds.utils import validate_url_params, parse_float
+
+async_blueprint = Blueprint('async_blueprint', __name__)
+
+def _invalid_params(root: str) -> Response:
+    return respond({
+        'msg': 'Invalid values for the URL parameters',
+        'error': True,
+        'data': None
+    }, HTTPStatus.BAD_REQUEST, root=root)
+
+@async_blueprint.route('/')
+async def root():
+    return respond({
+        'msg': 'This is the root / endpoint... and there is nothing here...',
+        'version': 'v1'
+    })
+
+@async_blueprint.route('/health')
+async def health():
+    db_ok = await async_db.ping()
+    return respond({
+        'msg': 'OK' if db_ok else 'The DB is not available',
+        'error': not db_ok,
+        'data': {'db': db_ok}
+    }, HTTPStatus.OK if db_ok else HTTPStatus.SERVICE_UNAVAILABLE, root='health')
+
+@async_blueprint.route('/funds/', methods=['GET', 'POST'])
+async def route_funds() -> Response:
+    if request.method == 'GET':
+        stream_format = request.args.get('stream', default='', type=str).upper()
+        if stream_format == 'TRUE':
+            stream_format = negotiate_format(formats=('JSON', 'XML', 'NDJSON'), req=request)
+        limit = request.args.get('limit', default=None, type=int)
+        valid_limit = 'limit' not in request.args or (limit is not None and 0 < limit <= current_app.config['FUNDS_PAGE_MAX'])
+        # The streams send every matching fund, limit and cursor only page the plain response
+        paged = 'limit' in request.args or 'cursor' in request.args
+        if not validate_url_params(request.args) or stream_format not in ['', 'JSON', 'XML', 'NDJSON'] or not valid_limit or (stream_format and paged):
+            return _invalid_params('funds')
+
+        try:
+            filters, fields = parse_fund_query(request.args)
+        except ValueError as error:
+            return respond({
+                'msg': f'{error}',
+                'error': True,
+                'data': None
+            }, HTTPStatus.BAD_REQUEST, root='funds')
+
+        if stream_format:
+            return stream_all_funds(stream_format, filters=filters, fields=fields)
+
+        return await get_all_funds(limit=limit, cursor=request.args.get('cursor', default=None, type=str), filters=filters, fields=fields)
+
+    request_data = await request.get_json(silent=True)
+    if not isinstance(request_data, dict) or not isinstance(request_data.get('cnpjs'), list):
+        return respond({
+            'msg': 'The body must be a JSON object with a list of cnpjs',
+            'error': True,
+            'data': None
+        }, HTTPStatus.BAD_REQUEST, root='funds')
+
+    if request.args.get('mode', default='', type=str).lower() == 'bulk':
+        return await upsert_funds(request_data['cnpjs'])
+    return await add_funds(request_data['cnpjs'])
+
+@async_blueprint.route('/funds/search', methods=['GET'])
+async def route_funds_search() -> Response:
+    limit = request.args.get('limit', default=current_app.config['SEARCH_LIMIT'], type=int)
+    if not validate_url_params(request.args) or limit is None or not 0 < limit <= current_app.config['FUNDS_PAGE_MAX']:
+        return _invalid_params('funds')
+
+    return await search_funds(request.args.get('q', default='', type=str), limit)
+
+@async_blueprint.route('/funds/<cnpj>', methods=['GET'])
+async def route_funds_get(cnpj: str) -> Response:
+    if not validate_url_params(request.args):
+        return _invalid_params('fund')
+
+    return await get_fund(cnpj)
+
+@async_blueprint.route('/funds/<cnpj>/quote/', methods=['GET'])
+async def route_funds_get_quote(cnpj: str) -> Response:
+    if not validate_url_params(request.args):
+        return _invalid_params('quote')
+
+    return await get_latest_quote(cnpj)
+
+@async_blueprint.route('/funds/<cnpj>/quotes', methods=['GET'])
+async def route_funds_get_quotes(cnpj: str) -> Response:
+    formats = ('JSON', 'XML', 'CSV', 'ARROW', 'PARQUET')
+    if not validate_url_params(request.args, formats=formats):
+        return _invalid_params('quotes')
+
+    return await get_quote_history(cnpj
+        , from_date=request.args.get('from', default=None, type=str)
+        , to_date=request.args.get('to', default=None, type=str)
+        , param_format=negotiate_format(formats=formats, req=request))
+
+@async_blueprint.route('/funds/<cnpj>/quotes/<any(monthly, yearly):period>', methods=['GET'])
+async def route_funds_get_rollups(cnpj: str, period: str) -> Response:
+    if not validate_url_params(request.args):
+        return _invalid_params('rollups')
+
+    return await get_rollups(cnpj, period
+        , from_date=request.args.get('from', default=None, type=str)
+        , to_date=request.args.get('to', default=None, type=str))
+
+@async_blueprint.route('/funds/<cnpj>/performance', methods=['GET'])
+async def route_funds_get_performance(cnpj: str) -> Response:
+    rate = parse_float(request.args.get('rate', default=current_app.config['RISK_FREE_RATE']))
+    # A rate of -100% or less has no per-period equivalent
+    if not validate_url_params(request.args) or rate is None or rate <= -1:
+        return _invalid_params('performance')
+
+    return await get_performance(cnpj
+        , from_date=request.args.get('from', default=None, type=str)
+        , to_date=request.args.get('to', default=None, type=str)
+        , rate=rate)
+
+@async_blueprint.route('/quotes/latest', methods=['POST'])
+async def route_quotes_latest() -> Response:
+    request_data = await request.get_json(silent=True)
+    if not isinstance(request_data, dict) or 'cnpjs' not in request_data:
+        return respond({
+            'msg': 'The body must be a JSON object with a list of cnpjs',
+            'error': True,
+            'data': None
+        }, HTTPStatus.BAD_REQUEST, root='quotes')
+
+    return await get_latest_quotes(request_data['cnpjs'])
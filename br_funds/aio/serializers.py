@@ -0,0 +1,50 @@
+from http import HTTPStatus
+
+from quart import Response, current_app, request
+
+from br_funds.serializers import MIMETYPES, build_response, negotiate_format, xml_element, xml_tag
+
+def respond(payload: dict, status: int=HTTPStatus.OK, root: str='response', formats=('JSON', 'XML')) -> Response:
+    '''Quart counterpart of br_funds.serializers.respond'''
+    return build_response(current_app, payload, negotiate_format(formats, req=request) or 'JSON', status, root)
+
+async def generate_json(header: dict, rows, dumps):
+    '''generate_json over an async iterable of rows'''
+    records = 0
+    yield dumps(header)[:-1] + (', ' if header else '') + '"data": ['
+    async for row in rows:
+        yield (', ' if records else '') + dumps(row)
+        records += 1
+    yield f'], "records": {records}}}'
+
+async def generate_xml_stream(header: dict, rows, root: str):
+    '''generate_xml_stream over an async iterable of rows'''
+    tag = xml_tag(root)
+    records = 0
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<{tag}>'
+    for key, value in header.items():
+        for chunk in xml_element(key, value):
+            yield chunk
+    yield '<data>'
+    async for row in rows:
+        yield ''.join(xml_element('item', row))
+        records += 1
+    yield f'</data><records>{records}</records></{tag}>'
+
+async def generate_ndjson(rows, dumps):
+    async for row in rows:
+        yield dumps(row) + '\n'
+
+def stream_response(header: dict, rows, root: str='response', param_format: str='JSON') -> Response:
+    '''Streams the rows of an async iterable in param_format (JSON, NDJSON or XML)'''
+    dumps = current_app.json.dumps
+    if param_format == 'XML':
+        body = generate_xml_stream(header, rows, root)
+    elif param_format == 'NDJSON':
+        body = generate_ndjson(rows, dumps)
+    else:
+        body = generate_json(header, rows, dumps)
+
+    resp = Response(body, mimetype=MIMETYPES[param_format])
+    resp.vary.add('Accept')
+    return resp
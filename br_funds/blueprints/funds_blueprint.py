@@ -1,53 +1,167 @@
 from http import HTTPStatus
-import re
-from flask import Blueprint, Response, request, jsonify
+from flask import Blueprint, Response, current_app, request
 
-from br_funds.quote.quotes import get_latest_quote, get_quotes
-from br_funds.utils import convert_to_xml, validate_url_params
-# from ..utils import add_funds, get_all_funds, get_fund
-from ..funds.funds import add_funds, get_all_funds, get_fund
+from br_funds.quote.quotes import get_latest_quote, get_quote_history
+from br_funds.quote.performance import get_performance
+from br_funds.quote.rollups import get_rollups
+from br_funds.utils import validate_url_params, validate_cnpj, InvalidCNPJError, parse_float
+from br_funds.cache import cached, fund_tag, quote_tag, REGISTRY_TAG
+from br_funds.serializers import negotiate_format, respond
+from ..funds.funds import add_funds, upsert_funds, get_all_funds, stream_all_funds, get_fund, parse_fund_query, submit_funds_job
+from ..funds.search import search_funds
 
 funds_blueprint = Blueprint('funds_blueprint', __name__)
 
+def cache_tags(tag) -> list:
+    '''Builds the cache tags function of a route receiving a cnpj'''
+    def tags(cnpj: str, **kwargs) -> list:
+        try:
+            return [tag(validate_cnpj([cnpj])[0])]
+        except InvalidCNPJError:
+            return list()
+    return tags
+
 @funds_blueprint.route('/funds/', methods=['GET', 'POST'])
+@cached('CACHE_TTL_FUND', tags=lambda **kwargs: [REGISTRY_TAG])
 def route_funds() -> Response:
     if request.method == 'GET':
-        resp = get_all_funds()
+        stream_format = request.args.get('stream', default='', type=str).upper()
+        if stream_format == 'TRUE':
+            stream_format = negotiate_format(formats=('JSON', 'XML', 'NDJSON'))
+        limit = request.args.get('limit', default=None, type=int)
+        valid_limit = 'limit' not in request.args or (limit is not None and 0 < limit <= current_app.config['FUNDS_PAGE_MAX'])
+        # The streams send every matching fund, limit and cursor only page the plain response
+        paged = 'limit' in request.args or 'cursor' in request.args
+        if not validate_url_params(request.args) or stream_format not in ['', 'JSON', 'XML', 'NDJSON'] or not valid_limit or (stream_format and paged):
+            return respond({
+                'msg': 'Invalid values for the URL parameters',
+                'error': True,
+                'data': None
+            }, HTTPStatus.BAD_REQUEST, root='funds')
+
+        try:
+            filters, fields = parse_fund_query(request.args)
+        except ValueError as error:
+            return respond({
+                'msg': f'{error}',
+                'error': True,
+                'data': None
+            }, HTTPStatus.BAD_REQUEST, root='funds')
+
+        if stream_format:
+            return stream_all_funds(stream_format, filters=filters, fields=fields)
+
+        resp = get_all_funds(limit=limit, cursor=request.args.get('cursor', default=None, type=str), filters=filters, fields=fields)
         return resp
 
     if request.method == 'POST':
-        request_data = request.get_json()
-        resp = add_funds(request_data['cnpjs'])
+        request_data = request.get_json(silent=True)
+        if not isinstance(request_data, dict) or not isinstance(request_data.get('cnpjs'), list):
+            return respond({
+                'msg': 'The body must be a JSON object with a list of cnpjs',
+                'error': True,
+                'data': None
+            }, HTTPStatus.BAD_REQUEST, root='funds')
+
+        bulk = request.args.get('mode', default='', type=str).lower() == 'bulk'
+        if len(request_data['cnpjs']) > current_app.config['JOBS_THRESHOLD']:
+            return submit_funds_job(request_data['cnpjs'], insert_only=not bulk)
+        if bulk:
+            resp = upsert_funds(request_data['cnpjs'])
+        else:
+            resp = add_funds(request_data['cnpjs'])
         return resp
 
     return None
 
+@funds_blueprint.route('/funds/search', methods=['GET'])
+def route_funds_search() -> Response:
+    limit = request.args.get('limit', default=current_app.config['SEARCH_LIMIT'], type=int)
+    if not validate_url_params(request.args) or limit is None or not 0 < limit <= current_app.config['FUNDS_PAGE_MAX']:
+        return respond({
+            'msg': 'Invalid values for the URL parameters',
+            'error': True,
+            'data': None
+        }, HTTPStatus.BAD_REQUEST, root='funds')
+
+    return search_funds(request.args.get('q', default='', type=str), limit=limit)
+
 @funds_blueprint.route('/funds/<cnpj>', methods=['GET'])
+@cached('CACHE_TTL_FUND', tags=cache_tags(fund_tag))
 def route_funds_get(cnpj: str):
+    if not validate_url_params(request.args):
+        return respond({
+            'msg': 'Invalid values for the URL parameters',
+            'error': True,
+            'data': None
+        }, HTTPStatus.BAD_REQUEST, root='fund')
 
     resp = get_fund(cnpj)
     return resp
 
 @funds_blueprint.route('/funds/<cnpj>/quote/', methods=['GET'])
+@cached('CACHE_TTL_QUOTE', tags=cache_tags(quote_tag))
 def route_funds_get_quote(cnpj: str) -> Response:
     # cnpj = '08.968.733/0001-26'
     # Artesanal 09.625.909/0001-00 09625909000100
     if not validate_url_params(request.args):
-        resp = jsonify({
+        return respond({
             'msg': 'Invalid values for the URL parameters',
             'error': True,
             'data': None
-        })
-        resp.status_code = HTTPStatus.BAD_REQUEST
-        return resp
-
-    print(request.args.get('format', default='JSON', type=str))
-    param_format = request.args.get('format', default='JSON', type=str).upper()
-    print(f'param ---> {param_format}')
+        }, HTTPStatus.BAD_REQUEST, root='quote')
 
     resp = get_latest_quote(cnpj)
+    return resp
+
+@funds_blueprint.route('/funds/<cnpj>/quotes', methods=['GET'])
+@cached('CACHE_TTL_QUOTE', tags=cache_tags(quote_tag), streamed=True)
+def route_funds_get_quotes(cnpj: str) -> Response:
+    formats = ('JSON', 'XML', 'CSV', 'ARROW', 'PARQUET')
+    if not validate_url_params(request.args, formats=formats):
+        return respond({
+            'msg': 'Invalid values for the URL parameters',
+            'error': True,
+            'data': None
+        }, HTTPStatus.BAD_REQUEST, root='quotes')
+
+    param_format = negotiate_format(formats=formats)
+
+    resp = get_quote_history(cnpj
+        , from_date=request.args.get('from', default=None, type=str)
+        , to_date=request.args.get('to', default=None, type=str)
+        , param_format=param_format)
+    return resp
+
+@funds_blueprint.route('/funds/<cnpj>/performance', methods=['GET'])
+@cached('CACHE_TTL_QUOTE', tags=cache_tags(quote_tag))
+def route_funds_get_performance(cnpj: str) -> Response:
+    rate = parse_float(request.args.get('rate', default=current_app.config['RISK_FREE_RATE']))
+    # A rate of -100% or less has no per-period equivalent
+    if not validate_url_params(request.args) or rate is None or rate <= -1:
+        return respond({
+            'msg': 'Invalid values for the URL parameters',
+            'error': True,
+            'data': None
+        }, HTTPStatus.BAD_REQUEST, root='performance')
+
+    resp = get_performance(cnpj
+        , from_date=request.args.get('from', default=None, type=str)
+        , to_date=request.args.get('to', default=None, type=str)
+        , rate=rate)
+    return resp
+
+@funds_blueprint.route('/funds/<cnpj>/quotes/<any(monthly, yearly):period>', methods=['GET'])
+@cached('CACHE_TTL_QUOTE', tags=cache_tags(quote_tag))
+def route_funds_get_rollups(cnpj: str, period: str) -> Response:
+    if not validate_url_params(request.args):
+        return respond({
+            'msg': 'Invalid values for the URL parameters',
+            'error': True,
+            'data': None
+        }, HTTPStatus.BAD_REQUEST, root='rollups')
 
-    if param_format == 'XML':
-        return convert_to_xml(resp)
-    
+    resp = get_rollups(cnpj, period
+        , from_date=request.args.get('from', default=None, type=str)
+        , to_date=request.args.get('to', default=None, type=str))
     return resp
\ No newline at end of file
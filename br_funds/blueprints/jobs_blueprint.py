@@ -0,0 +1,33 @@
+from http import HTTPStatus
+from flask import Blueprint, Response
+
+from br_funds.database import DBParametersError
+from br_funds.jobs import jobs
+from br_funds.serializers import respond
+
+jobs_blueprint = Blueprint('jobs_blueprint', __name__)
+
+@jobs_blueprint.route('/jobs/<job_id>', methods=['GET'])
+def route_jobs_get(job_id: str) -> Response:
+    try:
+        job = jobs.get(job_id)
+    except DBParametersError:
+        return respond({
+            'msg': 'Could not connect to the DB',
+            'error': True,
+            'data': None
+        }, HTTPStatus.INTERNAL_SERVER_ERROR, root='job')
+
+    if job is None:
+        return respond({
+            'msg': f'Job {job_id} not found',
+            'error': True,
+            'data': None
+        }, HTTPStatus.NOT_FOUND, root='job')
+
+    return respond({
+        'msg': f'Job {job_id}: {job["STATUS"]}, {job["PROCESSED"]} of {job["TOTAL"]} processed',
+        'records': len(job['RESULTS']),
+        'error': job['STATUS'] == 'failed',
+        'data': job
+    }, root='job')
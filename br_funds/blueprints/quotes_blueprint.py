@@ -0,0 +1,20 @@
+from http import HTTPStatus
+from flask import Blueprint, Response, request
+
+from br_funds.quote.quotes import get_latest_quotes
+from br_funds.serializers import respond
+
+quotes_blueprint = Blueprint('quotes_blueprint', __name__)
+
+@quotes_blueprint.route('/quotes/latest', methods=['POST'])
+def route_quotes_latest() -> Response:
+    request_data = request.get_json(silent=True)
+    if not isinstance(request_data, dict) or 'cnpjs' not in request_data:
+        return respond({
+            'msg': 'The body must be a JSON object with a list of cnpjs',
+            'error': True,
+            'data': None
+        }, HTTPStatus.BAD_REQUEST, root='quotes')
+
+    resp = get_latest_quotes(request_data['cnpjs'])
+    return resp
\ No newline at end of file
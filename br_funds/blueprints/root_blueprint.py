@@ -1,10 +1,30 @@
-from flask import Blueprint, jsonify
-from bson.objectid import ObjectId
+import os
+from http import HTTPStatus
+from flask import Blueprint, Response, abort
+from ..database import db
+from ..metrics import metrics
+from ..serializers import respond
 
 root_blueprint = Blueprint('root_bluprint', __name__)
 
 @root_blueprint.route('/')
 def root():
-    return jsonify(msg='This is the root / endpoint... and there is nothing here...'
-        , version='v1'
-    )
\ No newline at end of file
+    return respond({
+        'msg': 'This is the root / endpoint... and there is nothing here...',
+        'version': 'v1'
+    })
+
+@root_blueprint.route('/health')
+def health():
+    db_ok = db.ping()
+    return respond({
+        'msg': 'OK' if db_ok else 'The DB is not available',
+        'error': not db_ok,
+        'data': {'db': db_ok}
+    }, HTTPStatus.OK if db_ok else HTTPStatus.SERVICE_UNAVAILABLE, root='health')
+
+@root_blueprint.route('/metrics')
+def metrics_endpoint():
+    if not metrics.enabled:
+        abort(HTTPStatus.NOT_FOUND)
+    return Response(metrics.render(os.getpid()), mimetype='text/plain; version=0.0.4')
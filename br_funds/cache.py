@@ -0,0 +1,297 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from bson.objectid import ObjectId
+from flask import Response, current_app, request
+from pymongo.errors import PyMongoError
+
+from br_funds import settings
+from br_funds.compression import compression
+from br_funds.database import DBParametersError, get_db
+from br_funds.models.cache_model import CacheInvalidation
+from br_funds.serializers import MIMETYPES, negotiate_format
+
+logger = logging.getLogger(__name__)
+
+# Tag of the entries listing the funds, dropped whenever a fund is added or updated
+REGISTRY_TAG = 'funds'
+
+# Invalidations published this long before the last check are read again, so one
+# inserted late or by a process with a slightly behind clock is not missed
+SYNC_GRACE = 5
+
+class CacheEntry():
+    def __init__(self, body: bytes, status: int, mimetype: str, ttl: int, tags: list) -> None:
+        self.body = body
+        self.status = status
+        self.mimetype = mimetype
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.expires_at = time.monotonic() + ttl
+        self.tags = set(tags)
+        self.size = len(body)
+        # Compressed bodies by encoding, added as requests ask for them
+        self.encoded = dict()
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def to_response(self, encoding: str=None) -> Response:
+        '''
+            Builds the response with the body compressed with encoding (when not None),
+            answering 304 when the ETag matches If-None-Match.
+        '''
+        if encoding is None:
+            resp = Response(self.body, status=self.status, mimetype=self.mimetype)
+            resp.set_etag(self.etag)
+        else:
+            resp = Response(self.encoded[encoding], status=self.status, mimetype=self.mimetype)
+            resp.headers['Content-Encoding'] = encoding
+            resp.set_etag(f'{self.etag}-{encoding}')
+            resp.vary.add('Accept-Encoding')
+        resp.vary.add('Accept')
+        resp.cache_control.max_age = max(int(self.expires_at - time.monotonic()), 0)
+        return resp.make_conditional(request)
+
+class ResponseCache():
+    '''
+        In-process LRU cache of serialized responses, bounded by number of
+        entries and total bytes. Entries expire after the TTL of their route and
+        can be dropped earlier by tag (e.g. fund:<cnpj>) when the data changes.
+
+        Invalidations are also published to the CacheInvalidation collection, and
+        lookups apply the ones published by other processes (the other gunicorn
+        workers, flask ingest-quotes, flask sync-funds), checking for them at most
+        every CACHE_SYNC_INTERVAL seconds.
+    '''
+    def __init__(self, max_entries: int=settings.CACHE_MAX_ENTRIES, max_bytes: int=settings.CACHE_MAX_BYTES
+            , sync_interval: float=settings.CACHE_SYNC_INTERVAL) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sync_interval = sync_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._synced_at = 0.0
+        self._since = None
+        # Invalidations already applied, by _id, until they fall out of the grace window
+        self._applied = set()
+
+    def init_app(self, app) -> None:
+        self.max_entries = app.config.get('CACHE_MAX_ENTRIES', self.max_entries)
+        self.max_bytes = app.config.get('CACHE_MAX_BYTES', self.max_bytes)
+        self.sync_interval = app.config.get('CACHE_SYNC_INTERVAL', self.sync_interval)
+        self.clear()
+        app.extensions['cache'] = self
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(self, key: str) -> CacheEntry:
+        self.sync()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expired:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        if entry.size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._size += entry.size
+            self._evict()
+
+    def encode(self, key: str, entry: CacheEntry, encoding: str) -> bytes:
+        '''
+            The body of the entry compressed with encoding. It is compressed by the
+            first request asking for it and kept in the entry, counting in its size.
+
+            RETURNS
+            The compressed body
+        '''
+        body = entry.encoded.get(encoding)
+        if body is not None:
+            return body
+
+        body = compression.compress(entry.body, encoding)
+        with self._lock:
+            if encoding not in entry.encoded:
+                entry.encoded[encoding] = body
+                entry.size += len(body)
+                if self._entries.get(key) is entry:
+                    self._size += len(body)
+                    self._evict()
+        return body
+
+    def invalidate(self, tags: list) -> int:
+        '''
+            Drops every entry with any of the tags, here and, through the
+            CacheInvalidation collection, in every other process.
+
+            RETURNS
+            The number of entries dropped in this process
+        '''
+        tags = set(tags)
+        if not tags:
+            return 0
+
+        try:
+            get_db()
+            result = CacheInvalidation._get_collection().insert_one({'TAGS': sorted(tags), 'CREATED_AT': datetime.utcnow()})
+            self._applied.add(result.inserted_id)
+        except (DBParametersError, PyMongoError) as err:
+            logger.warning('Could not publish the cache invalidation of %d tags: %s', len(tags), err)
+
+        return self._drop(tags)
+
+    def sync(self) -> int:
+        '''
+            Applies the invalidations published by the other processes since the
+            last check, when CACHE_SYNC_INTERVAL has passed. With the cache empty
+            there is nothing to drop and the DB is not queried.
+
+            RETURNS
+            The number of entries dropped
+        '''
+        if time.monotonic() - self._synced_at < self.sync_interval or not self._sync_lock.acquire(blocking=False):
+            return 0
+
+        try:
+            self._synced_at = time.monotonic()
+            started = datetime.now(timezone.utc)
+            since = (self._since or started) - timedelta(seconds=SYNC_GRACE)
+            tags = set()
+            if self._entries:
+                get_db()
+                for invalidation in CacheInvalidation._get_collection().find({'_id': {'$gt': ObjectId.from_datetime(since)}}, {'TAGS': 1}):
+                    if invalidation['_id'] not in self._applied:
+                        self._applied.add(invalidation['_id'])
+                        tags.update(invalidation['TAGS'])
+            self._applied = {applied for applied in self._applied if applied.generation_time >= since}
+            self._since = started
+        except (DBParametersError, PyMongoError) as err:
+            logger.warning('Could not read the cache invalidations: %s', err)
+            return 0
+        finally:
+            self._sync_lock.release()
+
+        return self._drop(tags) if tags else 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _drop(self, tags: set) -> int:
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry.tags & tags]
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._size -= entry.size
+
+response_cache = ResponseCache()
+
+def fund_tag(cnpj: str) -> str:
+    return f'fund:{cnpj}'
+
+def quote_tag(cnpj: str) -> str:
+    return f'quote:{cnpj}'
+
+def cached(ttl_config: str, tags=None, streamed: bool=False):
+    '''
+        Caches the successful GET responses of a view by path, query string and
+        negotiated format. Streamed responses are only cached with streamed, their
+        chunks are sent as they are produced and the entry is stored once the body
+        is complete.
+        ttl_config is the config key with the TTL in seconds and tags a function
+        receiving the view arguments and returning the tags of the entry.
+        Entries are sent compressed as negotiated by compression.
+    '''
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+
+            # The negotiated format is part of the key since the body depends on Accept
+            key = f'{request.path}?{sorted(request.args.items(multi=True))}|{negotiate_format(formats=tuple(MIMETYPES))}'
+            entry = response_cache.get(key)
+            if entry is None:
+                resp = view(*args, **kwargs)
+                if resp.status_code != 200 or (resp.is_streamed and not streamed):
+                    return resp
+
+                ttl = current_app.config[ttl_config]
+                entry_tags = tags(**kwargs) if tags else list()
+                if resp.is_streamed:
+                    resp.response = _store_stream(resp, key, ttl, entry_tags)
+                    return resp
+
+                entry = CacheEntry(resp.get_data(), resp.status_code, resp.mimetype, ttl, entry_tags)
+                response_cache.set(key, entry)
+
+            encoding = compression.negotiate() if compression.compressible(entry.mimetype, len(entry.body)) else None
+            if encoding is not None:
+                response_cache.encode(key, entry, encoding)
+            return entry.to_response(encoding)
+        return wrapper
+    return decorator
+
+def _store_stream(resp: Response, key: str, ttl: int, tags: list):
+    '''
+        Passes the chunks of a streamed response through, then caches the body when
+        it fits in the cache.
+
+        RETURNS
+        The iterable to use as the body of resp
+    '''
+    def body(chunks, source, status: int, mimetype: str):
+        try:
+            collected = list()
+            size = 0
+            for chunk in chunks:
+                if collected is not None:
+                    size += len(chunk)
+                    collected = collected if size <= response_cache.max_bytes else None
+                if collected is not None:
+                    collected.append(chunk)
+                yield chunk
+            if collected is not None:
+                response_cache.set(key, CacheEntry(b''.join(collected), status, mimetype, ttl, tags))
+        finally:
+            if hasattr(source, 'close'):
+                source.close()
+
+    # Bound now, resp.response is replaced by the returned generator
+    return body(resp.iter_encoded(), resp.response, resp.status_code, resp.mimetype)
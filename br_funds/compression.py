@@ -0,0 +1,114 @@
+import gzip
+import zlib
+
+from flask import request
+
+from br_funds import settings
+from br_funds.serializers import MIMETYPES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Parquet is already compressed, the other formats are text or plain Arrow buffers
+COMPRESSIBLE_MIMETYPES = {mimetype for name, mimetype in MIMETYPES.items() if name != 'PARQUET'} | {'text/plain'}
+
+class Compression():
+    '''
+        gzip and brotli compression of the responses, negotiated with Accept-Encoding.
+        brotli is only offered when the brotli package is installed.
+
+        Bodies of at least COMPRESSION_MIN_SIZE bytes are compressed in an after_request
+        hook, streamed bodies are compressed on the fly as their chunks are produced.
+        The response cache keeps the compressed bodies next to its entries (see
+        br_funds.cache.cached), so cached bodies are compressed once per encoding.
+    '''
+    def __init__(self) -> None:
+        self.enabled = settings.COMPRESSION_ENABLED
+        self.min_size = settings.COMPRESSION_MIN_SIZE
+        self.gzip_level = settings.COMPRESSION_GZIP_LEVEL
+        self.brotli_quality = settings.COMPRESSION_BROTLI_QUALITY
+
+    def init_app(self, app) -> None:
+        self.enabled = app.config.get('COMPRESSION_ENABLED', self.enabled)
+        self.min_size = app.config.get('COMPRESSION_MIN_SIZE', self.min_size)
+        self.gzip_level = app.config.get('COMPRESSION_GZIP_LEVEL', self.gzip_level)
+        self.brotli_quality = app.config.get('COMPRESSION_BROTLI_QUALITY', self.brotli_quality)
+        app.extensions['compression'] = self
+        if self.enabled:
+            app.after_request(self._compress)
+
+    @property
+    def encodings(self) -> list:
+        '''Supported encodings, preferred first'''
+        return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    def compressible(self, mimetype: str, size: int=None) -> bool:
+        '''True when a body of mimetype and size (None for streamed bodies) is worth compressing'''
+        return self.enabled and mimetype in COMPRESSIBLE_MIMETYPES and (size is None or size >= self.min_size)
+
+    def negotiate(self) -> str:
+        '''
+            The preferred encoding accepted by the current request.
+
+            RETURNS
+            br, gzip or None for the body as it is
+        '''
+        return request.accept_encodings.best_match(self.encodings)
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        # mtime=0 gives the same bytes for the same body
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    def compress_stream(self, chunks, encoding: str):
+        '''Compresses an iterable of bytes as it is consumed, yielding the output as the compressor releases it'''
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            process, finish = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            process, finish = compressor.compress, compressor.flush
+
+        for chunk in chunks:
+            data = process(chunk)
+            if data:
+                yield data
+        yield finish()
+
+    def _compress(self, resp):
+        if resp.status_code < 200 or resp.status_code in (204, 206, 304) or 'Content-Encoding' in resp.headers or resp.direct_passthrough:
+            return resp
+
+        streamed = resp.is_streamed
+        if not self.compressible(resp.mimetype, None if streamed else resp.calculate_content_length()):
+            return resp
+
+        resp.vary.add('Accept-Encoding')
+        encoding = self.negotiate()
+        if encoding is None:
+            return resp
+
+        if streamed:
+            resp.response = _closing(self.compress_stream(resp.iter_encoded(), encoding), resp.response)
+            resp.headers.pop('Content-Length', None)
+        else:
+            resp.set_data(self.compress(resp.get_data(), encoding))
+        resp.headers['Content-Encoding'] = encoding
+
+        etag, weak = resp.get_etag()
+        if etag:
+            resp.set_etag(f'{etag}-{encoding}', weak)
+        return resp
+
+def _closing(chunks, source):
+    '''Yields chunks, then closes source as the WSGI server would have done'''
+    try:
+        yield from chunks
+    finally:
+        if hasattr(source, 'close'):
+            source.close()
+
+compression = Compression()
@@ -1,53 +1,228 @@
-from flask import Response, jsonify
-from mongoengine import connect
-from pymongo.errors import OperationFailure
-from dotenv import load_dotenv
-import os
+import logging
+import threading
+from mongoengine import connect, disconnect, get_connection
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from br_funds import settings
+
+logger = logging.getLogger(__name__)
 
 class DBParametersError(Exception):
     def __init__(self) -> None:
         super().__init__('Failed to retrieve the enviroment variables to connect to the DB')
 
+def db_config(config: dict=None) -> dict:
+    '''pymongo connection parameters from the app config, falling back to the settings'''
+    config = config or dict()
+    return {
+        'host': config.get('MONGODB_HOST', settings.MONGODB_HOST),
+        'username': config.get('MONGODB_USERNAME', settings.MONGODB_USERNAME),
+        'password': config.get('MONGODB_PASSWORD', settings.MONGODB_PASSWORD),
+        'db': config.get('MONGODB_DB', settings.MONGODB_DB),
+        'maxPoolSize': config.get('MONGODB_POOL_SIZE', settings.MONGODB_POOL_SIZE),
+        'serverSelectionTimeoutMS': config.get('MONGODB_SERVER_SELECTION_TIMEOUT_MS', settings.MONGODB_SERVER_SELECTION_TIMEOUT_MS),
+        'connectTimeoutMS': config.get('MONGODB_CONNECT_TIMEOUT_MS', settings.MONGODB_CONNECT_TIMEOUT_MS),
+        'socketTimeoutMS': config.get('MONGODB_SOCKET_TIMEOUT_MS', settings.MONGODB_SOCKET_TIMEOUT_MS)
+    }
+
 class DB():
-    _MONGODB_USERNAME = None
-    _MONGODB_PASSWORD = None
-    _MONGODB_CLUSTER = None
-    _MONGODB_DB = None
-    _MONGODB_COLLECTION = None
+    '''
+        Process-wide MongoDB connection manager.
+
+        create_app configures it once with init_app and the first request
+        registers the mongoengine connection. Every other call to get_db
+        reuses the same client and its connection pool.
+    '''
     def __init__(self) -> None:
-        self._load_envs()
+        self.config = dict()
+        self._connected = False
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.config = db_config(app.config)
+        self.disconnect()
+        app.extensions['db'] = self
+
+    @property
+    def connected(self) -> bool:
+        return self._connected
+
+    def connect(self) -> None:
+        if self._connected:
+            return
+
+        with self._lock:
+            if self._connected:
+                return
+
+            if not self.config:
+                self.config = db_config()
+
+            if not all([self.config['host'], self.config['db']]):
+                raise DBParametersError()
+
+            params = {key: value for key, value in self.config.items() if value is not None}
+            # The client connects in the background, the first query waits for the server selection
+            connect(connect=False, **params)
+            self._connected = True
+            logger.info('Connecting to the db...')
+
+    def disconnect(self) -> None:
+        with self._lock:
+            if self._connected:
+                disconnect()
+            self._connected = False
+
+    def ping(self) -> bool:
+        '''
+            Health check: sends a ping to the server.
+
+            RETURNS
+            True when the DB answered
+        '''
         try:
-            connect(host="mongodb+srv://cluster.a7nme.mongodb.net"
-                , db=self._MONGODB_DB
-                , username=self._MONGODB_USERNAME
-                , password=self._MONGODB_PASSWORD)
-        except OperationFailure as err:
-            print ('--> Could not connect to the DB')
-            raise Exception('Could not connect to the DB')
-        print('Connecting to the db...')
-
-
-    def _load_envs(self):
-        load_dotenv()
-        self._MONGODB_USERNAME = os.getenv('MONGODB_USERNAME')
-        self._MONGODB_PASSWORD = os.getenv('MONGODB_PASSWORD')
-        self._MONGODB_CLUSTER = os.getenv('MONGODB_CLUSTER')
-        self._MONGODB_DB = os.getenv('MONGODB_DB')
-        self._MONGODB_COLLECTION = os.getenv('MONGODB_COLLECTION')
-
-        if not all([self._MONGODB_USERNAME, self._MONGODB_PASSWORD, self._MONGODB_CLUSTER, self._MONGODB_DB, self._MONGODB_COLLECTION]):
-            raise DBParametersError()
+            self.connect()
+            get_connection().admin.command('ping')
+        except (DBParametersError, PyMongoError) as err:
+            logger.warning('DB health check failed: %s', err)
+            return False
+
+        return True
+
+db = DB()
+
+def get_db() -> DB:
+    '''Returns the shared connection manager, connecting on the first call'''
+    db.connect()
+    return db
 
 def connect_to_db() -> None:
     try:
-        db = DB()
-    except:
-        raise DBParametersError
-        print('--> Could not connect to the DB')
-        resp = jsonify({
-            'msg': 'Could not connect to the DB',
-            'error': True,
-            'data': None
-        })
-        resp.status_code = 500
-        return resp
\ No newline at end of file
+        get_db()
+    except DBParametersError:
+        logger.error('Could not connect to the DB')
+        raise
+
+def bulk_upsert(collection, documents: list, keys: list, batch_size: int=1000, skip_unchanged: bool=True) -> list:
+    '''
+        Upserts the documents matching them by the keys fields with unordered
+        bulk_write calls of batch_size operations.
+        When skip_unchanged is set, documents identical to the stored ones
+        are not sent to the DB at all.
+        A failed write doesn't stop the rest of the batch.
+
+        RETURNS
+        A list of dict with the keys of each document plus its status:
+        inserted, updated, unchanged or failed (with the error in msg)
+    '''
+    results = list()
+    for start in range(0, len(documents), batch_size):
+        results.extend(_bulk_upsert_batch(collection, documents[start:start + batch_size], keys, skip_unchanged))
+
+    return results
+
+def bulk_insert(collection, documents: list, keys: list) -> list:
+    '''
+        Inserts the documents with an unordered insert_many, so a document that is
+        already stored (a duplicate key) doesn't stop the others.
+
+        RETURNS
+        A list of dict with the keys of each document plus its status:
+        inserted or failed (with the error in msg)
+    '''
+    write_errors = dict()
+    if documents:
+        try:
+            collection.insert_many(documents, ordered=False)
+        except BulkWriteError as err:
+            write_errors = {error['index']: error for error in err.details.get('writeErrors', [])}
+
+    results = list()
+    for index, document in enumerate(documents):
+        result = {key: document.get(key) for key in keys}
+        error = write_errors.get(index)
+        if error is None:
+            result['status'] = 'inserted'
+        else:
+            result['status'] = 'failed'
+            result['msg'] = 'Already in the DB' if error.get('code') == 11000 else error.get('errmsg')
+        results.append(result)
+
+    return results
+
+def key_of(document: dict, keys: list) -> tuple:
+    '''Values of the keys fields of the document, identifying it in bulk_upsert'''
+    return tuple(document.get(key) for key in keys)
+
+def existing_query(documents: dict, keys: list) -> tuple:
+    '''
+        Query and projection reading the stored version of the documents,
+        a dict of documents by the tuple of their keys.
+    '''
+    query = {key: {'$in': list({key_value[pos] for key_value in documents})} for pos, key in enumerate(keys)}
+    projection = {field: 1 for document in documents.values() for field in document}
+    return query, projection
+
+def plan_upserts(documents: dict, keys: list, existing: dict) -> tuple:
+    '''
+        Builds the upserts of the documents that differ from the existing ones,
+        both dicts of documents by the tuple of their keys.
+
+        RETURNS
+        A tuple (statuses, operations, operation_keys)
+    '''
+    statuses = dict.fromkeys(documents)
+    operations = list()
+    operation_keys = list()
+    for key_value, document in documents.items():
+        current = existing.get(key_value)
+        if current is not None and all(current.get(field) == value for field, value in document.items()):
+            statuses[key_value] = ('unchanged', None)
+            continue
+
+        operations.append(UpdateOne(dict(zip(keys, key_value)), {'$set': document}, upsert=True))
+        operation_keys.append(key_value)
+
+    return statuses, operations, operation_keys
+
+def upsert_results(statuses: dict, keys: list, operation_keys: list, upserted: dict, write_errors: list) -> list:
+    '''Merges the outcome of the bulk write into statuses and returns the results in the order of the documents'''
+    for index, key_value in enumerate(operation_keys):
+        statuses[key_value] = ('inserted' if index in upserted else 'updated', None)
+    for error in write_errors:
+        statuses[operation_keys[error['index']]] = ('failed', error.get('errmsg'))
+
+    results = list()
+    for key_value, (status, msg) in statuses.items():
+        result = dict(zip(keys, key_value))
+        result['status'] = status
+        if msg:
+            result['msg'] = msg
+        results.append(result)
+
+    return results
+
+def bulk_write_error_details(err: BulkWriteError) -> tuple:
+    '''RETURNS A tuple (upserted ids by operation index, write errors)'''
+    upserted = {item['index']: item['_id'] for item in err.details.get('upserted', [])}
+    return upserted, err.details.get('writeErrors', [])
+
+def _bulk_upsert_batch(collection, documents: list, keys: list, skip_unchanged: bool) -> list:
+    # The last document wins when the same key shows up more than once
+    documents = {key_of(document, keys): document for document in documents}
+
+    existing = dict()
+    if skip_unchanged:
+        for document in collection.find(*existing_query(documents, keys)):
+            existing[key_of(document, keys)] = document
+
+    statuses, operations, operation_keys = plan_upserts(documents, keys, existing)
+
+    upserted, write_errors = dict(), list()
+    if operations:
+        try:
+            upserted = collection.bulk_write(operations, ordered=False).upserted_ids
+        except BulkWriteError as err:
+            upserted, write_errors = bulk_write_error_details(err)
+
+    return upsert_results(statuses, keys, operation_keys, upserted, write_errors)
@@ -0,0 +1,222 @@
+import io
+import json
+import logging
+import os
+import threading
+import time
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+import pyarrow as pa
+
+from br_funds import settings
+from br_funds.metrics import metrics
+from br_funds.snapshot import KEY_COLUMN, write_table
+
+logger = logging.getLogger(__name__)
+
+# Bump when the format of the records changes, older snapshots are then ignored
+SNAPSHOT_VERSION = 2
+# Schema metadata key of the source, version and validators of the snapshot file
+SNAPSHOT_METADATA = 'br_funds.cadastro'
+
+
+class CadastroUnavailableError(Exception):
+    def __init__(self, reason) -> None:
+        super().__init__(f'The CVM cadastro is not available: {reason}')
+        self.reason = reason
+
+
+class CadastroSnapshot():
+    '''
+        Local copy of the CVM cadastro (cad_fi.csv) indexed by CNPJ_FUNDO.
+
+        The csv is downloaded (or read from a local path) only when the snapshot is
+        missing or older than the TTL. Remote refreshes are conditional requests
+        (If-None-Match / If-Modified-Since) so an unchanged file costs a 304.
+        The parsed records are persisted to disk as an Arrow IPC file sorted by
+        CNPJ, so a restart does not need to download and parse the csv again.
+    '''
+    def __init__(self, url: str=settings.CADASTRO_URL
+            , local_path: str=settings.CADASTRO_LOCAL_PATH
+            , snapshot_path: str=settings.CADASTRO_SNAPSHOT_PATH
+            , ttl: int=settings.CADASTRO_TTL
+            , timeout: int=settings.CADASTRO_TIMEOUT
+            , retry: int=settings.CADASTRO_RETRY) -> None:
+        self.url = url
+        self.local_path = local_path
+        self.snapshot_path = snapshot_path
+        self.ttl = ttl
+        self.timeout = timeout
+        self.retry = retry
+        self._records = None
+        self._etag = None
+        self._last_modified = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.url = app.config.get('CADASTRO_URL', self.url)
+        self.local_path = app.config.get('CADASTRO_LOCAL_PATH', self.local_path)
+        self.snapshot_path = app.config.get('CADASTRO_SNAPSHOT_PATH', self.snapshot_path)
+        self.ttl = app.config.get('CADASTRO_TTL', self.ttl)
+        self.timeout = app.config.get('CADASTRO_TIMEOUT', self.timeout)
+        self.retry = app.config.get('CADASTRO_RETRY', self.retry)
+        app.extensions['cadastro'] = self
+
+    @property
+    def expired(self) -> bool:
+        return time.time() - self._checked_at > self.ttl
+
+    def records(self, refresh: bool=True) -> dict:
+        '''
+            Returns the whole cadastro as a dict of records keyed by CNPJ,
+            refreshing it first when the TTL has expired. Without refresh the
+            snapshot is used as it is, the cadastro is only loaded when there is none.
+        '''
+        if self._records is None or (refresh and self.expired):
+            with self._lock:
+                if self._records is None:
+                    self._load_snapshot()
+                if self._records is None or (refresh and self.expired):
+                    self.refresh()
+        return self._records
+
+    def get(self, cnpjs: list) -> list:
+        '''
+            Returns the records for the CNPJs found in the cadastro.
+            CNPJs that are not registered at CVM are left out.
+
+            RETURNS
+            A list of dict
+        '''
+        records = self.records()
+        return [dict(records[cnpj]) for cnpj in dict.fromkeys(cnpjs) if cnpj in records]
+
+    def refresh(self, force: bool=False) -> bool:
+        '''
+            Reloads the cadastro from the local path or the CVM url.
+            When the source did not change since the last load only the
+            check time is updated.
+
+            RETURNS
+            True when the records were rebuilt
+        '''
+        if self._records is None:
+            # The validators of the snapshot make the request conditional
+            self._load_snapshot()
+
+        validators = (self._etag, self._last_modified)
+        try:
+            if self.local_path:
+                source = self._read_local(force)
+            else:
+                source = self._download(force)
+            records = build_records(source) if source is not None else None
+        except (URLError, OSError, ValueError, KeyError) as err:
+            # A file that could not be parsed must not be skipped as unchanged next time
+            self._etag, self._last_modified = validators
+            if self._records is None:
+                raise CadastroUnavailableError(err)
+            # Keep serving the stale copy, the refresh is tried again after CADASTRO_RETRY
+            logger.warning('Could not refresh the cadastro, retrying in %d seconds: %s', self.retry, err)
+            self._checked_at = time.time() - self.ttl + self.retry
+            return False
+
+        self._checked_at = time.time()
+        if records is None:
+            self._save_snapshot()
+            return False
+
+        self._records = records
+        self._save_snapshot()
+        return True
+
+    def _read_local(self, force: bool):
+        mtime = str(os.path.getmtime(self.local_path))
+        if not force and self._records is not None and mtime == self._last_modified:
+            return None
+
+        self._etag = None
+        self._last_modified = mtime
+        return self.local_path
+
+    def _download(self, force: bool):
+        headers = dict()
+        if not force and self._records is not None:
+            if self._etag:
+                headers['If-None-Match'] = self._etag
+            if self._last_modified:
+                headers['If-Modified-Since'] = self._last_modified
+
+        started_at = time.perf_counter()
+        try:
+            with urlopen(Request(self.url, headers=headers), timeout=self.timeout) as resp:
+                body = resp.read()
+                self._etag = resp.headers.get('ETag')
+                self._last_modified = resp.headers.get('Last-Modified')
+        except HTTPError as err:
+            if err.code == 304:
+                return None
+            raise
+
+        metrics.observe_cadastro(metrics.cadastro_download, started_at)
+        return io.BytesIO(body)
+
+    def _load_snapshot(self) -> None:
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+
+        try:
+            with pa.OSFile(self.snapshot_path, 'rb') as snapshot_file:
+                table = pa.ipc.open_file(snapshot_file).read_all()
+            snapshot = json.loads((table.schema.metadata or dict())[SNAPSHOT_METADATA.encode('utf-8')])
+        except (OSError, ValueError, KeyError) as err:
+            logger.warning('Ignoring unreadable cadastro snapshot %s: %s', self.snapshot_path, err)
+            return
+
+        if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('source') != (self.local_path or self.url):
+            return
+
+        records = table.drop_columns([KEY_COLUMN]).to_pylist()
+        self._records = {record['CNPJ']: record for record in records}
+        self._etag = snapshot['etag']
+        self._last_modified = snapshot['last_modified']
+        self._checked_at = snapshot['checked_at']
+
+    def _save_snapshot(self) -> None:
+        if not self.snapshot_path or not self._records:
+            return
+
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'source': self.local_path or self.url,
+            'etag': self._etag,
+            'last_modified': self._last_modified,
+            'checked_at': self._checked_at
+        }
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.snapshot_path)), mode=0o700, exist_ok=True)
+            write_table(list(self._records.values()), self.snapshot_path, {SNAPSHOT_METADATA: json.dumps(snapshot)})
+        except OSError as err:
+            logger.warning('Could not save the cadastro snapshot: %s', err)
+
+def build_records(source) -> dict:
+    '''
+        Parses the cad_fi.csv from source and indexes the funds by CNPJ.
+
+        RETURNS
+        A dict of dict
+    '''
+    # Imported here to avoid a circular import, load_funds uses the snapshot
+    from .load_funds import load_funds_data_from_file, fix_columns, convert_types, convert_to_dict, CADASTRO_COLUMNS
+
+    funds = load_funds_data_from_file(source)
+    funds = funds.drop_duplicates(subset='CNPJ_FUNDO', keep='last')
+    funds = fix_columns(funds[CADASTRO_COLUMNS].copy())
+    funds = convert_types(funds)
+
+    return {fund['CNPJ']: fund for fund in convert_to_dict(funds)}
+
+
+cadastro = CadastroSnapshot()
@@ -1,80 +1,193 @@
+import logging
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from http import HTTPStatus
 import sys
-from flask import jsonify, Response
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from flask import Response, current_app
 from .load_funds import load_funds_data
+from .sync import cadastro_hash
+from .cadastro import CadastroUnavailableError
 from ..models.fund_model import Fund
-from ..database import DB
-from ..utils import validate_cnpj, InvalidCNPJError, funds_exist
+from mongoengine import ValidationError
+from ..database import get_db, bulk_insert, bulk_upsert, DBParametersError
+from ..cache import response_cache, fund_tag, REGISTRY_TAG
+from ..jobs import jobs, job_key, TooManyJobsError
+from ..serializers import respond, stream_response
+from ..utils import validate_cnpj, validate_cnpjs, InvalidCNPJError, funds_exist
 
-def get_all_funds() -> Response:
+logger = logging.getLogger(__name__)
+
+# Fields /funds/ can be filtered by, each one has an index in the Fund model
+FILTER_FIELDS = ['FUNDO_CLASSE', 'FUNDO_TIPO', 'STATUS', 'GESTOR_CNPJ', 'ADMIN_CNPJ']
+CNPJ_FILTERS = ['GESTOR_CNPJ', 'ADMIN_CNPJ']
+FUND_FIELDS = [field for field in Fund._fields if field not in ['id', 'CADASTRO_HASH']]
+
+def encode_cursor(object_id: ObjectId) -> str:
+    '''Opaque pagination cursor pointing after the given _id'''
+    return urlsafe_b64encode(object_id.binary).decode('ascii')
+
+def decode_cursor(cursor: str) -> ObjectId:
+    try:
+        return ObjectId(urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError, InvalidId):
+        raise ValueError(f'Invalid cursor: {cursor}')
+
+def parse_fund_query(args) -> tuple:
+    '''
+        Reads the filters and the projection of /funds/ from the URL parameters.
+        Each of FILTER_FIELDS may be repeated or hold comma separated values, a fund
+        matching any of them is returned; the CNPJs are validated and formatted.
+        fields is a comma separated list of Fund fields, _id is always returned.
+        Raises ValueError on an invalid value.
+
+        RETURNS
+        A tuple with the MongoDB filter and the list of fields (None for all of them)
+    '''
+    filters = dict()
+    for field in FILTER_FIELDS:
+        values = [value.strip() for arg in args.getlist(field) for value in arg.split(',') if value.strip()]
+        if not values:
+            continue
+        if field in CNPJ_FILTERS:
+            normalized, errors = validate_cnpjs(values)
+            errors = [error for error in errors if error]
+            if errors:
+                raise ValueError(f'{field}: {errors[0]}')
+            values = normalized
+        filters[field] = values[0] if len(values) == 1 else {'$in': list(dict.fromkeys(values))}
+
+    fields = None
+    if 'fields' in args:
+        fields = list(dict.fromkeys(field.strip() for field in args.get('fields').split(',') if field.strip()))
+        unknown = [field for field in fields if field not in FUND_FIELDS]
+        if not fields or unknown:
+            raise ValueError(f'Invalid fields: {", ".join(unknown) or args.get("fields")}. Valid fields: {", ".join(FUND_FIELDS)}')
+
+    return filters, fields
+
+def fund_projection(fields: list=None) -> dict:
+    '''MongoDB projection of fields, without them every field but CADASTRO_HASH'''
+    return {field: 1 for field in fields} if fields else {'CADASTRO_HASH': 0}
+
+def get_all_funds(limit: int=None, cursor: str=None, filters: dict=None, fields: list=None) -> Response:
+    '''
+        Lists the funds in the DB matching filters ordered by _id, with only fields
+        when given (see parse_fund_query).
+        With a limit only one page is returned, along with the cursor of the next page
+        (None on the last page). Without it, all funds are returned in a single body.
+    '''
     try:
-        db = DB()
-    except:
-        print('Could not connect to the DB')
-        resp = jsonify({
+        get_db()
+    except DBParametersError:
+        logger.error('Could not connect to the DB')
+        return respond({
             'msg': 'Could not connect to the DB',
             'error': True,
-            'data': None            
-        })
-        resp.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-        return resp
+            'data': None
+        }, HTTPStatus.INTERNAL_SERVER_ERROR, root='funds')
 
-    all_funds = [fund.to_mongo().to_dict() for fund in Fund.objects]
-    for fund in all_funds:
-        fund['_id'] = str(fund['_id'])
+    query = dict(filters or dict())
+    if cursor:
+        try:
+            query['_id'] = {'$gt': decode_cursor(cursor)}
+        except ValueError as error:
+            return respond({
+                'msg': f'{error}',
+                'error': True,
+                'data': None
+            }, HTTPStatus.BAD_REQUEST, root='funds')
 
-    print(all_funds)
-    resp = jsonify({
-        'msg': 'All funds in the DB',
+    # Reads skip mongoengine, the raw documents are serialized as they come
+    all_funds = list(Fund._get_collection().find(query, fund_projection(fields)).sort('_id', 1).limit(limit or 0))
+    next_cursor = None
+    if limit and len(all_funds) == limit:
+        next_cursor = encode_cursor(all_funds[-1]['_id'])
+
+    body = {
+        'msg': 'Funds in the DB matching the filters' if filters else 'All funds in the DB',
         'records': len(all_funds),
         'data': all_funds
-    })
-    return resp
+    }
+    if limit:
+        body['next_cursor'] = next_cursor
+    return respond(body, root='funds')
+
+def stream_all_funds(stream_format: str, filters: dict=None, fields: list=None) -> Response:
+    '''
+        Streams the funds in the DB matching filters as the cursor yields them, so
+        memory stays flat regardless of the size of the registry.
+        stream_format is NDJSON (one fund per line), JSON or XML (the same body as
+        get_all_funds, with records written after the data).
+    '''
+    try:
+        get_db()
+    except DBParametersError:
+        logger.error('Could not connect to the DB')
+        return respond({
+            'msg': 'Could not connect to the DB',
+            'error': True,
+            'data': None
+        }, HTTPStatus.INTERNAL_SERVER_ERROR, root='funds')
+
+    funds = Fund._get_collection().find(filters or dict(), fund_projection(fields)).sort('_id', 1)
+    msg = 'Funds in the DB matching the filters' if filters else 'All funds in the DB'
+    return stream_response({'msg': msg}, funds, root='funds', param_format=stream_format)
 
 def add_funds(cnpjs: list) -> Response:
     results = list()
-    try:
-        funds_list = validate_cnpj(cnpjs)
-    except InvalidCNPJError as error:
-        print('Invalid CNPJ')
-        resp = jsonify({
-            'msg': f'{error}',
+    if not cnpjs or not isinstance(cnpjs, list):
+        return respond({
+            'msg': f'{InvalidCNPJError(cnpjs)}',
             'error': True,
-            'data': [f'{error.fund}']
-        })
-        resp.status_code = HTTPStatus.BAD_REQUEST
-        return resp
+            'data': [f'{cnpjs}']
+        }, HTTPStatus.BAD_REQUEST, root='funds')
+
+    funds_list, errors = validate_cnpjs(cnpjs)
+    errors = [error for error in errors if error]
+    if errors:
+        logger.info('Invalid CNPJ')
+        return respond({
+            'msg': 'One or more CNPJs are invalid',
+            'error': True,
+            'data': errors
+        }, HTTPStatus.BAD_REQUEST, root='funds')
     
     try:
-        db = DB()
-    except:
-        print('Could not connect to the DB')
-        resp = jsonify({
+        get_db()
+    except DBParametersError:
+        logger.error('Could not connect to the DB')
+        return respond({
             'msg': 'Could not connect to the DB',
             'error': True,
-            'data': None            
-        })
-        resp.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-        return resp
+            'data': None
+        }, HTTPStatus.INTERNAL_SERVER_ERROR, root='funds')
     
-    funds_info = load_funds_data(funds_list)
+    try:
+        funds_info = load_funds_data(funds_list)
+    except CadastroUnavailableError as error:
+        logger.error('%s', error)
+        return respond({
+            'msg': f'{error}',
+            'error': True,
+            'data': None
+        }, HTTPStatus.SERVICE_UNAVAILABLE, root='funds')
     
     msg = funds_exist(funds_list, funds_info)
     if msg:
-        print('One or more funds were not found')
-        resp = jsonify({
+        logger.info('One or more funds were not found')
+        return respond({
             'msg': 'One or more funds were not found',
             'error': True,
             'data': msg
-        })
-        resp.status_code = HTTPStatus.NOT_FOUND
-        return resp
+        }, HTTPStatus.NOT_FOUND, root='funds')
 
     for record in funds_info:
-        fund = Fund(**record)
+        fund = Fund(CADASTRO_HASH=cadastro_hash(record), **record)
         try:
             result = fund.save()
-            print(f'Saved {fund.CNPJ}')
+            logger.debug('Saved %s', fund.CNPJ)
+            response_cache.invalidate([fund_tag(fund.CNPJ), REGISTRY_TAG])
             results.append(str(result.id))
         except:
             # The current behavior is to abort execution if there's an error
@@ -84,71 +197,236 @@ def add_funds(cnpjs: list) -> Response:
             # a solution might to send the error to db object to evaluate.
             # If the error is because a key duplication, ignore and continue
             e = sys.exc_info()
-            print('Exception -->', e)
-            print(f'{fund.CNPJ} not saved...')
-            resp = jsonify({
+            logger.exception('%s not saved', fund.CNPJ)
+            return respond({
                 'msg': f'Error while adding {fund.CNPJ} to the DB',
                 'error': True,
                 'data': [str(e[1]), record]
-            })
-            resp.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-            return resp
+            }, HTTPStatus.INTERNAL_SERVER_ERROR, root='funds')
 
-    resp = jsonify({
+    return respond({
         'msg': 'Records added',
         'records': len(results),
         'data': results
-    })
-    resp.status_code = HTTPStatus.CREATED
+    }, HTTPStatus.CREATED, root='funds')
+
+def save_fund_records(cnpjs: list, insert_only: bool=False) -> dict:
+    '''
+        Saves the cadastro records of cnpjs, already validated and formatted, with
+        bulk writes. Funds already in the DB are updated when their record changed,
+        or left as they are and reported failed with insert_only.
+        Raises CadastroUnavailableError when the cadastro can not be loaded.
+
+        RETURNS
+        A dict of results by CNPJ, each with its status: inserted, updated, unchanged or failed
+    '''
+    results = dict()
+    funds_info = load_funds_data(cnpjs) or list()
+    found = {fund['CNPJ'] for fund in funds_info}
+    for cnpj in cnpjs:
+        if cnpj not in found:
+            results[cnpj] = {'CNPJ': cnpj, 'status': 'failed', 'msg': f'Fund with CNPJ {cnpj} not found in the registry'}
+
+    documents = list()
+    for record in funds_info:
+        fund = Fund(CADASTRO_HASH=cadastro_hash(record), **record)
+        try:
+            fund.validate()
+        except ValidationError as error:
+            results[fund.CNPJ] = {'CNPJ': fund.CNPJ, 'status': 'failed', 'msg': f'{error}'}
+            continue
+        document = fund.to_mongo().to_dict()
+        document.pop('_id', None)
+        documents.append(document)
+
+    write = bulk_insert if insert_only else bulk_upsert
+    for result in write(Fund._get_collection(), documents, ['CNPJ']):
+        results[result['CNPJ']] = result
+    changed = [fund_tag(cnpj) for cnpj, result in results.items() if result['status'] in ['inserted', 'updated']]
+    response_cache.invalidate(changed + [REGISTRY_TAG] if changed else changed)
 
+    return results
+
+def summarize(results: list) -> dict:
+    '''Number of results by status'''
+    summary = {status: 0 for status in ['inserted', 'updated', 'unchanged', 'failed']}
+    for result in results:
+        summary[result['status']] += 1
+    return summary
+
+def upsert_funds(cnpjs: list) -> Response:
+    '''
+        Bulk ingest mode of add_funds: every fund is inserted or updated with
+        unordered bulk writes, so funds already in the DB don't abort the batch
+        and re-sending the same batch is idempotent.
+
+        RETURNS
+        A Response with the status of each CNPJ: inserted, updated, unchanged or failed
+    '''
+    if not cnpjs or not isinstance(cnpjs, list):
+        return respond({
+            'msg': f'{InvalidCNPJError(cnpjs)}',
+            'error': True,
+            'data': [f'{cnpjs}']
+        }, HTTPStatus.BAD_REQUEST, root='funds')
+
+    results = dict()
+    funds_list = list()
+    for cnpj, normalized, error in zip(cnpjs, *validate_cnpjs(cnpjs)):
+        if error:
+            results[str(cnpj)] = {'CNPJ': cnpj, 'status': 'failed', 'msg': error}
+            funds_list.append(str(cnpj))
+        else:
+            funds_list.append(normalized)
+
+    try:
+        get_db()
+    except DBParametersError:
+        logger.error('Could not connect to the DB')
+        return respond({
+            'msg': 'Could not connect to the DB',
+            'error': True,
+            'data': None
+        }, HTTPStatus.INTERNAL_SERVER_ERROR, root='funds')
+
+    try:
+        results.update(save_fund_records([cnpj for cnpj in funds_list if cnpj not in results]))
+    except CadastroUnavailableError as error:
+        logger.error('%s', error)
+        return respond({
+            'msg': f'{error}',
+            'error': True,
+            'data': None
+        }, HTTPStatus.SERVICE_UNAVAILABLE, root='funds')
+
+    data = [results[cnpj] for cnpj in dict.fromkeys(funds_list)]
+    summary = summarize(data)
+
+    return respond({
+        'msg': 'Funds upserted',
+        'records': len(data),
+        'error': summary['failed'] > 0,
+        'summary': summary,
+        'data': data
+    }, HTTPStatus.OK, root='funds')
+
+def run_funds_job(params: dict, progress) -> dict:
+    '''
+        Saves the funds of a job submitted by submit_funds_job in chunks of
+        JOBS_CHUNK_SIZE, reporting the results of each chunk to progress. The
+        CNPJs of the job are unique and formatted, except for the invalid ones.
+
+        RETURNS
+        The number of funds by status
+    '''
+    cnpjs = params['cnpjs']
+    chunk_size = current_app.config['JOBS_CHUNK_SIZE']
+    summary = summarize([])
+    for start in range(0, len(cnpjs), chunk_size):
+        chunk = cnpjs[start:start + chunk_size]
+        results = dict()
+        valid = list()
+        for cnpj, error in zip(chunk, validate_cnpjs(chunk)[1]):
+            if error:
+                results[cnpj] = {'CNPJ': cnpj, 'status': 'failed', 'msg': error}
+            else:
+                valid.append(cnpj)
+        results.update(save_fund_records(valid, insert_only=params['insert_only']))
+
+        data = [results[cnpj] for cnpj in chunk]
+        for status, count in summarize(data).items():
+            summary[status] += count
+        progress(start + len(chunk), data)
+
+    return summary
+
+def submit_funds_job(cnpjs: list, insert_only: bool) -> Response:
+    '''
+        Accepts a batch of add_funds (insert_only) or upsert_funds to be saved in the
+        background. The CNPJs are validated first: add_funds rejects the whole batch
+        when any is invalid, upsert_funds reports them failed in the job results.
+        Resubmitting a batch that is still queued or running returns the same job.
+
+        RETURNS
+        A 202 Response with the job, its progress and results are at /jobs/<id>
+    '''
+    normalized, errors = validate_cnpjs(cnpjs)
+    errors = [error for error in errors if error]
+    if insert_only and errors:
+        logger.info('Invalid CNPJ')
+        return respond({
+            'msg': 'One or more CNPJs are invalid',
+            'error': True,
+            'data': errors
+        }, HTTPStatus.BAD_REQUEST, root='funds')
+
+    # Formatted CNPJs once each, the invalid ones as they were sent
+    batch = list(dict.fromkeys(cnpj or str(sent) for sent, cnpj in zip(cnpjs, normalized)))
+    try:
+        job, created = jobs.submit('funds', job_key('funds', insert_only, sorted(batch))
+            , {'cnpjs': batch, 'insert_only': insert_only}, len(batch), run_funds_job)
+    except DBParametersError:
+        logger.error('Could not connect to the DB')
+        return respond({
+            'msg': 'Could not connect to the DB',
+            'error': True,
+            'data': None
+        }, HTTPStatus.INTERNAL_SERVER_ERROR, root='funds')
+    except TooManyJobsError as error:
+        logger.warning('%s', error)
+        resp = respond({
+            'msg': f'{error}',
+            'error': True,
+            'data': None
+        }, HTTPStatus.SERVICE_UNAVAILABLE, root='funds')
+        resp.headers['Retry-After'] = '60'
+        return resp
+
+    job.pop('RESULTS', None)
+    resp = respond({
+        'msg': 'Batch accepted, its progress is at the job url' if created else 'The same batch is already being processed',
+        'error': False,
+        'data': job
+    }, HTTPStatus.ACCEPTED, root='job')
+    resp.headers['Location'] = f'/jobs/{job["_id"]}'
     return resp
 
 def get_fund(cnpj: str) -> Response:
-    print('CNPJ Received ---->', cnpj)
+    logger.debug('CNPJ received: %s', cnpj)
     try:
         fund_cnpj = validate_cnpj([cnpj])[0]
     except InvalidCNPJError as error:
-        print('Invalid CNPJ')
-        resp = jsonify({
+        logger.info('Invalid CNPJ')
+        return respond({
             'msg': f'{error}',
             'error': True,
             'data': [cnpj]
-        })
-        resp.status_code = HTTPStatus.BAD_REQUEST
-        return resp
+        }, HTTPStatus.BAD_REQUEST, root='fund')
 
     try:
-        db = DB()
-    except:
-        print('Could not connect to the DB')
-        resp = jsonify({
+        get_db()
+    except DBParametersError:
+        logger.error('Could not connect to the DB')
+        return respond({
             'msg': 'Could not connect to the DB',
             'error': True,
-            'data': None            
-        })
-        resp.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-        return resp
+            'data': None
+        }, HTTPStatus.INTERNAL_SERVER_ERROR, root='fund')
 
-    funds = Fund.objects(CNPJ=fund_cnpj)
-    if not funds or len(funds) != 1:
-        print(f'---> Fund {cnpj} not found')
-        resp = jsonify({
+    fund = Fund._get_collection().find_one({'CNPJ': fund_cnpj}, fund_projection())
+    if fund is None:
+        logger.info('Fund %s not found', cnpj)
+        return respond({
             'msg': f'Fund {cnpj} ({fund_cnpj}) not found',
             'error': True,
             'data': [cnpj]
-        })
-        resp.status_code = HTTPStatus.NOT_FOUND
-        return resp
-    
-    for record in funds:
-        fund = record.to_mongo().to_dict()
-        fund['_id'] = str(fund['_id'])
-        resp = jsonify({
-            'msg': f'Fund: {fund["CNPJ"]}',
-            'records': len(funds),
-            'data': fund
-        })
-        return resp
+        }, HTTPStatus.NOT_FOUND, root='fund')
+
+    return respond({
+        'msg': f'Fund: {fund["CNPJ"]}',
+        'records': 1,
+        'data': fund
+    }, root='fund')
 
 if __name__ == '__main__':
     # print(ascii_letters)
@@ -1,62 +1,59 @@
+import logging
+import time
 import pandas as pd
-
-def load_funds_data_from_file() -> pd.DataFrame:
+from br_funds import settings
+from ..metrics import metrics
+from .cadastro import cadastro
+from ..snapshot import shared_snapshot
+from ..utils import to_date_column, to_float_column
+
+logger = logging.getLogger(__name__)
+
+CADASTRO_COLUMNS = [
+    "CNPJ_FUNDO"
+    , "DENOM_SOCIAL"
+    , "TP_FUNDO"
+    , "CLASSE"
+    , "SIT"
+    , "DT_INI_ATIV"
+    , "TAXA_ADM"
+    , "TAXA_PERFM"
+    , "INVEST_QUALIF"
+    , "INVEST_PROF"
+    , "CNPJ_ADMIN"
+    , "ADMIN"
+    , "CPF_CNPJ_GESTOR"
+    , "GESTOR"
+    ]
+
+def load_funds_data_from_file(source=None) -> pd.DataFrame:
     ''' 
         Loads the fund information dataset from CVM.
+        source can be a url, a local path or a file-like object,
+        the CVM url is used when it's not given.
     
         RETURNS
         pd.DataFrame
     '''
-    url = "http://dados.cvm.gov.br/dados/FI/CAD/DADOS/cad_fi.csv"
-    # url = 'cad_fi.csv'
-
-    cols = [
-        "CNPJ_FUNDO"
-        , "DENOM_SOCIAL"
-        , "TP_FUNDO"
-        , "CLASSE"
-        , "SIT"
-        , "DT_INI_ATIV"
-        , "TAXA_ADM"
-        , "TAXA_PERFM"
-        , "INVEST_QUALIF"
-        , "INVEST_PROF"
-        , "CNPJ_ADMIN"
-        , "ADMIN"
-        , "CPF_CNPJ_GESTOR"
-        , "GESTOR"
-        ]
-
-    funds_info = pd.read_csv(url, delimiter=';', encoding='ISO-8859-1', dtype='str', usecols=cols)
+    if source is None:
+        source = settings.CADASTRO_LOCAL_PATH or settings.CADASTRO_URL
+
+    # Includes the download when source is the url
+    started_at = time.perf_counter()
+    funds_info = pd.read_csv(source, delimiter=';', encoding='ISO-8859-1', dtype='str', usecols=CADASTRO_COLUMNS)
     funds_info.fillna(value='', inplace=True)
+    metrics.observe_cadastro(metrics.cadastro_parse, started_at)
     return funds_info
 
 def filter_data(funds: pd.DataFrame, cnpjs: list) -> pd.DataFrame:
     '''
-        Filters the data selecting only the columns in the cols list
+        Filters the data selecting only the columns in the CADASTRO_COLUMNS list
         and the rows that matches the CNPJs passed in the function argument
 
         RETURNS
         pd.DataFrame
     '''
-    cols = [
-            "CNPJ_FUNDO"
-            , "DENOM_SOCIAL"
-            , "TP_FUNDO"
-            , "CLASSE"
-            , "SIT"
-            , "DT_INI_ATIV"
-            , "TAXA_ADM"
-            , "TAXA_PERFM"
-            , "INVEST_QUALIF"
-            , "INVEST_PROF"
-            , "CNPJ_ADMIN"
-            , "ADMIN"
-            , "CPF_CNPJ_GESTOR"
-            , "GESTOR"
-            ]
-
-    funds_info = funds.loc[funds['CNPJ_FUNDO'].isin(cnpjs), cols]
+    funds_info = funds.loc[funds['CNPJ_FUNDO'].isin(cnpjs), CADASTRO_COLUMNS]
 
     return funds_info
 
@@ -88,6 +85,19 @@ def fix_columns(funds: pd.DataFrame) -> pd.DataFrame:
 
     return funds
 
+def convert_types(funds: pd.DataFrame) -> pd.DataFrame:
+    '''
+        Converts the typed columns of the Fund model (DATA_INICIO and TAXA_ADM)
+        from the strings in the csv. Empty values become None.
+
+        RETURNS
+        pd.DataFrame
+    '''
+    funds['DATA_INICIO'] = to_date_column(funds['DATA_INICIO'])
+    funds['TAXA_ADM'] = to_float_column(funds['TAXA_ADM'])
+
+    return funds
+
 def convert_to_dict(funds:pd.DataFrame) -> dict:
     '''
         Converts the DataFrame to a dictionary
@@ -103,25 +113,24 @@ def convert_to_dict(funds:pd.DataFrame) -> dict:
 
 def load_funds_data(cnpjs:list) -> dict:
     '''
-        Looks for the basic info for the Funds passed in the parameter as a list,
-        process the dataframe
+        Looks for the basic info for the Funds passed in the parameter as a list.
+        The lookup is done in the cadastro shared by the workers when there is one,
+        otherwise in the local cadastro snapshot, which is only downloaded again
+        when its TTL expires.
         
         RETURNS 
         A list of dict
     '''
-    if len(cnpjs) == 0 or cnpjs is None:
+    if cnpjs is None or len(cnpjs) == 0:
         return None
 
-    print(cnpjs)
-    
-    all_info = load_funds_data_from_file()
-
-    funds_info = filter_data(all_info, cnpjs)
-    funds_info = fix_columns(funds_info)
+    logger.debug('Looking up %d funds in the cadastro', len(cnpjs))
 
-    fund_dict = convert_to_dict(funds_info)
+    funds = shared_snapshot.get_funds(cnpjs)
+    if funds is not None:
+        return funds
 
-    return fund_dict
+    return cadastro.get(cnpjs)
 
 if __name__ == '__main__':
     funds = load_funds_data(['21.917.184/0001-29', '21.917.206/0001-50'])
@@ -0,0 +1,243 @@
+import bisect
+import heapq
+import logging
+import math
+import re
+import threading
+import unicodedata
+from http import HTTPStatus
+
+from flask import Response
+
+from br_funds import settings
+from .cadastro import CadastroUnavailableError, cadastro
+from .load_funds import load_funds_data
+from ..serializers import respond
+from ..snapshot import shared_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Fields indexed and the weight of a match in each of them
+SEARCH_FIELDS = {
+    'NOME': 3.0
+    , 'GESTOR': 2.0
+    , 'ADMIN': 1.0
+    }
+
+# A token matched only as the prefix of an indexed one counts this much of a full match
+PREFIX_WEIGHT = 0.5
+
+_SPLIT = re.compile(r'[^0-9a-z]+')
+
+def normalize(text) -> list:
+    '''
+        Accent-folded, lowercase alphanumeric tokens of text, so that
+        "Ações" and "ACOES" give the same token.
+
+        RETURNS
+        A list of str
+    '''
+    if not text:
+        return list()
+    folded = unicodedata.normalize('NFKD', str(text))
+    folded = ''.join(char for char in folded if not unicodedata.combining(char)).lower()
+    return [token for token in _SPLIT.split(folded) if token]
+
+class SearchIndex():
+    '''
+        In-memory inverted index of the NOME, GESTOR and ADMIN of the funds in the
+        cadastro: every normalized token points to the funds containing it and the
+        weight of its field. A sorted list of the tokens answers prefix queries
+        with a binary search.
+
+        The index follows the cadastro shared by the workers when there is one,
+        otherwise the local cadastro snapshot. When the source changes only the
+        funds whose indexed fields changed are updated.
+    '''
+    def __init__(self) -> None:
+        self._postings = dict()
+        self._vocabulary = list()
+        self._documents = dict()
+        self._source = None
+        self._lock = threading.Lock()
+
+    def _current_source(self):
+        '''The shared cadastro table when there is one, otherwise the local cadastro records'''
+        table = shared_snapshot.cadastro.table() if shared_snapshot.cadastro is not None else None
+        return table if table is not None else cadastro.records()
+
+    def _records(self, source):
+        '''(CNPJ, indexed fields) pairs of the funds in source'''
+        if isinstance(source, dict):
+            return ((cnpj, tuple(record.get(field) for field in SEARCH_FIELDS)) for cnpj, record in source.items())
+
+        rows = source.select(['CNPJ'] + list(SEARCH_FIELDS)).to_pydict()
+        return zip(rows['CNPJ'], zip(*[rows[field] for field in SEARCH_FIELDS]))
+
+    def sync(self) -> int:
+        '''
+            Brings the index up to date with the cadastro.
+
+            RETURNS
+            The number of funds added, changed or removed
+        '''
+        source = self._current_source()
+        if source is self._source:
+            return 0
+
+        with self._lock:
+            if source is self._source:
+                return 0
+
+            changed = 0
+            seen = set()
+            vocabulary_changed = False
+            for cnpj, fields in self._records(source):
+                seen.add(cnpj)
+                if self._documents.get(cnpj) == fields:
+                    continue
+                vocabulary_changed |= self._remove(cnpj)
+                vocabulary_changed |= self._add(cnpj, fields)
+                changed += 1
+
+            for cnpj in [cnpj for cnpj in self._documents if cnpj not in seen]:
+                vocabulary_changed |= self._remove(cnpj)
+                changed += 1
+
+            if vocabulary_changed:
+                self._vocabulary = sorted(self._postings)
+            self._source = source
+
+        logger.info('Search index updated: %d funds changed, %d indexed', changed, len(self._documents))
+        return changed
+
+    def _add(self, cnpj: str, fields: tuple) -> bool:
+        new_token = False
+        for field, text in zip(SEARCH_FIELDS, fields):
+            for token in set(normalize(text)):
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = dict()
+                    new_token = True
+                postings[cnpj] = postings.get(cnpj, 0.0) + SEARCH_FIELDS[field]
+        self._documents[cnpj] = fields
+        return new_token
+
+    def _remove(self, cnpj: str) -> bool:
+        fields = self._documents.pop(cnpj, None)
+        if fields is None:
+            return False
+
+        removed_token = False
+        for text in fields:
+            for token in set(normalize(text)):
+                postings = self._postings.get(token)
+                if postings is None or postings.pop(cnpj, None) is None:
+                    continue
+                if not postings:
+                    del self._postings[token]
+                    removed_token = True
+        return removed_token
+
+    def _tokens(self, term: str) -> list:
+        '''Indexed tokens equal to or starting with term, with the weight of a match on them'''
+        tokens = list()
+        position = bisect.bisect_left(self._vocabulary, term)
+        while position < len(self._vocabulary) and self._vocabulary[position].startswith(term):
+            token = self._vocabulary[position]
+            idf = math.log(1 + len(self._documents) / len(self._postings[token]))
+            tokens.append((self._postings[token], (1.0 if token == term else PREFIX_WEIGHT) * idf))
+            position += 1
+        return tokens
+
+    def _scores(self, tokens: list, candidates=None) -> dict:
+        '''
+            Best score of each fund on the tokens of a term. With candidates, only those
+            funds are looked up in the postings instead of walking all of them.
+        '''
+        scores = dict()
+        if candidates is None:
+            for postings, weight in tokens:
+                for cnpj, field_weight in postings.items():
+                    if field_weight * weight > scores.get(cnpj, 0.0):
+                        scores[cnpj] = field_weight * weight
+            return scores
+
+        for cnpj in candidates:
+            for postings, weight in tokens:
+                field_weight = postings.get(cnpj)
+                if field_weight is not None and field_weight * weight > scores.get(cnpj, 0.0):
+                    scores[cnpj] = field_weight * weight
+        return scores
+
+    def search(self, query: str, limit: int) -> list:
+        '''
+            Funds matching every term of query, each term as a whole token or as a prefix.
+            A term scores the weight of the fields it matched times its inverse document
+            frequency, whole tokens weigh more than prefixes.
+
+            RETURNS
+            A list of (CNPJ, score) sorted by descending score, at most limit long
+        '''
+        self.sync()
+        terms = list(dict.fromkeys(normalize(query)))
+        if not terms:
+            return list()
+
+        with self._lock:
+            # Only the rarest term walks its postings, the funds it matched are then
+            # looked up in the postings of the other terms
+            matches = sorted((self._tokens(term) for term in terms), key=lambda tokens: sum(len(postings) for postings, _ in tokens))
+            scores = self._scores(matches[0])
+            for tokens in matches[1:]:
+                if not scores:
+                    break
+                term_scores = self._scores(tokens, scores)
+                scores = {cnpj: score + term_scores[cnpj] for cnpj, score in scores.items() if cnpj in term_scores}
+            names = {cnpj: self._documents[cnpj][0] or '' for cnpj in scores}
+
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], names[item[0]], item[0]))
+
+search_index = SearchIndex()
+
+def search_records(query: str, limit: int) -> list:
+    '''
+        The cadastro records of the best matches of query, best first, each with its SCORE.
+        Raises CadastroUnavailableError when the cadastro can not be loaded.
+
+        RETURNS
+        A list of dict
+    '''
+    ranked = search_index.search(query, limit)
+    records = {record['CNPJ']: record for record in load_funds_data([cnpj for cnpj, _ in ranked]) or list()}
+    return [dict(records[cnpj], SCORE=round(score, 4)) for cnpj, score in ranked if cnpj in records]
+
+def search_funds(query: str, limit: int=settings.SEARCH_LIMIT) -> Response:
+    '''
+        Searches the cadastro by NOME, GESTOR and ADMIN.
+
+        RETURNS
+        The cadastro records of the best matches, best first, each with its SCORE
+    '''
+    if not normalize(query):
+        return respond({
+            'msg': 'The search needs at least one letter or digit in q',
+            'error': True,
+            'data': None
+        }, HTTPStatus.BAD_REQUEST, root='funds')
+
+    try:
+        results = search_records(query, limit)
+    except CadastroUnavailableError as error:
+        logger.error('%s', error)
+        return respond({
+            'msg': f'{error}',
+            'error': True,
+            'data': None
+        }, HTTPStatus.SERVICE_UNAVAILABLE, root='funds')
+
+    return respond({
+        'msg': f'Funds matching {query}',
+        'records': len(results),
+        'data': results
+    }, root='funds')
@@ -0,0 +1,93 @@
+import hashlib
+import logging
+
+import click
+from flask.cli import with_appcontext
+from mongoengine import ValidationError
+
+from br_funds import settings
+from .cadastro import cadastro
+from ..cache import response_cache, fund_tag, REGISTRY_TAG
+from ..database import connect_to_db, bulk_upsert
+from ..models.fund_model import Fund
+
+logger = logging.getLogger(__name__)
+
+# Fields of the Fund documents that come from the cadastro, in a fixed order for the hash
+CADASTRO_FIELDS = [field for field in Fund._fields if field not in ['id', 'CADASTRO_HASH']]
+
+def cadastro_hash(record: dict) -> str:
+    '''
+        Digest of the cadastro fields of a fund record, stored with the fund as
+        CADASTRO_HASH so a sync only has to compare it to find the funds that changed.
+
+        RETURNS
+        A hex str
+    '''
+    values = '\x1f'.join(str(record.get(field)) for field in CADASTRO_FIELDS)
+    return hashlib.blake2b(values.encode('utf-8'), digest_size=16).hexdigest()
+
+def sync_funds(refresh: bool=True, batch_size: int=settings.FUNDS_SYNC_BATCH_SIZE) -> dict:
+    '''
+        Brings the funds in the DB up to date with the CVM cadastro. Only the CNPJ and
+        CADASTRO_HASH of the stored funds are read, and only the funds whose hash
+        differs from the one of their current record are written, in bulk batches of
+        batch_size. With refresh the cadastro is reloaded first (a conditional request,
+        so an unchanged file is not downloaded again).
+
+        RETURNS
+        A dict with the number of funds updated, unchanged, failed and missing from the cadastro
+    '''
+    connect_to_db()
+    # A single conditional request, the records are rebuilt only when the file changed
+    if refresh:
+        cadastro.refresh()
+    records = cadastro.records(refresh=False)
+
+    collection = Fund._get_collection()
+    stored = {fund['CNPJ']: fund.get('CADASTRO_HASH') for fund in collection.find({}, {'_id': 0, 'CNPJ': 1, 'CADASTRO_HASH': 1})}
+
+    counts = {'funds': len(stored), 'updated': 0, 'unchanged': 0, 'failed': 0, 'missing': 0}
+    documents = list()
+    for record in [records[cnpj] for cnpj in stored if cnpj in records]:
+        digest = cadastro_hash(record)
+        if stored[record['CNPJ']] == digest:
+            counts['unchanged'] += 1
+            continue
+
+        fund = Fund(CADASTRO_HASH=digest, **record)
+        try:
+            fund.validate()
+        except ValidationError as error:
+            logger.warning('%s not synced: %s', fund.CNPJ, error)
+            counts['failed'] += 1
+            continue
+        document = fund.to_mongo().to_dict()
+        document.pop('_id', None)
+        documents.append(document)
+    counts['missing'] = counts['funds'] - counts['unchanged'] - counts['failed'] - len(documents)
+
+    changed = list()
+    for result in bulk_upsert(collection, documents, ['CNPJ'], batch_size=batch_size, skip_unchanged=False):
+        if result['status'] == 'failed':
+            logger.warning('%s not synced: %s', result['CNPJ'], result.get('msg'))
+            counts['failed'] += 1
+        else:
+            changed.append(result['CNPJ'])
+    counts['updated'] = len(changed)
+
+    if changed:
+        response_cache.invalidate([fund_tag(cnpj) for cnpj in changed] + [REGISTRY_TAG])
+
+    logger.info('Funds synced with the cadastro: %s', counts)
+    return counts
+
+@click.command('sync-funds')
+@click.option('--batch-size', default=settings.FUNDS_SYNC_BATCH_SIZE, show_default=True, help='Funds updated per bulk write')
+@click.option('--no-refresh', is_flag=True, help='Use the cadastro snapshot as it is instead of checking CVM for a new file')
+@with_appcontext
+def sync_funds_command(batch_size, no_refresh):
+    '''Updates the funds in the DB whose record in the CVM cadastro changed'''
+    counts = sync_funds(refresh=not no_refresh, batch_size=batch_size)
+    click.echo(f'Funds: {counts["funds"]}, updated: {counts["updated"]}, unchanged: {counts["unchanged"]}'
+        f', failed: {counts["failed"]}, not in the cadastro: {counts["missing"]}')
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from br_funds import settings
+from br_funds.database import get_db
+from br_funds.models.job_model import Job
+
+logger = logging.getLogger(__name__)
+
+# Internal fields left out of what the API returns
+_HIDDEN_FIELDS = ('KEY', 'ACTIVE_KEY', 'PARAMS')
+
+class JobAbandonedError(Exception):
+    def __init__(self, job_id) -> None:
+        super().__init__(f'Job {job_id} was given up as stale, it stopped')
+        self.job_id = job_id
+
+class TooManyJobsError(Exception):
+    def __init__(self, pending: int) -> None:
+        super().__init__(f'Too many jobs waiting to run ({pending}), try again later')
+        self.pending = pending
+
+def _projection() -> dict:
+    # A new dict on every query, drivers may add _id to the one they are given
+    return {field: 0 for field in _HIDDEN_FIELDS}
+
+def job_key(*parts) -> str:
+    '''Identifies a batch by its parts, jobs with the same key are coalesced'''
+    return hashlib.blake2b(json.dumps(parts, default=str).encode('utf-8'), digest_size=16).hexdigest()
+
+class JobRunner():
+    '''
+        Runs batches too large for a request in a bounded pool of background threads:
+        JOBS_WORKERS at a time per process, with at most JOBS_MAX_PENDING accepted and
+        not finished. The state of the jobs lives in the Job collection, so any worker
+        can report it, and a batch submitted while an identical one is queued or
+        running gets the existing job instead of a new one.
+
+        A job that made no progress for JOBS_STALE_AFTER seconds (its process died or
+        it waited too long in the queue) is marked failed when the same batch is
+        submitted again. A job only starts, and only records progress, while its
+        status is the one it expects, so a job given up this way stops instead of
+        writing the same funds as its replacement.
+    '''
+    def __init__(self) -> None:
+        self.workers = settings.JOBS_WORKERS
+        self.max_pending = settings.JOBS_MAX_PENDING
+        self.stale_after = settings.JOBS_STALE_AFTER
+        self._app = None
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.workers = app.config.get('JOBS_WORKERS', self.workers)
+        self.max_pending = app.config.get('JOBS_MAX_PENDING', self.max_pending)
+        self.stale_after = app.config.get('JOBS_STALE_AFTER', self.stale_after)
+        self._app = app
+        app.extensions['jobs'] = self
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # Created on the first job, after gunicorn forked the worker
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='br_funds-job')
+        return self._executor
+
+    def submit(self, kind: str, key: str, params: dict, total: int, function) -> tuple:
+        '''
+            Queues function(params, progress) as a job, unless a job with the same key
+            is queued or running. function calls progress(processed, results) as it goes
+            and returns the summary of the job.
+            Raises TooManyJobsError when the pool is full and DBParametersError.
+
+            RETURNS
+            A tuple with the job and True when it was created, False when it already existed
+        '''
+        get_db()
+        collection = Job._get_collection()
+        existing = self._active(collection, key)
+        if existing is not None:
+            return existing, False
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise TooManyJobsError(self._pending)
+            self._pending += 1
+
+        now = datetime.utcnow()
+        job = {
+            '_id': ObjectId(),
+            'KEY': key,
+            'ACTIVE_KEY': key,
+            'KIND': kind,
+            'STATUS': 'queued',
+            'PARAMS': params,
+            'TOTAL': total,
+            'PROCESSED': 0,
+            'SUMMARY': dict(),
+            'RESULTS': list(),
+            'CREATED_AT': now,
+            'UPDATED_AT': now
+        }
+        try:
+            collection.insert_one(job)
+        except DuplicateKeyError:
+            # Another worker submitted the same batch in the meantime
+            self._release()
+            existing = collection.find_one({'ACTIVE_KEY': key}, _projection())
+            if existing is None:
+                return self.submit(kind, key, params, total, function)
+            return existing, False
+        except Exception:
+            self._release()
+            raise
+
+        self.executor.submit(self._run, job['_id'], params, function)
+        logger.info('Job %s (%s, %d items) queued', job['_id'], kind, total)
+        return {field: value for field, value in job.items() if field not in _HIDDEN_FIELDS}, True
+
+    def get(self, job_id: str) -> dict:
+        '''
+            RETURNS
+            The job with the results of the items processed so far, None when not found
+        '''
+        try:
+            object_id = ObjectId(job_id)
+        except (InvalidId, TypeError):
+            return None
+
+        get_db()
+        return Job._get_collection().find_one({'_id': object_id}, _projection())
+
+    def _active(self, collection, key: str) -> dict:
+        job = collection.find_one({'ACTIVE_KEY': key}, _projection())
+        if job is None or job['UPDATED_AT'] >= datetime.utcnow() - timedelta(seconds=self.stale_after):
+            return job
+
+        logger.warning('Job %s made no progress since %s, marking it failed', job['_id'], job['UPDATED_AT'])
+        collection.update_one({'_id': job['_id'], 'UPDATED_AT': job['UPDATED_AT']}, {
+            '$set': {'STATUS': 'failed', 'ERROR': 'The job stopped making progress', 'FINISHED_AT': datetime.utcnow()},
+            '$unset': {'ACTIVE_KEY': ''}
+        })
+        return None
+
+    def _release(self) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def _run(self, job_id: ObjectId, params: dict, function) -> None:
+        collection = Job._get_collection()
+
+        def progress(processed: int, results: list) -> None:
+            result = collection.update_one({'_id': job_id, 'STATUS': 'running'}, {
+                '$set': {'PROCESSED': processed, 'UPDATED_AT': datetime.utcnow()},
+                '$push': {'RESULTS': {'$each': results}}
+            })
+            if not result.matched_count:
+                raise JobAbandonedError(job_id)
+
+        try:
+            with self._app.app_context():
+                started = collection.update_one({'_id': job_id, 'STATUS': 'queued'}, {'$set': {'STATUS': 'running', 'UPDATED_AT': datetime.utcnow()}})
+                if not started.matched_count:
+                    raise JobAbandonedError(job_id)
+                summary = function(params, progress)
+            self._finish(collection, job_id, {'STATUS': 'done', 'SUMMARY': summary})
+            logger.info('Job %s done: %s', job_id, summary)
+        except JobAbandonedError as err:
+            logger.warning('%s', err)
+        except Exception as err:
+            logger.exception('Job %s failed', job_id)
+            self._finish(collection, job_id, {'STATUS': 'failed', 'ERROR': f'{err}'})
+        finally:
+            self._release()
+
+    def _finish(self, collection, job_id: ObjectId, fields: dict) -> None:
+        now = datetime.utcnow()
+        fields.update({'UPDATED_AT': now, 'FINISHED_AT': now})
+        # A job given up as stale keeps the failure it was given
+        collection.update_one({'_id': job_id, 'STATUS': {'$in': ['queued', 'running']}}, {'$set': fields, '$unset': {'ACTIVE_KEY': ''}})
+
+jobs = JobRunner()
@@ -0,0 +1,41 @@
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+from br_funds import settings
+
+LOG_FORMAT = '[%(asctime)s] %(levelname)s %(process)d %(name)s: %(message)s'
+
+_listener = None
+
+def setup_logging(app=None) -> logging.Logger:
+    '''
+        Configures the br_funds logger. Records are put on an in-memory queue and
+        written to stderr by a background thread, so a request never waits on the
+        stream. The level is LOG_LEVEL from the app config or the settings.
+        Calling it again only updates the level.
+
+        RETURNS
+        The br_funds logger
+    '''
+    global _listener
+
+    config = app.config if app is not None else dict()
+    logger = logging.getLogger('br_funds')
+    logger.setLevel(str(config.get('LOG_LEVEL', settings.LOG_LEVEL)).upper())
+
+    if _listener is None:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        records = queue.SimpleQueue()
+        _listener = QueueListener(records, handler, respect_handler_level=True)
+        _listener.start()
+        # Flushes what is still queued when the process exits
+        atexit.register(_listener.stop)
+
+        logger.addHandler(QueueHandler(records))
+        logger.propagate = False
+
+    return logger
@@ -0,0 +1,181 @@
+import bisect
+import threading
+import time
+
+from flask import g, request
+from pymongo import monitoring
+
+from br_funds import settings
+from br_funds.cache import response_cache
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+SIZE_BUCKETS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216]
+
+def _labels_text(names: tuple, values: tuple, extra: str='') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter():
+    '''Monotonic counter per combination of label values'''
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: tuple=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount: float=1) -> None:
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def samples(self) -> list:
+        with self._lock:
+            return [(self.name, _labels_text(self.labels, values), value) for values, value in sorted(self._values.items())]
+
+class Histogram():
+    '''Cumulative histogram per combination of label values, observe is a bisect and three additions'''
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple=(), buckets: list=LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = list(buckets)
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *values) -> None:
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(values)
+            if series is None:
+                # One count per bucket plus +Inf, then the sum
+                series = self._values[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[position] += 1
+            series[-1] += value
+
+    def samples(self) -> list:
+        with self._lock:
+            items = [(values, list(series)) for values, series in sorted(self._values.items())]
+
+        samples = list()
+        for values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float('inf')], series[:-1]):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', _labels_text(self.labels, values, f'le="{_number(float(bound))}"'), cumulative))
+            samples.append((f'{self.name}_sum', _labels_text(self.labels, values), series[-1]))
+            samples.append((f'{self.name}_count', _labels_text(self.labels, values), cumulative))
+        return samples
+
+class Gauge():
+    '''Value read by a function when the metrics are collected, kind is counter when it only grows'''
+    def __init__(self, name: str, documentation: str, function, kind: str='gauge') -> None:
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.kind = kind
+
+    def samples(self) -> list:
+        return [(self.name, '', self.function())]
+
+class CommandListener(monitoring.CommandListener):
+    '''Counts and times every command sent by the pymongo clients, successful or not'''
+    def __init__(self, metrics) -> None:
+        self.metrics = metrics
+
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        self.metrics.mongo_commands.inc(event.command_name, 'success')
+        self.metrics.mongo_duration.observe(event.duration_micros / 1e6, event.command_name)
+
+    def failed(self, event) -> None:
+        self.metrics.mongo_commands.inc(event.command_name, 'failure')
+        self.metrics.mongo_duration.observe(event.duration_micros / 1e6, event.command_name)
+
+class Metrics():
+    '''
+        Process-wide registry of the metrics exposed at /metrics in the Prometheus
+        text format: latency, status and size of the responses by route, the
+        commands sent to MongoDB, the cadastro download and parse times and the
+        response cache counters.
+        Each gunicorn worker keeps its own registry, the pid label tells them apart.
+    '''
+    def __init__(self) -> None:
+        self.enabled = settings.METRICS_ENABLED
+        self._listener = None
+        self.requests = Counter('http_requests_total', 'Responses by route, method and status', ('route', 'method', 'status'))
+        self.latency = Histogram('http_request_duration_seconds', 'Time to build the response, streamed bodies excluded', ('route', 'method'))
+        self.size = Histogram('http_response_size_bytes', 'Size of the non-streamed response bodies', ('route', 'method'), SIZE_BUCKETS)
+        self.mongo_commands = Counter('mongodb_commands_total', 'Commands sent to MongoDB', ('command', 'outcome'))
+        self.mongo_duration = Histogram('mongodb_command_duration_seconds', 'Duration of the commands sent to MongoDB', ('command',))
+        self.cadastro_download = Histogram('cadastro_download_seconds', 'Download of cad_fi.csv from CVM', buckets=[0.5, 1, 2.5, 5, 10, 30, 60, 120])
+        self.cadastro_parse = Histogram('cadastro_parse_seconds', 'Parse of cad_fi.csv', buckets=[0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30])
+        self.collectors = [self.requests, self.latency, self.size, self.mongo_commands, self.mongo_duration
+            , self.cadastro_download, self.cadastro_parse
+            , Gauge('response_cache_hits_total', 'Requests answered from the response cache', lambda: response_cache.hits, 'counter')
+            , Gauge('response_cache_misses_total', 'Requests not found in the response cache', lambda: response_cache.misses, 'counter')
+            , Gauge('response_cache_entries', 'Entries in the response cache', lambda: len(response_cache))
+            , Gauge('response_cache_bytes', 'Size of the bodies in the response cache', lambda: response_cache.size)
+            ]
+
+    def init_app(self, app) -> None:
+        self.enabled = app.config.get('METRICS_ENABLED', self.enabled)
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+
+        # Global listeners only reach the clients created after they are registered,
+        # the DB connects on the first request
+        if self._listener is None:
+            self._listener = CommandListener(self)
+            monitoring.register(self._listener)
+
+        app.before_request(self._start_timer)
+        app.after_request(self._record)
+
+    def _start_timer(self) -> None:
+        g.metrics_started_at = time.perf_counter()
+
+    def _record(self, resp):
+        started_at = g.pop('metrics_started_at', None)
+        if started_at is None:
+            return resp
+
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        self.requests.inc(route, request.method, str(resp.status_code))
+        self.latency.observe(time.perf_counter() - started_at, route, request.method)
+        if not resp.is_streamed:
+            self.size.observe(resp.calculate_content_length() or 0, route, request.method)
+        return resp
+
+    def observe_cadastro(self, histogram: Histogram, started_at: float) -> None:
+        if self.enabled:
+            histogram.observe(time.perf_counter() - started_at)
+
+    def render(self, pid: int) -> str:
+        '''The metrics in the Prometheus text exposition format (version 0.0.4)'''
+        lines = list()
+        for collector in self.collectors:
+            lines.append(f'# HELP {collector.name} {collector.documentation}')
+            lines.append(f'# TYPE {collector.name} {collector.kind}')
+            for name, labels, value in collector.samples():
+                labels = labels[:-1] + f',pid="{pid}"}}' if labels else f'{{pid="{pid}"}}'
+                lines.append(f'{name}{labels} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
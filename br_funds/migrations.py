@@ -0,0 +1,61 @@
+import click
+from flask.cli import with_appcontext
+from pymongo import UpdateOne
+
+from br_funds.database import connect_to_db
+from br_funds.models.fund_model import Fund
+from br_funds.models.quote_model import Quote, LatestQuote
+from br_funds.utils import parse_date, parse_float, parse_int
+
+QUOTE_CONVERTERS = {
+    'DATA': parse_date
+    , 'VALOR_QUOTA': parse_float
+    , 'VALOR_PATRIMONIAL': parse_float
+    , 'CAPTACAO_DIA': parse_float
+    , 'RESGATE_DIA': parse_float
+    , 'COTISTAS': parse_int
+}
+
+TYPED_FIELDS = [
+    (Fund, {'DATA_INICIO': parse_date, 'TAXA_ADM': parse_float})
+    , (Quote, QUOTE_CONVERTERS)
+    , (LatestQuote, QUOTE_CONVERTERS)
+]
+
+def migrate_collection(document, converters: dict, batch_size: int) -> int:
+    '''
+        Converts the fields still stored as strings in the collection of the
+        document class, writing them back in bulk batches of batch_size.
+
+        RETURNS
+        The number of documents converted
+    '''
+    collection = document._get_collection()
+    query = {'$or': [{field: {'$type': 'string'}} for field in converters]}
+    projection = {field: 1 for field in converters}
+
+    migrated = 0
+    operations = list()
+    for record in collection.find(query, projection, batch_size=batch_size):
+        update = {field: converter(record[field]) for field, converter in converters.items() if isinstance(record.get(field), str)}
+        operations.append(UpdateOne({'_id': record['_id']}, {'$set': update}))
+        if len(operations) >= batch_size:
+            collection.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+            operations = list()
+
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+        migrated += len(operations)
+
+    return migrated
+
+@click.command('migrate-types')
+@click.option('--batch-size', default=1000, show_default=True, help='Documents converted per bulk write')
+@with_appcontext
+def migrate_types_command(batch_size):
+    '''Converts the dates and numbers of Fund and Quote documents stored as strings to typed values'''
+    connect_to_db()
+    for document, converters in TYPED_FIELDS:
+        migrated = migrate_collection(document, converters, batch_size)
+        click.echo(f'{document.__name__}: {migrated} documents converted')
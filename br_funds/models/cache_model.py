@@ -0,0 +1,20 @@
+from mongoengine import DateTimeField, Document, ListField, StringField
+
+# Longer than any cache TTL, older invalidations can not match a live entry
+INVALIDATION_RETENTION = 24 * 60 * 60
+
+class CacheInvalidation(Document):
+    '''
+        Tags dropped from the response cache (see br_funds.cache). Every process
+        caching responses reads the ones published since its last check, so an
+        invalidation by one gunicorn worker or CLI command reaches all of them.
+    '''
+    TAGS = ListField(StringField())
+    CREATED_AT = DateTimeField()
+
+    meta = {
+        'collection': 'cache_invalidation',
+        'indexes': [
+            {'fields': ['CREATED_AT'], 'expireAfterSeconds': INVALIDATION_RETENTION}
+        ]
+    }
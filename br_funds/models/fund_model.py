@@ -1,5 +1,5 @@
 from enum import unique
-from mongoengine import Document, StringField
+from mongoengine import DateField, Document, FloatField, StringField
 
 class Fund(Document):
     CNPJ = StringField(unique=True)
@@ -7,8 +7,8 @@ class Fund(Document):
     FUNDO_TIPO = StringField()
     FUNDO_CLASSE = StringField()
     STATUS = StringField()
-    DATA_INICIO = StringField()
-    TAXA_ADM = StringField()
+    DATA_INICIO = DateField()
+    TAXA_ADM = FloatField()
     TAXA_PERFORMANCE = StringField()
     INVESTIDOR_QUALIFICADO = StringField()
     INVESTIDOR_PROFISSIONAL = StringField()
@@ -16,6 +16,20 @@ class Fund(Document):
     ADMIN = StringField()
     GESTOR_CNPJ = StringField()
     GESTOR = StringField()
+    # Digest of the fields above as read from the cadastro, see br_funds.funds.sync
+    CADASTRO_HASH = StringField()
+
+    # The filters of /funds/ match on one field and page by _id, so each one
+    # is an index scan already in the order of the pages
+    meta = {
+        'indexes': [
+            {'fields': ['FUNDO_CLASSE', 'id']}
+            , {'fields': ['FUNDO_TIPO', 'id']}
+            , {'fields': ['STATUS', 'id']}
+            , {'fields': ['GESTOR_CNPJ', 'id']}
+            , {'fields': ['ADMIN_CNPJ', 'id']}
+        ]
+    }
 
 if __name__ == '__main__':
     pass
\ No newline at end of file
@@ -0,0 +1,33 @@
+from mongoengine import DateTimeField, DictField, Document, IntField, ListField, StringField
+
+# Finished jobs are dropped by MongoDB after a week
+JOB_RETENTION = 7 * 24 * 60 * 60
+
+class Job(Document):
+    '''
+        Batch of funds saved in the background (see br_funds.jobs). KEY identifies
+        the batch, ACTIVE_KEY holds it while the job is queued or running, so the
+        unique index lets a single job per batch be active across the workers.
+        RESULTS gets the status of each CNPJ as the chunks of the batch are saved.
+    '''
+    KEY = StringField()
+    ACTIVE_KEY = StringField()
+    KIND = StringField()
+    STATUS = StringField(choices=['queued', 'running', 'done', 'failed'])
+    PARAMS = DictField()
+    TOTAL = IntField()
+    PROCESSED = IntField()
+    SUMMARY = DictField()
+    RESULTS = ListField(DictField())
+    ERROR = StringField()
+    CREATED_AT = DateTimeField()
+    UPDATED_AT = DateTimeField()
+    FINISHED_AT = DateTimeField()
+
+    meta = {
+        'collection': 'job',
+        'indexes': [
+            {'fields': ['ACTIVE_KEY'], 'unique': True, 'sparse': True}
+            , {'fields': ['FINISHED_AT'], 'expireAfterSeconds': JOB_RETENTION}
+        ]
+    }
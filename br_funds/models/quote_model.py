@@ -1,13 +1,79 @@
-from mongoengine import Document, StringField
+from mongoengine import DateField, DateTimeField, Document, FloatField, IntField, ObjectIdField, StringField
 
 class Quote(Document):
     CNPJ = StringField()
-    DATA = StringField()
-    VALOR_QUOTA = StringField()
-    VALOR_PATRIMONIAL = StringField()
-    CAPTACAO_DIA = StringField()
-    RESGATE_DIA = StringField()
-    COTISTAS = StringField()
+    DATA = DateField()
+    VALOR_QUOTA = FloatField()
+    VALOR_PATRIMONIAL = FloatField()
+    CAPTACAO_DIA = FloatField()
+    RESGATE_DIA = FloatField()
+    COTISTAS = IntField()
+
+    meta = {
+        'indexes': [
+            {'fields': ['CNPJ', '-DATA']}
+        ]
+    }
+
+class LatestQuote(Document):
+    '''
+        Copy of the most recent Quote of each fund, kept up to date by the
+        quote ingestion so the latest quote is a point read by CNPJ.
+        The _id is the same as the Quote it was copied from.
+    '''
+    id = ObjectIdField(primary_key=True)
+    CNPJ = StringField(unique=True)
+    DATA = DateField()
+    VALOR_QUOTA = FloatField()
+    VALOR_PATRIMONIAL = FloatField()
+    CAPTACAO_DIA = FloatField()
+    RESGATE_DIA = FloatField()
+    COTISTAS = IntField()
+
+    meta = {
+        'collection': 'latest_quote'
+    }
+
+class QuoteIngestion(Document):
+    '''Last ingestion of each monthly daily report, used to skip files that did not change'''
+    MES = StringField(unique=True)
+    SOURCE = StringField()
+    ETAG = StringField()
+    LAST_MODIFIED = StringField()
+    ROWS = IntField()
+    DATA_INGESTAO = DateTimeField()
+
+    meta = {
+        'collection': 'quote_ingestion'
+    }
+
+class QuoteRollup(Document):
+    '''
+        Monthly (PERIODO M) and yearly (PERIODO Y) summary of the quotes of a fund,
+        kept up to date by the quote ingestion.
+        RETORNO is VALOR_QUOTA over COTA_INICIAL, the last quota of the previous
+        period (or the first one of the fund), and CAPTACAO_LIQUIDA is the sum of
+        CAPTACAO_DIA - RESGATE_DIA. VALOR_PATRIMONIAL and COTISTAS are the values
+        at the end of the period.
+    '''
+    CNPJ = StringField()
+    PERIODO = StringField(choices=['M', 'Y'])
+    INICIO = DateField()
+    FIM = DateField()
+    COTAS = IntField()
+    COTA_INICIAL = FloatField()
+    VALOR_QUOTA = FloatField()
+    RETORNO = FloatField()
+    CAPTACAO_LIQUIDA = FloatField()
+    VALOR_PATRIMONIAL = FloatField()
+    COTISTAS = IntField()
+
+    meta = {
+        'collection': 'quote_rollup',
+        'indexes': [
+            {'fields': ['CNPJ', 'PERIODO', 'INICIO'], 'unique': True}
+        ]
+    }
 
 if __name__ == '__main__':
     pass
\ No newline at end of file
@@ -0,0 +1,133 @@
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+from flask import g, request
+
+from br_funds import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+REPORT_HEADER = 'X-Profile-Report'
+
+_UNSAFE_CHARS = re.compile(r'[^A-Za-z0-9_.-]+')
+
+class RequestProfiler():
+    '''
+        Opt-in cProfile of single requests. A request is profiled when it sends the
+        X-Profile header with PROFILE_TOKEN, or at random with PROFILE_SAMPLE_RATE.
+
+        With PROFILE_DIR the profile is stored there, as a .prof file for pstats or
+        snakeviz plus a .txt report, and the file name is sent in X-Profile-Report.
+        Without it, a request that asked with the header gets the text report as
+        its body and the sampled ones are logged.
+
+        Only one request per process is profiled at a time, the others run as usual.
+        Streamed bodies are generated after the profile is taken.
+    '''
+    def __init__(self) -> None:
+        self.token = settings.PROFILE_TOKEN
+        self.sample_rate = settings.PROFILE_SAMPLE_RATE
+        self.directory = settings.PROFILE_DIR
+        self.sort = settings.PROFILE_SORT
+        self.limit = settings.PROFILE_LIMIT
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.token = app.config.get('PROFILE_TOKEN', self.token)
+        self.sample_rate = app.config.get('PROFILE_SAMPLE_RATE', self.sample_rate)
+        self.directory = app.config.get('PROFILE_DIR', self.directory)
+        self.sort = app.config.get('PROFILE_SORT', self.sort)
+        self.limit = app.config.get('PROFILE_LIMIT', self.limit)
+        app.extensions['profiler'] = self
+        if not self.token and not self.sample_rate:
+            return
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._stop)
+
+    def requested(self) -> bool:
+        '''True when the request sent the profiling token'''
+        value = request.headers.get(PROFILE_HEADER)
+        return bool(self.token and value) and hmac.compare_digest(value.encode(), self.token.encode())
+
+    def _start(self) -> None:
+        requested = self.requested()
+        if not requested and not (self.sample_rate and random.random() < self.sample_rate):
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as err:
+            # Another profiler (e.g. a debugger) is already active in this process
+            self._lock.release()
+            logger.warning('Could not profile %s: %s', request.path, err)
+            return
+        g.profile = (profile, requested, time.perf_counter())
+
+    def _stop(self, exc=None):
+        entry = g.pop('profile', None)
+        if entry is not None:
+            entry[0].disable()
+            self._lock.release()
+        return entry
+
+    def _finish(self, resp):
+        entry = self._stop()
+        if entry is None:
+            return resp
+
+        profile, requested, started_at = entry
+        report = self.report(profile, f'{request.method} {request.full_path.rstrip("?")} -> {resp.status_code}'
+            f' in {(time.perf_counter() - started_at) * 1000:.1f}ms')
+
+        if self.directory:
+            try:
+                resp.headers[REPORT_HEADER] = self.store(profile, report)
+            except OSError as err:
+                logger.warning('Could not store the request profile: %s', err)
+        elif requested:
+            resp.set_data(report)
+            resp.mimetype = 'text/plain'
+            resp.headers.pop('ETag', None)
+            resp.headers.pop('Content-Encoding', None)
+        else:
+            logger.info('Request profile\n%s', report)
+        return resp
+
+    def report(self, profile: cProfile.Profile, title: str) -> str:
+        '''The limit most expensive functions, ordered by sort'''
+        stream = io.StringIO()
+        stream.write(f'{title}\n')
+        pstats.Stats(profile, stream=stream).sort_stats(self.sort).print_stats(self.limit)
+        return stream.getvalue()
+
+    def store(self, profile: cProfile.Profile, report: str) -> str:
+        '''
+            Writes the profile and its report to the profile directory.
+
+            RETURNS
+            The name of the files, without the extension
+        '''
+        name = _UNSAFE_CHARS.sub('_', f'{datetime.now():%Y%m%dT%H%M%S%f}-{os.getpid()}-{request.method}-{request.path}').strip('_')
+        os.makedirs(self.directory, exist_ok=True)
+        profile.dump_stats(os.path.join(self.directory, f'{name}.prof'))
+        with open(os.path.join(self.directory, f'{name}.txt'), 'w') as report_file:
+            report_file.write(report)
+        logger.info('Request profile stored in %s', os.path.join(self.directory, name))
+        return name
+
+request_profiler = RequestProfiler()
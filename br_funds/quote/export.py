@@ -0,0 +1,122 @@
+import csv
+import io
+from itertools import islice
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from br_funds.serializers import format_date
+
+QUOTE_HISTORY_FIELDS = [
+    'DATA'
+    , 'VALOR_QUOTA'
+    , 'VALOR_PATRIMONIAL'
+    , 'CAPTACAO_DIA'
+    , 'RESGATE_DIA'
+    , 'COTISTAS'
+]
+
+QUOTE_HISTORY_SCHEMA = pa.schema([
+    ('DATA', pa.date32())
+    , ('VALOR_QUOTA', pa.float64())
+    , ('VALOR_PATRIMONIAL', pa.float64())
+    , ('CAPTACAO_DIA', pa.float64())
+    , ('RESGATE_DIA', pa.float64())
+    , ('COTISTAS', pa.int64())
+])
+
+class _ChunkSink():
+    '''File-like object collecting what pyarrow writes, so it can be yielded as it is produced'''
+    def __init__(self) -> None:
+        self.chunks = list()
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def pop(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = list()
+        return data
+
+def batches(rows, size: int):
+    '''Splits an iterable of rows in lists of up to size rows'''
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+def to_record_batch(rows: list) -> pa.RecordBatch:
+    columns = [pa.array([row.get(field.name) for row in rows], type=field.type) for field in QUOTE_HISTORY_SCHEMA]
+    return pa.RecordBatch.from_arrays(columns, schema=QUOTE_HISTORY_SCHEMA)
+
+def csv_batch(rows: list, header: bool=False) -> str:
+    '''The CSV lines of a batch of rows, preceded by the header line when header'''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        writer.writerow(QUOTE_HISTORY_FIELDS)
+    for row in rows:
+        values = [row.get(field) for field in QUOTE_HISTORY_FIELDS]
+        if values[0] is not None:
+            values[0] = format_date(values[0])
+        writer.writerow(values)
+    return buffer.getvalue()
+
+def generate_csv(rows, batch_size: int):
+    header = True
+    for batch in batches(rows, batch_size):
+        yield csv_batch(batch, header)
+        header = False
+    if header:
+        yield csv_batch(list(), header)
+
+class ArrowStream():
+    '''Arrow IPC stream fed one batch of rows at a time, each call returns the bytes it produced'''
+    def __init__(self) -> None:
+        self._sink = _ChunkSink()
+        self._writer = pa.ipc.new_stream(self._sink, QUOTE_HISTORY_SCHEMA)
+
+    def write(self, rows: list) -> bytes:
+        self._writer.write_batch(to_record_batch(rows))
+        return self._sink.pop()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._sink.pop()
+
+def generate_arrow(rows, batch_size: int):
+    '''Streams the rows in the Arrow IPC stream format, one record batch at a time'''
+    stream = ArrowStream()
+    for batch in batches(rows, batch_size):
+        yield stream.write(batch)
+    yield stream.close()
+
+class ParquetBuffer():
+    '''Parquet file built in memory one batch of rows at a time, the body is returned by close'''
+    def __init__(self) -> None:
+        self._buffer = io.BytesIO()
+        self._writer = pq.ParquetWriter(self._buffer, QUOTE_HISTORY_SCHEMA, compression='zstd')
+
+    def write(self, rows: list) -> None:
+        self._writer.write_batch(to_record_batch(rows))
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._buffer.getvalue()
+
+def build_parquet(rows, batch_size: int) -> bytes:
+    '''Parquet needs its footer at the end of the file, so the body is built before sending'''
+    parquet = ParquetBuffer()
+    for batch in batches(rows, batch_size):
+        parquet.write(batch)
+    return parquet.close()
@@ -0,0 +1,206 @@
+import logging
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from collections import Counter
+from datetime import datetime
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import click
+import pandas as pd
+from flask.cli import with_appcontext
+
+from br_funds import settings
+from br_funds.cache import response_cache, quote_tag
+from br_funds.database import bulk_upsert, connect_to_db
+from br_funds.models.fund_model import Fund
+from br_funds.models.quote_model import Quote, QuoteIngestion
+from br_funds.quote.quotes import update_latest_quotes
+from br_funds.quote.rollups import month_start, update_rollups
+from br_funds.utils import to_date_column, to_float_column, to_int_column
+
+logger = logging.getLogger(__name__)
+
+# CVM column -> Quote field. Reports from 2024 on use CNPJ_FUNDO_CLASSE.
+QUOTE_COLUMNS = {
+    'CNPJ_FUNDO': 'CNPJ'
+    , 'CNPJ_FUNDO_CLASSE': 'CNPJ'
+    , 'DT_COMPTC': 'DATA'
+    , 'VL_QUOTA': 'VALOR_QUOTA'
+    , 'VL_PATRIM_LIQ': 'VALOR_PATRIMONIAL'
+    , 'CAPTC_DIA': 'CAPTACAO_DIA'
+    , 'RESG_DIA': 'RESGATE_DIA'
+    , 'NR_COTST': 'COTISTAS'
+}
+
+class DailyReportNotFoundError(Exception):
+    def __init__(self, month, source) -> None:
+        super().__init__(f'No daily report for {month} in {source}')
+        self.month = month
+
+def normalize_month(month: str) -> str:
+    '''Accepts YYYYMM or YYYY-MM and returns YYYYMM'''
+    match = re.match(r'^(\d{4})-?(\d{2})$', month.strip())
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        raise click.BadParameter(f'Invalid month: {month}, expected YYYYMM or YYYY-MM')
+    return f'{match.group(1)}{match.group(2)}'
+
+def fetch_daily_report(month: str, source: str, ingestion: QuoteIngestion=None) -> tuple:
+    '''
+        Finds the inf_diario_fi_YYYYMM file (zip or csv) in a local directory or
+        under a base url. Remote files are fetched with a conditional request
+        and streamed to a temporary file.
+
+        RETURNS
+        A tuple (location, etag, last_modified, path, temporary),
+        path is None when the file did not change since the last ingestion
+    '''
+    for name in [f'inf_diario_fi_{month}.zip', f'inf_diario_fi_{month}.csv']:
+        if os.path.isdir(source):
+            path = os.path.join(source, name)
+            if not os.path.exists(path):
+                continue
+            last_modified = str(os.path.getmtime(path))
+            if ingestion and ingestion.SOURCE == path and ingestion.LAST_MODIFIED == last_modified:
+                return path, None, last_modified, None, False
+            return path, None, last_modified, path, False
+
+        url = f'{source.rstrip("/")}/{name}'
+        headers = dict()
+        if ingestion and ingestion.SOURCE == url:
+            if ingestion.ETAG:
+                headers['If-None-Match'] = ingestion.ETAG
+            if ingestion.LAST_MODIFIED:
+                headers['If-Modified-Since'] = ingestion.LAST_MODIFIED
+
+        try:
+            with urlopen(Request(url, headers=headers), timeout=settings.QUOTES_TIMEOUT) as resp:
+                with tempfile.NamedTemporaryFile(suffix=os.path.splitext(name)[1], delete=False) as tmp_file:
+                    shutil.copyfileobj(resp, tmp_file, 1024 * 1024)
+                return url, resp.headers.get('ETag'), resp.headers.get('Last-Modified'), tmp_file.name, True
+        except HTTPError as err:
+            if err.code == 304:
+                return url, ingestion.ETAG, ingestion.LAST_MODIFIED, None, False
+            if err.code == 404:
+                continue
+            raise
+
+    raise DailyReportNotFoundError(month, source)
+
+def read_daily_report(path: str, chunk_size: int):
+    '''
+        Reads a daily report (csv or zipped csv) in chunks of chunk_size rows,
+        only the columns mapped to the Quote fields are parsed.
+
+        RETURNS
+        A generator of pd.DataFrame with the Quote field names
+    '''
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if not member.lower().endswith('.csv'):
+                    continue
+                with archive.open(member) as csv_file:
+                    yield from _read_chunks(csv_file, chunk_size)
+    else:
+        yield from _read_chunks(path, chunk_size)
+
+def _read_chunks(source, chunk_size: int):
+    reader = pd.read_csv(source, delimiter=';', encoding='ISO-8859-1', dtype='str'
+        , usecols=lambda column: column in QUOTE_COLUMNS, chunksize=chunk_size)
+    with reader:
+        for chunk in reader:
+            chunk = chunk.rename(columns=QUOTE_COLUMNS)
+            yield convert_quote_types(chunk)
+
+def convert_quote_types(quotes: pd.DataFrame) -> pd.DataFrame:
+    '''
+        Converts the report columns to the types of the Quote fields.
+        Empty values become None.
+
+        RETURNS
+        pd.DataFrame
+    '''
+    quotes['DATA'] = to_date_column(quotes['DATA'])
+    for column in ['VALOR_QUOTA', 'VALOR_PATRIMONIAL', 'CAPTACAO_DIA', 'RESGATE_DIA']:
+        if column in quotes.columns:
+            quotes[column] = to_float_column(quotes[column])
+    if 'COTISTAS' in quotes.columns:
+        quotes['COTISTAS'] = to_int_column(quotes['COTISTAS'])
+
+    return quotes
+
+def ingest_month(month: str, source: str=None, force: bool=False) -> dict:
+    '''
+        Loads the quotes of one month for the funds registered in the DB.
+        Rows are upserted on (CNPJ, DATA), so running the same month again
+        only writes the rows that changed, and a file that did not change
+        since the last run is not even read. Only the rollups of the months
+        that got new or changed rows are recomputed.
+
+        RETURNS
+        A dict with the counts of rows by status
+    '''
+    month = normalize_month(month)
+    source = source or settings.QUOTES_SOURCE
+    connect_to_db()
+
+    ingestion = QuoteIngestion.objects(MES=month).first()
+    location, etag, last_modified, path, temporary = fetch_daily_report(month, source, None if force else ingestion)
+    if path is None:
+        logger.info('%s: %s did not change, skipping', month, location)
+        return {'month': month, 'source': location, 'skipped': True}
+
+    registered = set(Fund.objects.distinct('CNPJ'))
+    collection = Quote._get_collection()
+    counts = Counter()
+    touched = set()
+    periods = set()
+    rows = 0
+    try:
+        for chunk in read_daily_report(path, settings.QUOTES_CHUNK_SIZE):
+            rows += len(chunk)
+            chunk = chunk.loc[chunk['CNPJ'].isin(registered) & chunk['DATA'].notna()]
+            if chunk.empty:
+                continue
+
+            records = chunk.to_dict(orient='records')
+            for result in bulk_upsert(collection, records, ['CNPJ', 'DATA'], batch_size=settings.QUOTES_BATCH_SIZE):
+                counts[result['status']] += 1
+                if result['status'] in ['inserted', 'updated']:
+                    touched.add(result['CNPJ'])
+                    periods.add((result['CNPJ'], month_start(result['DATA'])))
+    finally:
+        if temporary:
+            os.remove(path)
+
+    if touched:
+        update_latest_quotes(touched)
+        update_rollups(periods)
+        response_cache.invalidate([quote_tag(cnpj) for cnpj in touched])
+
+    ingestion = ingestion or QuoteIngestion(MES=month)
+    ingestion.SOURCE = location
+    ingestion.ETAG = etag
+    ingestion.LAST_MODIFIED = last_modified
+    ingestion.ROWS = rows
+    ingestion.DATA_INGESTAO = datetime.utcnow()
+    ingestion.save()
+
+    summary = {'month': month, 'source': location, 'skipped': False, 'rows': rows, 'funds': len(touched)}
+    summary.update({status: counts[status] for status in ['inserted', 'updated', 'unchanged', 'failed']})
+    logger.info('%s: %s', month, summary)
+    return summary
+
+@click.command('ingest-quotes')
+@click.argument('months', nargs=-1, required=True)
+@click.option('--source', default=None, help='Local directory or base url with the inf_diario_fi_YYYYMM files')
+@click.option('--force', is_flag=True, help='Ingest the files even if they did not change')
+@with_appcontext
+def ingest_quotes_command(months, source, force):
+    '''Loads the CVM daily reports of the given months (YYYYMM) into the Quote collection'''
+    for month in months:
+        ingest_month(month, source=source, force=force)
@@ -0,0 +1,129 @@
+import logging
+import math
+from http import HTTPStatus
+
+import numpy as np
+import pandas as pd
+from flask import Response
+
+from br_funds.database import DBParametersError, connect_to_db
+from br_funds.models.quote_model import Quote
+from br_funds.quote.quotes import quote_history_query
+from br_funds.serializers import respond
+from br_funds.utils import InvalidCNPJError, validate_cnpj
+
+logger = logging.getLogger(__name__)
+
+# Business days in a year, the convention used by the CVM and ANBIMA
+PERIODS_PER_YEAR = 252
+
+SERIES_FIELDS = ['DATA', 'VALOR_QUOTA']
+
+def load_quote_series(cnpj: str, from_date: str=None, to_date: str=None) -> pd.Series:
+    '''
+        Reads only DATA and VALOR_QUOTA of the fund between from_date and to_date
+        (both inclusive).
+
+        RETURNS
+        pd.Series of VALOR_QUOTA indexed by DATA, in chronological order
+    '''
+    cursor = Quote._get_collection().find(*quote_history_query(cnpj, from_date, to_date, SERIES_FIELDS)).sort('DATA', 1)
+    return to_quote_series(list(cursor))
+
+def to_quote_series(rows: list) -> pd.Series:
+    '''Builds the VALOR_QUOTA series of the rows, missing and non-positive quotas are dropped'''
+    quotes = pd.DataFrame(rows, columns=SERIES_FIELDS)
+    quotes['VALOR_QUOTA'] = pd.to_numeric(quotes['VALOR_QUOTA'], errors='coerce')
+    quotes = quotes.loc[quotes['VALOR_QUOTA'] > 0]
+
+    return pd.Series(quotes['VALOR_QUOTA'].to_numpy(dtype='float64'), index=pd.DatetimeIndex(quotes['DATA']))
+
+def _finite(value) -> float:
+    '''NaN and inf are not valid JSON, they become None'''
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+def compute_performance(series: pd.Series, rate: float=0.0) -> dict:
+    '''
+        Computes the performance of a quota series over the whole period with
+        vectorized operations. rate is the annual risk free rate (0.1 for 10%)
+        used by the Sharpe ratio, volatility and Sharpe are annualised with
+        PERIODS_PER_YEAR.
+
+        RETURNS
+        A dict with the metrics, those that need more quotes than available are None
+    '''
+    values = series.to_numpy()
+    returns = values[1:] / values[:-1] - 1
+    periods = len(returns)
+
+    cumulative = values[-1] / values[0] - 1
+    annualised = (1 + cumulative) ** (PERIODS_PER_YEAR / periods) - 1 if periods else np.nan
+
+    volatility = returns.std(ddof=1) * math.sqrt(PERIODS_PER_YEAR) if periods > 1 else np.nan
+    excess = returns - ((1 + rate) ** (1 / PERIODS_PER_YEAR) - 1)
+    sharpe = excess.mean() / returns.std(ddof=1) * math.sqrt(PERIODS_PER_YEAR) if periods > 1 else np.nan
+
+    drawdowns = values / np.maximum.accumulate(values) - 1
+    trough = int(drawdowns.argmin())
+    peak = int(values[:trough + 1].argmax())
+
+    # Last quota of each month, months without quotes are kept as gaps so shift(12) is always a year
+    months = series.index.to_period('M')
+    monthly = series.groupby(months).last()
+    monthly = monthly.reindex(pd.period_range(months[0], months[-1], freq='M'))
+    rolling = (monthly / monthly.shift(12) - 1).dropna()
+
+    return {
+        'INICIO': series.index[0].date()
+        , 'FIM': series.index[-1].date()
+        , 'COTAS': len(values)
+        , 'RETORNO_ACUMULADO': _finite(cumulative)
+        , 'RETORNO_ANUALIZADO': _finite(annualised)
+        , 'VOLATILIDADE': _finite(volatility)
+        , 'TAXA_LIVRE_DE_RISCO': rate
+        , 'SHARPE': _finite(sharpe)
+        , 'DRAWDOWN_MAXIMO': _finite(drawdowns[trough])
+        , 'DRAWDOWN_PICO': series.index[peak].date()
+        , 'DRAWDOWN_VALE': series.index[trough].date()
+        , 'RETORNOS_12M': [{'MES': str(month), 'RETORNO': _finite(value)} for month, value in rolling.items()]
+    }
+
+def get_performance(cnpj: str, from_date: str=None, to_date: str=None, rate: float=0.0) -> Response:
+    '''
+        Performance metrics of a fund between from_date and to_date, computed
+        from the quote history in the DB.
+    '''
+    try:
+        cnpj = validate_cnpj([cnpj])[0]
+    except InvalidCNPJError as err:
+        logger.info('Invalid CNPJ: %s', cnpj)
+        return respond({
+            'msg': str(err),
+            'error': True,
+            'data': None
+        }, HTTPStatus.BAD_REQUEST, root='performance')
+
+    try:
+        connect_to_db()
+    except DBParametersError:
+        logger.error('Could not connect to the DB')
+        return respond({
+            'msg': 'Could not connect to the DB',
+            'error': True,
+            'data': None
+        }, HTTPStatus.INTERNAL_SERVER_ERROR, root='performance')
+
+    series = load_quote_series(cnpj, from_date, to_date)
+    if series.empty:
+        return respond({
+            'msg': f'Could not find any quotes for the fund {cnpj}',
+            'error': True,
+            'data': None
+        }, HTTPStatus.NOT_FOUND, root='performance')
+
+    return respond({
+        'msg': f'Performance of the fund {cnpj}',
+        'error': False,
+        'data': compute_performance(series, rate)
+    }, root='performance')
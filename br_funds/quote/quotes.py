@@ -1,9 +1,18 @@
+import logging
 from http import HTTPStatus
+from datetime import timedelta
+from itertools import chain
 from typing import List
-from flask import Response, jsonify
-from br_funds.database import DB, DBParametersError, connect_to_db
-from br_funds.models.quote_model import Quote
-from br_funds.utils import InvalidCNPJError, validate_cnpj
+from flask import Response, current_app, stream_with_context
+from br_funds.database import DBParametersError, connect_to_db
+from pymongo import DeleteMany, ReplaceOne
+from br_funds.models.quote_model import Quote, LatestQuote
+from br_funds.quote.export import QUOTE_HISTORY_FIELDS, generate_csv, generate_arrow, build_parquet
+from br_funds.serializers import MIMETYPES, respond, stream_response
+from br_funds.snapshot import shared_snapshot
+from br_funds.utils import InvalidCNPJError, validate_cnpj, validate_cnpjs, parse_date
+
+logger = logging.getLogger(__name__)
 
 
 def get_quotes(cnpj: str, from_date: str='1900-01-01', to_date: str='9999-12-31') -> List:
@@ -12,55 +21,224 @@ def get_quotes(cnpj: str, from_date: str='1900-01-01', to_date: str='9999-12-31'
     except DBParametersError:
         raise DBParametersError
 
-    results = list()
-    for quote in Quote.objects(CNPJ=cnpj, DATA__gte=from_date, DATA__lt=to_date).order_by('-DATA'):
-        result = quote.to_mongo().to_dict()
-        result['_id'] = str(result['_id'])
-        results.append(result)
+    query = {'CNPJ': cnpj, 'DATA': {'$gte': parse_date(from_date), '$lt': parse_date(to_date)}}
+    return list(Quote._get_collection().find(query).sort('DATA', -1))
+
+def latest_quotes_pipeline(cnpjs: List) -> List:
+    '''Aggregation returning the most recent Quote of each CNPJ, it walks the (CNPJ, -DATA) index'''
+    return [
+        {'$match': {'CNPJ': {'$in': cnpjs}}},
+        {'$sort': {'CNPJ': 1, 'DATA': -1}},
+        {'$group': {'_id': '$CNPJ', 'quote': {'$first': '$$ROOT'}}}
+    ]
+
+def find_latest_quote(cnpj: str) -> dict:
+    '''
+        Point read in the latest quotes shared by the workers or in the LatestQuote
+        collection, falling back to a single indexed sort + limit(1) over the quotes
+        when the fund is not there yet.
+
+        RETURNS
+        The quote as a dict or None
+    '''
+    shared = shared_snapshot.get_latest_quotes([cnpj])
+    if shared:
+        return shared[0]
+
+    quote = LatestQuote._get_collection().find_one({'CNPJ': cnpj})
+    if quote is None:
+        quote = Quote._get_collection().find_one({'CNPJ': cnpj}, sort=[('DATA', -1)])
+
+    return quote
+
+def update_latest_quotes(cnpjs: List) -> int:
+    '''
+        Refreshes the LatestQuote documents of the given funds from the Quote collection.
+
+        RETURNS
+        The number of funds updated
+    '''
+    operations = list()
+    for group in Quote._get_collection().aggregate(latest_quotes_pipeline(list(cnpjs))):
+        quote = group['quote']
+        operations.append(DeleteMany({'CNPJ': quote['CNPJ'], '_id': {'$ne': quote['_id']}}))
+        operations.append(ReplaceOne({'_id': quote['_id']}, quote, upsert=True))
+
+    if operations:
+        LatestQuote._get_collection().bulk_write(operations, ordered=True)
+
+    return len(operations) // 2
+
+def find_latest_quotes(cnpjs: List) -> dict:
+    '''
+        Batch version of find_latest_quote: a lookup in the shared latest quotes, one
+        $in read in LatestQuote and a single aggregation (group by CNPJ, max DATA)
+        for the funds not found at each step.
+
+        RETURNS
+        A dict of quotes by CNPJ, funds without quotes are left out
+    '''
+    results = {quote['CNPJ']: quote for quote in shared_snapshot.get_latest_quotes(cnpjs) or list()}
+
+    missing = [cnpj for cnpj in cnpjs if cnpj not in results]
+    if missing:
+        for quote in LatestQuote._get_collection().find({'CNPJ': {'$in': missing}}):
+            results[quote['CNPJ']] = quote
+
+    missing = [cnpj for cnpj in cnpjs if cnpj not in results]
+    if missing:
+        for group in Quote._get_collection().aggregate(latest_quotes_pipeline(missing)):
+            results[group['_id']] = group['quote']
 
     return results
 
+def get_latest_quotes(cnpjs: List) -> Response:
+    '''
+        Latest quote of each fund in cnpjs. Invalid CNPJs and funds without quotes
+        get their own entry with error set instead of failing the whole request.
+        The whole list is validated in one pass.
+    '''
+    if not cnpjs or not isinstance(cnpjs, list):
+        return respond({
+            'msg': str(InvalidCNPJError(cnpjs)),
+            'error': True,
+            'data': None
+        }, HTTPStatus.BAD_REQUEST, root='quotes')
+
+    entries = list()
+    for cnpj, normalized, error in zip(cnpjs, *validate_cnpjs(cnpjs)):
+        if error:
+            entries.append({'CNPJ': cnpj, 'error': True, 'msg': error, 'data': None})
+        else:
+            entries.append({'CNPJ': normalized})
+
+    try:
+        connect_to_db()
+    except DBParametersError:
+        logger.error('Could not connect to the DB')
+        return respond({
+            'msg': 'Could not connect to the DB',
+            'error': True,
+            'data': None
+        }, HTTPStatus.INTERNAL_SERVER_ERROR, root='quotes')
+
+    quotes = find_latest_quotes(list(dict.fromkeys(entry['CNPJ'] for entry in entries if 'error' not in entry)))
+
+    found = 0
+    for entry in entries:
+        if 'error' in entry:
+            continue
+        quote = quotes.get(entry['CNPJ'])
+        if quote is None:
+            entry.update({'error': True, 'msg': f'Could not find any quotes for the fund {entry["CNPJ"]}', 'data': None})
+        else:
+            entry.update({'error': False, 'data': quote})
+            found += 1
+
+    return respond({
+        'msg': f'Latest quotes for {found} of {len(entries)} funds',
+        'records': found,
+        'error': found < len(entries),
+        'data': entries
+    }, root='quotes')
+
 def get_latest_quote(cnpj: str) -> Response:
     try:
         cnpj = validate_cnpj([cnpj])[0]
     except InvalidCNPJError as err:
-        print(f'--> Invalid CNPJ: {cnpj}')
-        resp = jsonify({
+        logger.info('Invalid CNPJ: %s', cnpj)
+        return respond({
             'msg': str(err),
             'error': True,
             'data': None
-        })
-        resp.status_code = HTTPStatus.BAD_REQUEST
-        return resp
+        }, HTTPStatus.BAD_REQUEST, root='quote')
 
     try:
-        # results = get_quotes(cnpj, from_date='2021-06-01', to_date='2021-06-18')
-        results = get_quotes(cnpj)
+        connect_to_db()
     except DBParametersError:
-        print('--> Could not connect to the DB')
-        resp = jsonify({
+        logger.error('Could not connect to the DB')
+        return respond({
             'msg': 'Could not connect to the DB',
             'error': True,
             'data': None
-        })
-        resp.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-        return resp
+        }, HTTPStatus.INTERNAL_SERVER_ERROR, root='quote')
 
-    if not results:
-        print('dentro de if results')
-        resp = jsonify({
+    result = find_latest_quote(cnpj)
+    if not result:
+        return respond({
             'msg': f'Could not find any quotes for the fund {cnpj}',
             'records': 0,
             'error': True,
             'data': None
-        })
-        resp.status_code = HTTPStatus.NOT_FOUND
-        return resp
+        }, HTTPStatus.NOT_FOUND, root='quote')
 
-    resp = jsonify({
+    return respond({
         'msg': f'Latest quote for the fund {cnpj}',
         'records': 1,
-        'data': results[0]
-    })
+        'data': result
+    }, root='quote')
+
+def quote_history_query(cnpj: str, from_date: str=None, to_date: str=None, fields: List=QUOTE_HISTORY_FIELDS) -> tuple:
+    '''
+        Query and projection (only fields) of the quotes of a fund between
+        from_date and to_date, both inclusive.
+    '''
+    query = {'CNPJ': cnpj, 'DATA': {'$gte': parse_date(from_date or '1900-01-01')}}
+    if to_date:
+        query['DATA']['$lt'] = parse_date(to_date) + timedelta(days=1)
+    projection = {field: 1 for field in fields}
+    projection['_id'] = 0
+
+    return query, projection
+
+def get_quote_history(cnpj: str, from_date: str=None, to_date: str=None, param_format: str='JSON') -> Response:
+    '''
+        Returns the quotes of a fund between from_date and to_date (both inclusive)
+        in chronological order. JSON, XML, CSV and Arrow bodies are streamed from the
+        cursor, Parquet is built in memory since its footer goes at the end.
+    '''
+    try:
+        cnpj = validate_cnpj([cnpj])[0]
+    except InvalidCNPJError as err:
+        logger.info('Invalid CNPJ: %s', cnpj)
+        return respond({
+            'msg': str(err),
+            'error': True,
+            'data': None
+        }, HTTPStatus.BAD_REQUEST, root='quotes')
+
+    try:
+        connect_to_db()
+    except DBParametersError:
+        logger.error('Could not connect to the DB')
+        return respond({
+            'msg': 'Could not connect to the DB',
+            'error': True,
+            'data': None
+        }, HTTPStatus.INTERNAL_SERVER_ERROR, root='quotes')
+
+    cursor = Quote._get_collection().find(*quote_history_query(cnpj, from_date, to_date)).sort('DATA', 1)
+    first = next(cursor, None)
+    if first is None:
+        cursor.close()
+        return respond({
+            'msg': f'Could not find any quotes for the fund {cnpj}',
+            'records': 0,
+            'error': True,
+            'data': None
+        }, HTTPStatus.NOT_FOUND, root='quotes')
+
+    rows = chain([first], cursor)
+    batch_size = current_app.config['QUOTES_EXPORT_BATCH_SIZE']
+
+    if param_format == 'PARQUET':
+        return Response(build_parquet(rows, batch_size), mimetype=MIMETYPES[param_format])
+
+    if param_format == 'CSV':
+        body = generate_csv(rows, batch_size)
+    elif param_format == 'ARROW':
+        body = generate_arrow(rows, batch_size)
+    else:
+        return stream_response({'msg': f'Quotes for the fund {cnpj}'}, rows, root='quotes', param_format=param_format)
 
-    return resp
+    return Response(stream_with_context(body), mimetype=MIMETYPES[param_format])
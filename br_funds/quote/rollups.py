@@ -0,0 +1,257 @@
+import logging
+from datetime import datetime
+from http import HTTPStatus
+from typing import List
+
+import click
+import numpy as np
+import pandas as pd
+from flask import Response
+from flask.cli import with_appcontext
+
+from br_funds import settings
+from br_funds.database import DBParametersError, bulk_upsert, connect_to_db
+from br_funds.models.quote_model import Quote, QuoteRollup
+from br_funds.serializers import respond
+from br_funds.utils import InvalidCNPJError, validate_cnpj, parse_date, to_float_column, to_int_column
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {
+    'monthly': 'M'
+    , 'yearly': 'Y'
+}
+
+ROLLUP_FIELDS = [
+    'CNPJ'
+    , 'PERIODO'
+    , 'INICIO'
+    , 'FIM'
+    , 'COTAS'
+    , 'COTA_INICIAL'
+    , 'VALOR_QUOTA'
+    , 'RETORNO'
+    , 'CAPTACAO_LIQUIDA'
+    , 'VALOR_PATRIMONIAL'
+    , 'COTISTAS'
+]
+
+_QUOTE_FIELDS = ['CNPJ', 'DATA', 'VALOR_QUOTA', 'VALOR_PATRIMONIAL', 'CAPTACAO_DIA', 'RESGATE_DIA', 'COTISTAS']
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+def add_months(value: datetime, months: int) -> datetime:
+    '''First day of the month months after the month of value'''
+    month = value.month - 1 + months
+    return datetime(value.year + month // 12, month % 12 + 1, 1)
+
+def edge_rollups_pipeline(cnpjs: List, inicio: dict, direction: int) -> List:
+    '''
+        Aggregation returning, for each CNPJ, the first monthly rollup matching inicio
+        in the direction of INICIO (1 for the earliest, -1 for the latest)
+    '''
+    return [
+        {'$match': {'CNPJ': {'$in': cnpjs}, 'PERIODO': 'M', 'INICIO': inicio}},
+        {'$sort': {'CNPJ': 1, 'INICIO': direction}},
+        {'$group': {'_id': '$CNPJ', 'rollup': {'$first': '$$ROOT'}}}
+    ]
+
+def daily_rows(quotes: pd.DataFrame, base: dict) -> pd.DataFrame:
+    '''
+        Prepares the quotes to be aggregated: COTA_INICIAL is the previous quota of
+        the fund, base has the quota before the first row of each fund and funds
+        not in base start from their first quota.
+
+        RETURNS
+        pd.DataFrame sorted by CNPJ and DATA
+    '''
+    quotes = quotes.sort_values(['CNPJ', 'DATA'], ignore_index=True)
+    for column in ['VALOR_QUOTA', 'VALOR_PATRIMONIAL', 'CAPTACAO_DIA', 'RESGATE_DIA', 'COTISTAS']:
+        quotes[column] = pd.to_numeric(quotes[column], errors='coerce')
+
+    quota = quotes.groupby('CNPJ')['VALOR_QUOTA'].ffill()
+    previous = quota.groupby(quotes['CNPJ']).shift(1)
+    previous = previous.mask(~quotes['CNPJ'].duplicated(), quotes['CNPJ'].map(base).astype('float64'))
+
+    return quotes.assign(
+        COTAS=1
+        , COTA_INICIAL=previous.fillna(quotes['VALOR_QUOTA'])
+        , CAPTACAO_LIQUIDA=quotes['CAPTACAO_DIA'].fillna(0) - quotes['RESGATE_DIA'].fillna(0)
+    )
+
+def aggregate_periods(rows: pd.DataFrame, period: str) -> pd.DataFrame:
+    '''
+        Groups rows sorted by CNPJ and DATA in the periods (M or Y) of each fund.
+        Works for daily rows as well as for monthly rollups, with DATA as their FIM.
+
+        RETURNS
+        pd.DataFrame with the ROLLUP_FIELDS but PERIODO
+    '''
+    rows = rows.assign(INICIO=rows['DATA'].dt.to_period(period).dt.start_time)
+    periods = rows.groupby(['CNPJ', 'INICIO'], sort=True).agg(
+        FIM=('DATA', 'last')
+        , COTAS=('COTAS', 'sum')
+        , COTA_INICIAL=('COTA_INICIAL', 'first')
+        , VALOR_QUOTA=('VALOR_QUOTA', 'last')
+        , CAPTACAO_LIQUIDA=('CAPTACAO_LIQUIDA', 'sum')
+        , VALOR_PATRIMONIAL=('VALOR_PATRIMONIAL', 'last')
+        , COTISTAS=('COTISTAS', 'last')
+    ).reset_index()
+    periods['RETORNO'] = (periods['VALOR_QUOTA'] / periods['COTA_INICIAL'] - 1).replace([np.inf, -np.inf], np.nan)
+
+    return periods
+
+def to_documents(periods: pd.DataFrame, period: str) -> List:
+    periods = periods.assign(PERIODO=period)
+    for column in ['INICIO', 'FIM']:
+        periods[column] = pd.Series([value.to_pydatetime() for value in periods[column]], index=periods.index, dtype=object)
+    for column in ['COTA_INICIAL', 'VALOR_QUOTA', 'RETORNO', 'CAPTACAO_LIQUIDA', 'VALOR_PATRIMONIAL']:
+        periods[column] = to_float_column(periods[column])
+    for column in ['COTAS', 'COTISTAS']:
+        periods[column] = to_int_column(periods[column])
+
+    return periods[ROLLUP_FIELDS].to_dict(orient='records')
+
+def _update_batch(cnpjs: List, start: datetime, end: datetime) -> List:
+    collection = QuoteRollup._get_collection()
+
+    base = {group['_id']: group['rollup']['VALOR_QUOTA'] for group in collection.aggregate(edge_rollups_pipeline(cnpjs, {'$lt': start}, -1))}
+    cursor = Quote._get_collection().find({'CNPJ': {'$in': cnpjs}, 'DATA': {'$gte': start, '$lt': end}}
+        , {field: 1 for field in _QUOTE_FIELDS})
+    quotes = pd.DataFrame(list(cursor), columns=_QUOTE_FIELDS)
+    if quotes.empty:
+        return list()
+
+    quotes['DATA'] = pd.to_datetime(quotes['DATA'])
+    monthly = aggregate_periods(daily_rows(quotes, base), 'M')
+    documents = to_documents(monthly, 'M')
+
+    # The first month stored after the range starts from the last quota computed here
+    last = monthly.groupby('CNPJ')['VALOR_QUOTA'].last().dropna()
+    for group in collection.aggregate(edge_rollups_pipeline(list(last.index), {'$gte': end}, 1)):
+        rollup = {field: group['rollup'].get(field) for field in ROLLUP_FIELDS}
+        rollup['COTA_INICIAL'] = float(last[group['_id']])
+        if rollup['VALOR_QUOTA'] is not None and rollup['COTA_INICIAL']:
+            rollup['RETORNO'] = rollup['VALOR_QUOTA'] / rollup['COTA_INICIAL'] - 1
+        documents.append(rollup)
+
+    results = bulk_upsert(collection, documents, ['CNPJ', 'PERIODO', 'INICIO'])
+
+    years = sorted({document['INICIO'].year for document in documents})
+    cursor = collection.find({'CNPJ': {'$in': cnpjs}, 'PERIODO': 'M'
+        , 'INICIO': {'$gte': datetime(years[0], 1, 1), '$lt': datetime(years[-1] + 1, 1, 1)}}
+        , {'_id': 0}).sort([('CNPJ', 1), ('INICIO', 1)])
+    months = pd.DataFrame(list(cursor), columns=ROLLUP_FIELDS)
+    months = months.loc[months['INICIO'].map(lambda value: value.year).isin(years)]
+    months = months.assign(DATA=pd.to_datetime(months['FIM'])).drop(columns=['PERIODO', 'INICIO', 'FIM'])
+    yearly = aggregate_periods(months, 'Y')
+
+    return results + bulk_upsert(collection, to_documents(yearly, 'Y'), ['CNPJ', 'PERIODO', 'INICIO'])
+
+def update_rollups(periods) -> dict:
+    '''
+        Recomputes the monthly and yearly rollups of the (cnpj, date) pairs in periods.
+        Only the months with a date in periods are read from the Quote collection,
+        together with the month after them, whose return starts from their last quota.
+        The years of those months are then rebuilt from the monthly rollups.
+
+        RETURNS
+        A dict with the counts of rollups by status
+    '''
+    touched = dict()
+    for cnpj, date in periods:
+        touched.setdefault(cnpj, set()).add(month_start(date))
+
+    counts = dict.fromkeys(['inserted', 'updated', 'unchanged', 'failed'], 0)
+    cnpjs = sorted(touched)
+    for start in range(0, len(cnpjs), settings.ROLLUPS_BATCH_SIZE):
+        batch = cnpjs[start:start + settings.ROLLUPS_BATCH_SIZE]
+        months = set().union(*[touched[cnpj] for cnpj in batch])
+        for result in _update_batch(batch, min(months), add_months(max(months), 2)):
+            counts[result['status']] += 1
+
+    return counts
+
+def rebuild_rollups(cnpjs: List=None) -> dict:
+    '''
+        Drops and recomputes every rollup of the given funds, or of all the funds with quotes.
+
+        RETURNS
+        A dict with the counts of rollups by status
+    '''
+    connect_to_db()
+    match = {'CNPJ': {'$in': cnpjs}} if cnpjs else dict()
+    QuoteRollup._get_collection().delete_many(match)
+
+    periods = set()
+    for group in Quote._get_collection().aggregate([
+        {'$match': match},
+        {'$group': {'_id': '$CNPJ', 'first': {'$min': '$DATA'}, 'last': {'$max': '$DATA'}}}
+    ]):
+        if group['first'] is not None:
+            periods.update([(group['_id'], group['first']), (group['_id'], group['last'])])
+
+    return update_rollups(periods)
+
+def rollups_query(cnpj: str, period: str, from_date: str=None, to_date: str=None) -> tuple:
+    '''Query and projection of the rollups of a fund in period (monthly or yearly) overlapping from_date and to_date'''
+    query = {'CNPJ': cnpj, 'PERIODO': PERIODS[period]}
+    if from_date:
+        query['FIM'] = {'$gte': parse_date(from_date)}
+    if to_date:
+        query['INICIO'] = {'$lte': parse_date(to_date)}
+
+    return query, {'_id': 0}
+
+def get_rollups(cnpj: str, period: str, from_date: str=None, to_date: str=None) -> Response:
+    '''
+        Monthly or yearly rollups of a fund overlapping from_date and to_date
+        (both inclusive) in chronological order, read straight from QuoteRollup.
+    '''
+    try:
+        cnpj = validate_cnpj([cnpj])[0]
+    except InvalidCNPJError as err:
+        logger.info('Invalid CNPJ: %s', cnpj)
+        return respond({
+            'msg': str(err),
+            'error': True,
+            'data': None
+        }, HTTPStatus.BAD_REQUEST, root='rollups')
+
+    try:
+        connect_to_db()
+    except DBParametersError:
+        logger.error('Could not connect to the DB')
+        return respond({
+            'msg': 'Could not connect to the DB',
+            'error': True,
+            'data': None
+        }, HTTPStatus.INTERNAL_SERVER_ERROR, root='rollups')
+
+    results = list(QuoteRollup._get_collection().find(*rollups_query(cnpj, period, from_date, to_date)).sort('INICIO', 1))
+    if not results:
+        return respond({
+            'msg': f'Could not find any {period} rollups for the fund {cnpj}',
+            'records': 0,
+            'error': True,
+            'data': None
+        }, HTTPStatus.NOT_FOUND, root='rollups')
+
+    return respond({
+        'msg': f'{period.capitalize()} rollups for the fund {cnpj}',
+        'records': len(results),
+        'data': results
+    }, root='rollups')
+
+@click.command('rebuild-rollups')
+@click.argument('cnpjs', nargs=-1)
+@with_appcontext
+def rebuild_rollups_command(cnpjs):
+    '''Recomputes the monthly and yearly rollups of the given funds, or of every fund when none is given'''
+    try:
+        cnpjs = validate_cnpj(list(cnpjs)) if cnpjs else None
+    except InvalidCNPJError as err:
+        raise click.BadParameter(str(err))
+
+    click.echo(f'Rollups: {rebuild_rollups(cnpjs)}')
@@ -0,0 +1,170 @@
+import re
+from datetime import date, datetime
+from http import HTTPStatus
+from xml.sax.saxutils import escape
+
+from bson.objectid import ObjectId
+from flask import Response, current_app, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+MIMETYPES = {
+    'JSON': 'application/json'
+    , 'XML': 'text/xml'
+    , 'NDJSON': 'application/x-ndjson'
+    , 'CSV': 'text/csv'
+    , 'ARROW': 'application/vnd.apache.arrow.stream'
+    , 'PARQUET': 'application/vnd.apache.parquet'
+}
+
+ACCEPTED_MIMETYPES = {
+    'application/json': 'JSON'
+    , 'text/xml': 'XML'
+    , 'application/xml': 'XML'
+    , 'application/x-ndjson': 'NDJSON'
+    , 'text/csv': 'CSV'
+    , 'application/vnd.apache.arrow.stream': 'ARROW'
+    , 'application/vnd.apache.parquet': 'PARQUET'
+}
+
+_INVALID_TAG_CHARS = re.compile(r'[^A-Za-z0-9_.-]')
+
+def format_date(value) -> str:
+    '''Dates are written as YYYY-MM-DD, the same format stored before the fields were typed'''
+    if isinstance(value, datetime) and value.time() != datetime.min.time():
+        return value.isoformat()
+    return value.strftime('%Y-%m-%d')
+
+class FundsJSONProvider(DefaultJSONProvider):
+    sort_keys = False
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, (date, datetime)):
+            return format_date(o)
+        if isinstance(o, ObjectId):
+            return str(o)
+        return DefaultJSONProvider.default(o)
+
+def negotiate_format(formats=('JSON', 'XML'), default: str='JSON', req=None) -> str:
+    '''
+        Picks the response format: the ?format= parameter when given,
+        otherwise the best match for the Accept header among formats.
+        req is the request to look at, the current Flask request by default.
+
+        RETURNS
+        The format name or None when ?format= is not one of formats
+    '''
+    req = request if req is None else req
+    param_format = req.args.get('format', default=None, type=str)
+    if param_format:
+        param_format = param_format.upper()
+        return param_format if param_format in formats else None
+
+    # The default goes first so it wins ties like */* or a missing Accept header
+    mimetypes = [MIMETYPES[default]] + [mimetype for mimetype, name in ACCEPTED_MIMETYPES.items()
+        if name in formats and mimetype != MIMETYPES[default]]
+    best = req.accept_mimetypes.best_match(mimetypes, default=MIMETYPES[default])
+
+    return ACCEPTED_MIMETYPES[best]
+
+def xml_tag(name) -> str:
+    tag = _INVALID_TAG_CHARS.sub('_', str(name))
+    if not tag or not (tag[0].isalpha() or tag[0] == '_'):
+        tag = f'_{tag}'
+    return tag
+
+def _xml_text(value) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (date, datetime)):
+        return format_date(value)
+    return escape(str(value))
+
+def xml_element(name, value):
+    '''
+        Writes value as an XML element named name. Dicts become child elements,
+        lists and other iterables become <item> children and are consumed lazily,
+        so generators are streamed.
+
+        RETURNS
+        A generator of str
+    '''
+    tag = xml_tag(name)
+    if value is None:
+        yield f'<{tag}/>'
+    elif isinstance(value, dict):
+        yield f'<{tag}>'
+        for key, item in value.items():
+            yield from xml_element(key, item)
+        yield f'</{tag}>'
+    elif isinstance(value, (str, ObjectId, date, datetime, int, float)):
+        yield f'<{tag}>{_xml_text(value)}</{tag}>'
+    else:
+        yield f'<{tag}>'
+        for item in value:
+            yield from xml_element('item', item)
+        yield f'</{tag}>'
+
+def generate_xml(payload: dict, root: str):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield from xml_element(root, payload)
+
+def generate_json(header: dict, rows, dumps):
+    '''
+        Streams the same body jsonify would build from header plus data,
+        with records written after the data.
+    '''
+    records = 0
+    yield dumps(header)[:-1] + (', ' if header else '') + '"data": ['
+    for row in rows:
+        yield (', ' if records else '') + dumps(row)
+        records += 1
+    yield f'], "records": {records}}}'
+
+def generate_xml_stream(header: dict, rows, root: str):
+    '''XML counterpart of generate_json'''
+    tag = xml_tag(root)
+    records = 0
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<{tag}>'
+    for key, value in header.items():
+        yield from xml_element(key, value)
+    yield '<data>'
+    for row in rows:
+        yield from xml_element('item', row)
+        records += 1
+    yield f'</data><records>{records}</records></{tag}>'
+
+def generate_ndjson(rows, dumps):
+    for row in rows:
+        yield dumps(row) + '\n'
+
+def respond(payload: dict, status: int=HTTPStatus.OK, root: str='response', formats=('JSON', 'XML')) -> Response:
+    '''
+        Serializes payload in the format negotiated for the request (JSON when
+        none matches), straight from the query results.
+    '''
+    return build_response(current_app, payload, negotiate_format(formats) or 'JSON', status, root)
+
+def build_response(app, payload: dict, param_format: str='JSON', status: int=HTTPStatus.OK, root: str='response'):
+    '''Serializes payload in param_format (JSON or XML) with the response class and JSON provider of app'''
+    if param_format == 'XML':
+        resp = app.response_class(''.join(generate_xml(payload, root)), mimetype=MIMETYPES['XML'])
+    else:
+        resp = app.json.response(payload)
+    resp.status_code = status
+    resp.vary.add('Accept')
+    return resp
+
+def stream_response(header: dict, rows, root: str='response', param_format: str='JSON') -> Response:
+    '''Streams the rows in param_format (JSON, NDJSON or XML) as they are produced'''
+    dumps = current_app.json.dumps
+    if param_format == 'XML':
+        body = generate_xml_stream(header, rows, root)
+    elif param_format == 'NDJSON':
+        body = generate_ndjson(rows, dumps)
+    else:
+        body = generate_json(header, rows, dumps)
+
+    resp = Response(stream_with_context(body), mimetype=MIMETYPES[param_format])
+    resp.vary.add('Accept')
+    return resp
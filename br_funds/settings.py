@@ -0,0 +1,95 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+JSON_SORT_KEYS = False
+
+# CVM cadastro (cad_fi.csv)
+CADASTRO_URL = os.getenv('CADASTRO_URL', 'http://dados.cvm.gov.br/dados/FI/CAD/DADOS/cad_fi.csv')
+CADASTRO_LOCAL_PATH = os.getenv('CADASTRO_LOCAL_PATH')
+# Parsed cadastro kept between restarts, in the cache dir of the user running the app
+CADASTRO_SNAPSHOT_PATH = os.getenv('CADASTRO_SNAPSHOT_PATH', os.path.join(
+    os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'br_funds', 'cad_fi.arrow'))
+CADASTRO_TTL = int(os.getenv('CADASTRO_TTL', 6 * 60 * 60))
+CADASTRO_TIMEOUT = int(os.getenv('CADASTRO_TIMEOUT', 60))
+# Seconds before a failed refresh is tried again, the stale copy is served meanwhile
+CADASTRO_RETRY = int(os.getenv('CADASTRO_RETRY', 5 * 60))
+# Funds written per bulk write by flask sync-funds
+FUNDS_SYNC_BATCH_SIZE = int(os.getenv('FUNDS_SYNC_BATCH_SIZE', 1000))
+
+# MongoDB
+MONGODB_HOST = os.getenv('MONGODB_HOST', 'mongodb+srv://cluster.a7nme.mongodb.net')
+MONGODB_USERNAME = os.getenv('MONGODB_USERNAME')
+MONGODB_PASSWORD = os.getenv('MONGODB_PASSWORD')
+MONGODB_DB = os.getenv('MONGODB_DB')
+MONGODB_POOL_SIZE = int(os.getenv('MONGODB_POOL_SIZE', 50))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', 5000))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv('MONGODB_SOCKET_TIMEOUT_MS', 30000))
+
+# CVM daily reports (inf_diario_fi_YYYYMM)
+QUOTES_SOURCE = os.getenv('QUOTES_SOURCE', 'https://dados.cvm.gov.br/dados/FI/DOC/INF_DIARIO/DADOS/')
+QUOTES_CHUNK_SIZE = int(os.getenv('QUOTES_CHUNK_SIZE', 100000))
+QUOTES_BATCH_SIZE = int(os.getenv('QUOTES_BATCH_SIZE', 1000))
+QUOTES_TIMEOUT = int(os.getenv('QUOTES_TIMEOUT', 120))
+# Funds whose monthly and yearly rollups are recomputed per query
+ROLLUPS_BATCH_SIZE = int(os.getenv('ROLLUPS_BATCH_SIZE', 100))
+
+# API
+FUNDS_PAGE_MAX = int(os.getenv('FUNDS_PAGE_MAX', 1000))
+QUOTES_EXPORT_BATCH_SIZE = int(os.getenv('QUOTES_EXPORT_BATCH_SIZE', 5000))
+# Annual rate used by the Sharpe ratio when ?rate= is not given, 0.1 for 10%
+RISK_FREE_RATE = float(os.getenv('RISK_FREE_RATE', 0.0))
+
+# POST /funds/ batches of more than JOBS_THRESHOLD CNPJs are saved by background jobs,
+# polled at /jobs/<id>. Each process runs JOBS_WORKERS of them at a time and accepts at
+# most JOBS_MAX_PENDING; a job saves its funds in chunks of JOBS_CHUNK_SIZE and is given
+# up after JOBS_STALE_AFTER seconds without progress
+JOBS_THRESHOLD = int(os.getenv('JOBS_THRESHOLD', 500))
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', 2))
+JOBS_MAX_PENDING = int(os.getenv('JOBS_MAX_PENDING', 20))
+JOBS_CHUNK_SIZE = int(os.getenv('JOBS_CHUNK_SIZE', 500))
+JOBS_STALE_AFTER = int(os.getenv('JOBS_STALE_AFTER', 60 * 60))
+
+# Results of /funds/search when ?limit= is not given
+SEARCH_LIMIT = int(os.getenv('SEARCH_LIMIT', 20))
+
+# Async serving mode: CNPJs per concurrent query of the batch routes
+ASYNC_FANOUT_SIZE = int(os.getenv('ASYNC_FANOUT_SIZE', 100))
+
+# Cadastro and latest quotes shared by the pre-forked workers through memory-mapped
+# Arrow files (see gunicorn.conf.py), disabled when SNAPSHOT_DIR is not set
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR')
+SNAPSHOT_REFRESH = int(os.getenv('SNAPSHOT_REFRESH', 5 * 60))
+SNAPSHOT_CHECK_INTERVAL = int(os.getenv('SNAPSHOT_CHECK_INTERVAL', 5))
+
+# Logging: records are written to stderr by a background thread
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+
+# Request profiling: requests sending the X-Profile header with PROFILE_TOKEN, plus a
+# random PROFILE_SAMPLE_RATE of them, are profiled with cProfile. The reports are
+# stored in PROFILE_DIR, or returned as the body of the requests with the header
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0.0))
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+PROFILE_SORT = os.getenv('PROFILE_SORT', 'cumulative')
+PROFILE_LIMIT = int(os.getenv('PROFILE_LIMIT', 40))
+
+# Prometheus metrics at /metrics
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ['1', 'true', 'yes']
+
+# Response compression negotiated with Accept-Encoding: brotli when the brotli package
+# is installed, otherwise gzip. Bodies under COMPRESSION_MIN_SIZE bytes are sent as they are
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() in ['1', 'true', 'yes']
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', 5))
+
+# Response cache
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 10000))
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+CACHE_TTL_FUND = int(os.getenv('CACHE_TTL_FUND', 60 * 60))
+CACHE_TTL_QUOTE = int(os.getenv('CACHE_TTL_QUOTE', 15 * 60))
+# Seconds between the checks for invalidations published by other processes
+CACHE_SYNC_INTERVAL = float(os.getenv('CACHE_SYNC_INTERVAL', 1))
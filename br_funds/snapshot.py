@@ -0,0 +1,207 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pyarrow as pa
+
+from br_funds import settings
+
+logger = logging.getLogger(__name__)
+
+CADASTRO_FILE = 'cadastro.arrow'
+LATEST_QUOTES_FILE = 'latest_quotes.arrow'
+
+LATEST_QUOTE_FIELDS = ['_id', 'CNPJ', 'DATA', 'VALOR_QUOTA', 'VALOR_PATRIMONIAL', 'CAPTACAO_DIA', 'RESGATE_DIA', 'COTISTAS']
+
+# Sorted int64 version of the CNPJ, the lookups are binary searches over it
+KEY_COLUMN = 'CNPJ_KEY'
+
+def cnpj_keys(cnpjs: list) -> np.ndarray:
+    '''The digits of each formatted CNPJ as an int64, invalid ones become -1'''
+    keys = np.full(len(cnpjs), -1, dtype='int64')
+    for pos, cnpj in enumerate(cnpjs):
+        digits = ''.join(char for char in str(cnpj) if char.isdigit())
+        if len(digits) == 14:
+            keys[pos] = int(digits)
+    return keys
+
+def write_table(records: list, path: str, metadata: dict=None) -> int:
+    '''
+        Writes the records, sorted by CNPJ, as an uncompressed Arrow IPC file so
+        it can be memory-mapped. The file is written next to path and renamed
+        over it, readers see either the old or the new table. metadata (str keys
+        and values) is kept in the schema of the file.
+
+        RETURNS
+        The number of records written
+    '''
+    table = pa.Table.from_pylist(records)
+    table = table.append_column(KEY_COLUMN, pa.array(cnpj_keys(table.column('CNPJ').to_pylist())))
+    table = table.sort_by(KEY_COLUMN)
+    if metadata:
+        table = table.replace_schema_metadata(metadata)
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+    return table.num_rows
+
+class SharedTable():
+    '''
+        Read-only view of a table written by write_table. The file is memory-mapped,
+        so every process reading it shares the same pages instead of holding a copy.
+        Every check_interval seconds the file is checked and mapped again when it
+        was replaced.
+    '''
+    def __init__(self, path: str, check_interval: int=settings.SNAPSHOT_CHECK_INTERVAL) -> None:
+        self.path = path
+        self.check_interval = check_interval
+        # (table, keys) replaced in a single assignment, so a lookup never pairs
+        # the keys of one file with the rows of another
+        self._current = (None, None)
+        self._stat = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _reload(self) -> None:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self._current, self._stat = (None, None), None
+            return
+
+        if self._stat == (stat.st_ino, stat.st_mtime_ns):
+            return
+
+        table = pa.ipc.open_file(pa.memory_map(self.path, 'r')).read_all()
+        keys = table.column(KEY_COLUMN).combine_chunks()
+        # Zero-copy view of the key column, the table keeps the mapping alive
+        keys = np.frombuffer(keys.buffers()[1], dtype='int64', count=len(keys), offset=keys.offset * 8)
+        self._current = (table.drop_columns([KEY_COLUMN]), keys)
+        self._stat = (stat.st_ino, stat.st_mtime_ns)
+
+    def _loaded(self) -> tuple:
+        '''The current (table, keys), both None when the file does not exist'''
+        if time.monotonic() - self._checked_at > self.check_interval:
+            with self._lock:
+                if time.monotonic() - self._checked_at > self.check_interval:
+                    self._reload()
+                    self._checked_at = time.monotonic()
+        return self._current
+
+    def table(self) -> pa.Table:
+        '''The current table or None when the file does not exist'''
+        return self._loaded()[0]
+
+    def get(self, cnpjs: list) -> list:
+        '''
+            Returns the rows of the CNPJs found in the table, in the order of cnpjs
+            and without duplicates.
+
+            RETURNS
+            A list of dict or None when the file does not exist
+        '''
+        table, keys = self._loaded()
+        if table is None:
+            return None
+
+        wanted = cnpj_keys(list(dict.fromkeys(cnpjs)))
+        if not len(keys) or not len(wanted):
+            return list()
+
+        positions = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        positions = positions[keys[positions] == wanted]
+        return table.take(pa.array(positions)).to_pylist()
+
+class SharedSnapshot():
+    '''
+        Cadastro and latest quotes shared by the pre-forked workers. The files are
+        written to SNAPSHOT_DIR by the snapshot writer started by the gunicorn
+        master (see gunicorn.conf.py), the workers only map them.
+        Nothing is shared when SNAPSHOT_DIR is not set.
+    '''
+    def __init__(self) -> None:
+        self.cadastro = None
+        self.latest_quotes = None
+
+    def init_app(self, app) -> None:
+        directory = app.config.get('SNAPSHOT_DIR', settings.SNAPSHOT_DIR)
+        check_interval = app.config.get('SNAPSHOT_CHECK_INTERVAL', settings.SNAPSHOT_CHECK_INTERVAL)
+        if directory:
+            self.cadastro = SharedTable(os.path.join(directory, CADASTRO_FILE), check_interval)
+            self.latest_quotes = SharedTable(os.path.join(directory, LATEST_QUOTES_FILE), check_interval)
+        else:
+            self.cadastro = None
+            self.latest_quotes = None
+        app.extensions['snapshot'] = self
+
+    def get_funds(self, cnpjs: list) -> list:
+        '''Cadastro records of the CNPJs or None when there is no shared cadastro'''
+        return self.cadastro.get(cnpjs) if self.cadastro is not None else None
+
+    def get_latest_quotes(self, cnpjs: list) -> list:
+        '''Latest quotes of the CNPJs or None when there are no shared quotes'''
+        quotes = self.latest_quotes.get(cnpjs) if self.latest_quotes is not None else None
+        if quotes is None:
+            return None
+        # Missing fields are left out, as in the documents read from the DB
+        return [{field: value for field, value in quote.items() if value is not None} for quote in quotes]
+
+shared_snapshot = SharedSnapshot()
+
+def write_snapshot(directory: str, cadastro_records: dict=None) -> dict:
+    '''
+        Writes the cadastro (when cadastro_records is given) and the LatestQuote
+        collection to directory.
+
+        RETURNS
+        A dict with the number of rows written per file
+    '''
+    from br_funds.database import connect_to_db
+    from br_funds.models.quote_model import LatestQuote
+
+    os.makedirs(directory, exist_ok=True)
+    counts = dict()
+    if cadastro_records is not None:
+        counts[CADASTRO_FILE] = write_table(list(cadastro_records.values()), os.path.join(directory, CADASTRO_FILE))
+
+    connect_to_db()
+    quotes = list()
+    for quote in LatestQuote._get_collection().find():
+        quote['_id'] = str(quote['_id'])
+        quotes.append({field: quote.get(field) for field in LATEST_QUOTE_FIELDS})
+    if quotes:
+        counts[LATEST_QUOTES_FILE] = write_table(quotes, os.path.join(directory, LATEST_QUOTES_FILE))
+
+    return counts
+
+def run_writer(ready=None) -> None:
+    '''
+        Snapshot writer loop: the cadastro is loaded once and rewritten only when
+        its TTL refresh brings a new file, the latest quotes are rewritten every
+        SNAPSHOT_REFRESH seconds. ready (a multiprocessing Event) is set after
+        the first write.
+    '''
+    from br_funds import create_app
+    from br_funds.funds.cadastro import cadastro
+
+    app = create_app()
+    directory = app.config['SNAPSHOT_DIR']
+    written = None
+    with app.app_context():
+        while True:
+            try:
+                records = cadastro.records()
+                counts = write_snapshot(directory, records if records is not written else None)
+                written = records
+                logger.info('Snapshot written to %s: %s', directory, counts)
+            except Exception as err:
+                logger.error('Could not write the snapshot: %s', err)
+            if ready is not None:
+                ready.set()
+            time.sleep(app.config['SNAPSHOT_REFRESH'])
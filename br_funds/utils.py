@@ -1,42 +1,82 @@
-from http import HTTPStatus
-import sys
-from flask import jsonify, Response, request
+import math
 import re
-from string import digits
+from datetime import date, datetime
 from typing import List, Tuple
-from .funds.load_funds import load_funds_data
-from .models.fund_model import Fund
-from .database import DB
+import numpy as np
+import pandas as pd
 
 class InvalidCNPJError(Exception):
     def __init__(self, cnpj) -> None:
         super().__init__(f'Invalid CNPJ: {cnpj}')
         self.fund = cnpj
 
+# ASCII digits only, the check digits are computed on the bytes of the CNPJ
+_FORMATTED_CNPJ = re.compile(r'[0-9]{2}\.[0-9]{3}\.[0-9]{3}/[0-9]{4}-[0-9]{2}')
+_NUMERIC_CNPJ = re.compile(r'[0-9]{14}')
+_CNPJ_WEIGHTS_1 = np.array([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+_CNPJ_WEIGHTS_2 = np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+
+def _check_digit(digits: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    remainder = (digits @ weights) % 11
+    return np.where(remainder < 2, 0, 11 - remainder)
+
+def validate_cnpjs(cnpjs: list) -> Tuple[List, List]:
+    '''
+        Validates a batch of CNPJs, formatted (00.000.000/0000-00) or numeric
+        (00000000000000). The two check digits of the whole batch are computed
+        at once with NumPy.
+
+        RETURNS
+        A tuple of two lists aligned with cnpjs: the formatted CNPJs (None when invalid)
+        and the error messages (None when valid)
+    '''
+    normalized = [None] * len(cnpjs)
+    errors = [None] * len(cnpjs)
+
+    positions = list()
+    numbers = list()
+    for pos, cnpj in enumerate(cnpjs):
+        if isinstance(cnpj, str) and _FORMATTED_CNPJ.fullmatch(cnpj):
+            numbers.append(cnpj[0:2] + cnpj[3:6] + cnpj[7:10] + cnpj[11:15] + cnpj[16:18])
+            positions.append(pos)
+        elif isinstance(cnpj, str) and _NUMERIC_CNPJ.fullmatch(cnpj):
+            numbers.append(cnpj)
+            positions.append(pos)
+        else:
+            errors[pos] = str(InvalidCNPJError(cnpj))
+
+    if not numbers:
+        return normalized, errors
+
+    digits = np.frombuffer(''.join(numbers).encode('ascii'), dtype=np.uint8).reshape(-1, 14).astype(np.int64) - ord('0')
+    first = _check_digit(digits[:, :12], _CNPJ_WEIGHTS_1)
+    second = _check_digit(np.column_stack([digits[:, :12], first]), _CNPJ_WEIGHTS_2)
+    valid = (first == digits[:, 12]) & (second == digits[:, 13]) & (digits != digits[:, :1]).any(axis=1)
+
+    for pos, number, is_valid in zip(positions, numbers, valid.tolist()):
+        if is_valid:
+            normalized[pos] = f'{number[0:2]}.{number[2:5]}.{number[5:8]}/{number[8:12]}-{number[12:14]}'
+        else:
+            errors[pos] = f'Invalid CNPJ: {cnpjs[pos]} (check digits do not match)'
+
+    return normalized, errors
+
 def validate_cnpj(cnpjs: list) -> list:
-    symbols = '-./'
-    regex = re.compile('^[0-9]{2}\.[0-9]{3}\.[0-9]{3}\/[0-9]{4}\-[0-9]{2}$')
-    new_cnpjs = list()
+    '''
+        Validates and formats the CNPJs, raising InvalidCNPJError on the first invalid one.
 
+        RETURNS
+        The list of formatted CNPJs
+    '''
     if not cnpjs:
         raise InvalidCNPJError(str(cnpjs))
-    
-    for cnpj in cnpjs:
-        print(cnpj)
-        for digit in cnpj:
-            if digit not in symbols and digit not in digits:
-                raise InvalidCNPJError(cnpj)
-        
-        if '-' not in cnpj and '/' not in cnpj and '-' not in cnpj:
-            # Numeric CNPJ given, so converting...
-            cnpj = f'{cnpj[0:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:14]}'
-
-        if not regex.match(cnpj):
+
+    normalized, errors = validate_cnpjs(cnpjs)
+    for cnpj, error in zip(cnpjs, errors):
+        if error:
             raise InvalidCNPJError(cnpj)
-        
-        new_cnpjs.append(cnpj)
 
-    return new_cnpjs
+    return normalized
 
 def funds_exist(list_of_funds: List, existing_funds: List) -> List:
     '''Returns a list of error messages when fund is not in the results loaded by pandas'''
@@ -48,172 +88,63 @@ def funds_exist(list_of_funds: List, existing_funds: List) -> List:
 
     return messages
 
-def validate_url_params(args) -> bool:
+def validate_url_params(args, formats: Tuple=('JSON', 'XML')) -> bool:
     param_format = args.get('format', default='JSON', type=str)
 
-    if param_format.upper() not in ['JSON', 'XML']:
+    if param_format.upper() not in formats:
         return False
 
-    return True
-
-def convert_to_xml(resp: Response) -> Response:
-    resp_dict = resp.get_json()
-    xml = f'<?xml version="1.0" encoding="UTF-8"?>\n<quote>'
-    print('----> converting to XML')
-    for key, value in resp_dict.items():
-        if isinstance(value, dict): # This should be recursive...
-            xml += f'<{key}>\n'
-            for subkey, subvalue in value.items():
-                xml += f'\t<{subkey}>{subvalue}</{subkey}>\n'
-            xml += f'</{key}>\n'
-        else:
-            xml += f'<{key}>{value}</{key}>\n'
-    xml += '</quote>'
-
-    print(xml)
-
-    resp_xml = Response(xml, mimetype='text/xml', status=HTTPStatus.OK)
-    return resp_xml
-
+    for param in ['from', 'to']:
+        if param in args and parse_date(args.get(param)) is None:
+            return False
 
+    return True
 
-def get_all_funds() -> Response:
-    try:
-        db = DB()
-    except:
-        print('Could not connect to the DB')
-        resp = jsonify({
-            'msg': 'Could not connect to the DB',
-            'error': True,
-            'data': None            
-        })
-        resp.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-        return resp
-
-    all_funds = [fund.to_mongo().to_dict() for fund in Fund.objects]
-    for fund in all_funds:
-        fund['_id'] = str(fund['_id'])
-
-    print(all_funds)
-    resp = jsonify({
-        'msg': 'All funds in the DB',
-        'records': len(all_funds),
-        'data': all_funds
-    })
-    return resp
-
-def add_funds(cnpjs: list) -> Response:
-    results = list()
+def parse_date(value) -> datetime:
+    '''Converts a YYYY-MM-DD string to datetime, empty or invalid values become None'''
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
     try:
-        funds_list = validate_cnpj(cnpjs)
-    except InvalidCNPJError as error:
-        print('Invalid CNPJ')
-        resp = jsonify({
-            'msg': f'{error}',
-            'error': True,
-            'data': cnpjs
-        })
-        resp.status_code = 400
-        return resp
-    
+        return datetime.strptime(str(value).strip()[:10], '%Y-%m-%d')
+    except ValueError:
+        return None
+
+def parse_float(value) -> float:
+    '''Converts a numeric string to float, empty, invalid or non-finite (nan, inf) values become None'''
+    if value is None:
+        return value
     try:
-        db = DB()
-    except:
-        print('Could not connect to the DB')
-        resp = jsonify({
-            'msg': 'Could not connect to the DB',
-            'error': True,
-            'data': None            
-        })
-        resp.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-        return resp
-    
-    funds_info = load_funds_data(funds_list)
-    
-    msg = funds_exist(funds_list, funds_info)
-    if msg:
-        print('One or more funds were not found')
-        resp = jsonify({
-            'msg': 'One or more funds were not found',
-            'error': True,
-            'data': msg
-        })
-        resp.status_code = HTTPStatus.NOT_FOUND
-        return resp
-
-    for record in funds_info:
-        fund = Fund(**record)
-        try:
-            result = fund.save()
-            print(f'Saved {fund.CNPJ}')
-            results.append(str(result.id))
-        except:
-            e = sys.exc_info()
-            print('Exception -->', e)
-            print(f'{fund.CNPJ} not saved...')
-            resp = jsonify({
-                'msg': f'Error while adding {fund.CNPJ} to the DB',
-                'error': True,
-                'data': str(e[1])
-            })
-            resp.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-            return resp
-
-    resp = jsonify({
-        'msg': 'Records added',
-        'records': len(results),
-        'data': results
-    })
-    resp.status_code = HTTPStatus.CREATED
-
-    return resp
-
-def get_fund(cnpj: str) -> Response:
-    print('CNPJ Received ---->', cnpj)
-    try:
-        fund_cnpj = validate_cnpj([cnpj])[0]
-    except InvalidCNPJError as error:
-        print('Invalid CNPJ')
-        resp = jsonify({
-            'msg': f'{error}',
-            'error': True,
-            'data': [cnpj]
-        })
-        resp.status_code = HTTPStatus.BAD_REQUEST
-        return resp
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+def parse_int(value) -> int:
+    '''Converts a numeric string to int, empty or invalid values become None'''
+    if value is None or isinstance(value, int):
+        return value
+    value = parse_float(value)
+    return None if value is None else int(value)
+
+def to_date_column(column: pd.Series) -> pd.Series:
+    '''Vectorized parse_date for a column of YYYY-MM-DD strings'''
+    dates = pd.to_datetime(column, format='%Y-%m-%d', errors='coerce')
+    return pd.Series([None if pd.isna(value) else value.to_pydatetime() for value in dates], index=column.index, dtype=object)
+
+def to_float_column(column: pd.Series) -> pd.Series:
+    '''Vectorized parse_float for a column of numeric strings'''
+    numbers = pd.to_numeric(column, errors='coerce')
+    numbers = numbers.where(np.isfinite(numbers))
+    return numbers.astype(object).where(numbers.notna(), None)
+
+def to_int_column(column: pd.Series) -> pd.Series:
+    '''Vectorized parse_int for a column of numeric strings'''
+    numbers = pd.to_numeric(column, errors='coerce')
+    numbers = numbers.where(np.isfinite(numbers)).round().astype('Int64')
+    return numbers.astype(object).where(numbers.notna(), None)
 
-    try:
-        db = DB()
-    except:
-        print('Could not connect to the DB')
-        resp = jsonify({
-            'msg': 'Could not connect to the DB',
-            'error': True,
-            'data': None            
-        })
-        resp.status_code = HTTPStatus.INTERNAL_SERVER_ERROR
-        return resp
-
-    funds = Fund.objects(CNPJ=fund_cnpj)
-    if not funds or len(funds) != 1:
-        print(f'---> Fund {cnpj} not found')
-        resp = jsonify({
-            'msg': f'Fund {cnpj} ({fund_cnpj}) not found',
-            'error': True,
-            'data': [cnpj]
-        })
-        resp.status_code = HTTPStatus.NOT_FOUND
-        return resp
-    
-    for record in funds:
-        fund = record.to_mongo().to_dict()
-        fund['_id'] = str(fund['_id'])
-        resp = jsonify({
-            'msg': f'Fund: {fund["CNPJ"]}',
-            'records': len(funds),
-            'data': fund
-        })
-        return resp
 
 if __name__ == '__main__':
     # print(ascii_letters)
@@ -0,0 +1,32 @@
+import multiprocessing
+import os
+
+# The workers map the snapshot files, on tmpfs their pages are shared memory
+os.environ.setdefault('SNAPSHOT_DIR', '/dev/shm/br_funds')
+
+wsgi_app = 'br_funds:create_app()'
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:80')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+_writer = None
+
+def on_starting(server):
+    '''
+        Starts the snapshot writer before the workers are forked and waits for its
+        first snapshot. It is a spawned process, so the master never opens a
+        MongoClient that the forked workers would inherit.
+    '''
+    global _writer
+    from br_funds.snapshot import run_writer
+
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    _writer = context.Process(target=run_writer, args=(ready,), name='br_funds-snapshot', daemon=True)
+    _writer.start()
+    if not ready.wait(int(os.getenv('SNAPSHOT_START_TIMEOUT', 120))):
+        server.log.warning('The first snapshot is not ready, the workers will load their own cadastro')
+
+def on_exit(server):
+    if _writer is not None and _writer.is_alive():
+        _writer.terminate()